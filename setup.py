@@ -35,7 +35,7 @@ setup(
     packages=('txrudp', 'tests'),
     install_requires=('enum34', 'protobuf', 'twisted'),
     extras_require={
-        'crypto': ('pynacl',)
+        'crypto': ('pynacl>=1.0.1',)
     },
     tests_require=('coverage', 'nose', 'mock'),
     test_suite='nose.collector',
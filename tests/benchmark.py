@@ -1,10 +1,20 @@
 #! /usr/bin/env python
 
 import collections
+import multiprocessing
+import Queue
 import random
+import resource
+import sys
 import time
 
-from txrudp import rudp, constants, connection
+from nacl import public, utils
+from twisted.internet import protocol
+from twisted.python import threadpool
+
+from txrudp import (
+    rudp, constants, connection, crypto_connection, mmsg, packet
+)
 
 
 class StubHandler(connection.Handler):
@@ -106,6 +116,315 @@ class BadConnectionMultiplexer(rudp.ConnectionMultiplexer):
             super(BadConnectionMultiplexer, self).send_datagram(datagram, addr)
 
 
+class NullConnectionMultiplexer(object):
+
+    """Stand-in protocol that drops every outbound datagram."""
+
+    def send_datagram(self, datagram, addr):
+        pass
+
+
+def benchmark_retransmission_timers(count, shared, rounds=10):
+    """
+    Run `count` connections with full send windows on the reactor.
+
+    Every round, half of the packets in flight on each connection are
+    ACKed, so that both ACK processing and retransmissions are
+    exercised. Must run in a fresh process, as it runs the reactor.
+
+    Returns:
+        Tuple of (CPU seconds, live timers with full windows,
+        peak RSS in KiB).
+    """
+    proto = NullConnectionMultiplexer()
+    own_addr = ('127.0.0.1', 12345)
+    cons = []
+    result = {}
+
+    def setup():
+        for i in range(count):
+            dest_addr = ('127.0.0.2', 1024 + i)
+            con = connection.Connection(
+                proto,
+                StubHandler(),
+                own_addr,
+                dest_addr,
+                shared_retransmission_timer=shared
+            )
+            syn_packet = packet.Packet.from_data(
+                1,
+                own_addr,
+                dest_addr,
+                syn=True
+            )
+            con.receive_packet(syn_packet, dest_addr)
+            for _ in range(2 * constants.WINDOW_SIZE):
+                con.send_message('a')
+            cons.append(con)
+
+    def ack_round(remaining):
+        if remaining == rounds:
+            result['timers'] = len(connection.REACTOR.getDelayedCalls())
+        for con in cons:
+            window = con._sending_window
+            if window:
+                seqnums = list(window)
+                ack_packet = packet.Packet.from_data(
+                    0,
+                    own_addr,
+                    con.dest_addr,
+                    ack=seqnums[len(seqnums) // 2]
+                )
+                con.receive_packet(ack_packet, con.dest_addr)
+        if remaining:
+            connection.REACTOR.callLater(
+                constants.PACKET_TIMEOUT / 2,
+                ack_round,
+                remaining - 1
+            )
+        else:
+            connection.REACTOR.stop()
+
+    connection.REACTOR.callWhenRunning(setup)
+    connection.REACTOR.callLater(1, ack_round, rounds)
+    connection.REACTOR.run()
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime, result['timers'], usage.ru_maxrss
+
+
+def _run_timer_benchmark(args):
+    return benchmark_retransmission_timers(*args)
+
+
+def main_timers(count=10000):
+    for shared in (False, True):
+        # A fresh process per run keeps peak RSS figures independent.
+        pool = multiprocessing.Pool(1)
+        cpu, timers, rss = pool.apply(_run_timer_benchmark, ((count, shared),))
+        pool.close()
+        pool.join()
+        print """{0} retransmission timer, {1} connections:
+    CPU time: {2:.2f} seconds
+    Live timers with full windows: {3}
+    Peak RSS: {4} KiB
+    """.format(
+            'Shared' if shared else 'Per-packet', count, cpu, timers, rss
+        )
+
+
+def benchmark_crypto(threads, batches=200, batch_size=constants.WINDOW_SIZE):
+    """
+    Encrypt and decrypt full-size segments in batches.
+
+    Batches are processed inline if `threads` is 0, or on a thread
+    pool of that size otherwise, as CryptoConnection does with a
+    crypto thread pool.
+
+    Returns:
+        The number of segments processed per (wall clock) second.
+    """
+    box = public.Box(
+        public.PrivateKey.generate(),
+        public.PrivateKey.generate().public_key
+    )
+    nonce = utils.random(public.Box.NONCE_SIZE)
+    payload = constants.UDP_SAFE_SEGMENT_SIZE * b'a'
+
+    def process_batch():
+        for _ in range(batch_size):
+            box.decrypt(box.encrypt(payload, nonce))
+
+    start = time.time()
+    if threads:
+        pool = threadpool.ThreadPool(threads, threads)
+        pool.start()
+        done = Queue.Queue()
+        for _ in range(batches):
+            pool.callInThreadWithCallback(
+                lambda success, result: done.put(success),
+                process_batch
+            )
+        for _ in range(batches):
+            done.get()
+        pool.stop()
+    else:
+        for _ in range(batches):
+            process_batch()
+    return batches * batch_size / (time.time() - start)
+
+
+def main_crypto(max_threads=multiprocessing.cpu_count()):
+    inline = benchmark_crypto(0)
+    print 'Inline: {0:.0f} segments/second'.format(inline)
+    threads = 1
+    while threads <= max_threads:
+        rate = benchmark_crypto(threads)
+        print '{0} threads: {1:.0f} segments/second ({2:.2f}x)'.format(
+            threads, rate, rate / inline
+        )
+        threads *= 2
+
+
+def benchmark_connection_setup(count, pooled):
+    """
+    Create `count` CryptoConnections at once through a factory.
+
+    With `pooled`, the factory draws from a KeyPool that was filled
+    beforehand, as it would be during idle reactor time.
+
+    Returns:
+        The number of connections created per second.
+    """
+    key_pool = None
+    if pooled:
+        key_pool = crypto_connection.KeyPool(size=count, batch_size=count)
+        key_pool._refill(count)
+    factory = crypto_connection.CryptoConnectionFactory(
+        StubHandlerFactory(),
+        key_pool=key_pool
+    )
+    proto = NullConnectionMultiplexer()
+    own_addr = ('127.0.0.1', 12345)
+
+    start = time.time()
+    for i in range(count):
+        factory.make_new_connection(
+            proto,
+            own_addr,
+            ('127.0.0.2', 1024 + i),
+            None
+        )
+    return count / (time.time() - start)
+
+
+def _run_setup_benchmark(args):
+    return benchmark_connection_setup(*args)
+
+
+def main_keys(count=5000):
+    for pooled in (False, True):
+        # A fresh process per run keeps the timers of the connections
+        # of one run from slowing down the other.
+        pool = multiprocessing.Pool(1)
+        rate = pool.apply(_run_setup_benchmark, ((count, pooled),))
+        pool.close()
+        pool.join()
+        print '{0}: {1:.0f} connections/second'.format(
+            'Key pool' if pooled else 'No key pool', rate
+        )
+
+
+class CountingProtocol(protocol.DatagramProtocol):
+
+    """Protocol counting the datagrams it receives."""
+
+    def __init__(self):
+        self.received_count = 0
+        self.last_received_at = None
+
+    def datagramReceived(self, datagram, addr):
+        self.received_count += 1
+        self.last_received_at = time.time()
+
+
+def _count_calls(counts, name, f):
+    """Wrap `f` so that its calls are counted in `counts[name]`."""
+    def counted(*args):
+        counts[name] += 1
+        return f(*args)
+    return counted
+
+
+def benchmark_socket_io(batched, count=200000, size=100, burst=64):
+    """
+    Send `count` datagrams of `size` bytes over the loopback interface.
+
+    The sender writes `burst` datagrams per reactor iteration, as a
+    busy ConnectionMultiplexer would, through a udp.Port or, with
+    `batched`, an mmsg.MMsgPort; so does the receiver read.
+
+    Returns:
+        A tuple of the number of datagrams received per second and
+        a dict of the number of socket system calls made, by name.
+    """
+    reactor = connection.REACTOR
+    counts = collections.Counter()
+    if batched:
+        mmsg._recvmmsg = _count_calls(counts, 'recvmmsg', mmsg._recvmmsg)
+        mmsg._sendmmsg = _count_calls(counts, 'sendmmsg', mmsg._sendmmsg)
+        listen = mmsg.listen_udp
+    else:
+        listen = reactor.listenUDP
+
+    receiver = CountingProtocol()
+    receiver_port = listen(0, receiver, '127.0.0.1')
+    sender_port = listen(0, protocol.DatagramProtocol(), '127.0.0.1')
+    if not batched:
+        receiver_port.socket.recvfrom = _count_calls(
+            counts,
+            'recvfrom',
+            receiver_port.socket.recvfrom
+        )
+        sender_port.socket.sendto = _count_calls(
+            counts,
+            'sendto',
+            sender_port.socket.sendto
+        )
+
+    addr = ('127.0.0.1', receiver_port.getHost().port)
+    datagram = size * b'a'
+    state = {'sent': 0}
+
+    def send_burst():
+        for _ in range(min(burst, count - state['sent'])):
+            sender_port.write(datagram, addr)
+        state['sent'] += burst
+        if state['sent'] < count:
+            reactor.callLater(0, send_burst)
+        else:
+            reactor.callLater(0.5, check_done)
+
+    def check_done():
+        if time.time() - receiver.last_received_at < 0.5:
+            reactor.callLater(0.5, check_done)
+        else:
+            reactor.stop()
+
+    start = time.time()
+    reactor.callLater(0, send_burst)
+    reactor.run()
+    rate = receiver.received_count / (receiver.last_received_at - start)
+    return rate, dict(counts)
+
+
+def _run_socket_io_benchmark(args):
+    return benchmark_socket_io(*args)
+
+
+def main_mmsg(count=200000):
+    for batched in (False, True):
+        # The reactor cannot be restarted, so each run gets a process.
+        pool = multiprocessing.Pool(1)
+        rate, counts = pool.apply(
+            _run_socket_io_benchmark,
+            ((batched, count),)
+        )
+        pool.close()
+        pool.join()
+        print """{0}, {1} datagrams:
+    Throughput: {2:.0f} datagrams/second
+    System calls: {3}
+    """.format(
+            'recvmmsg/sendmmsg' if batched else 'recvfrom/sendto',
+            count,
+            rate,
+            ', '.join(
+                '{0} {1}'.format(n, name) for name, n in sorted(counts.items())
+            )
+        )
+
+
 def main():
     cf = connection.CryptoConnectionFactory(StubHandlerFactory())
     cm = BadConnectionMultiplexer(cf, '127.0.0.1', relaying=False)
@@ -128,4 +447,13 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    if sys.argv[1:] == ['timers']:
+        main_timers()
+    elif sys.argv[1:] == ['crypto']:
+        main_crypto()
+    elif sys.argv[1:] == ['keys']:
+        main_keys()
+    elif sys.argv[1:] == ['mmsg']:
+        main_mmsg()
+    else:
+        main()
@@ -1,5 +1,9 @@
+import gc
+import mmap
+import tempfile
+
 import mock
-from twisted.internet import reactor, task
+from twisted.internet import defer, error, reactor, task
 from twisted.trial import unittest
 
 from txrudp import connection, constants, packet, rudp
@@ -54,7 +58,9 @@ class TestScheduledPacketAPI(unittest.TestCase):
             ('213.54.76.98', 54321)
         ).to_bytes()
         timeout = 0.7
-        timeout_cb = reactor.callLater(timeout, lambda: None)
+        # The repr of a DelayedCall shows the time left, so it is
+        # only stable on a Clock.
+        timeout_cb = task.Clock().callLater(timeout, lambda: None)
         sp = self.spclass(datagram, timeout, timeout_cb, retries=10)
 
         self.assertEqual(
@@ -80,7 +86,8 @@ class TestConnectionAPI(unittest.TestCase):
 
     def setUp(self):
         self.clock = task.Clock()
-        connection.REACTOR.callLater = self.clock.callLater
+        self.patch(connection.REACTOR, 'callLater', self.clock.callLater)
+        self.patch(connection.REACTOR, 'seconds', self.clock.seconds)
 
         self.proto_mock = mock.Mock(spec_set=rudp.ConnectionMultiplexer)
         self.handler_mock = mock.Mock(spec_set=connection.Handler)
@@ -94,6 +101,11 @@ class TestConnectionAPI(unittest.TestCase):
     def tearDown(self):
         self.con.shutdown()
 
+        # Messages pending on shutdown fail, but most tests ignore
+        # their Deferreds.
+        gc.collect()
+        self.flushLoggedErrors(error.ConnectionDone, error.ConnectionLost)
+
     def test_default_init(self):
         self.assertEqual(self.con.handler, self.handler_mock)
         self.assertEqual(self.con.own_addr, self.own_addr)
@@ -144,13 +156,36 @@ class TestConnectionAPI(unittest.TestCase):
         self.handler_mock.handle_shutdown.assert_called_once_with()
 
     def test_send_syn_during_connecting(self):
-        self.clock.advance(0)
-        connection.REACTOR.runUntilCurrent()
+        send_times = []
+        self.proto_mock.send_datagram.side_effect = (
+            lambda *args: send_times.append(self.clock.seconds())
+        )
 
-        self._advance_to_fin()
+        # Without jitter, SYN retransmissions back off exactly, until
+        # the handshake deadline sends the FIN packet.
+        expected_times = [0]
+        timeout = constants.PACKET_TIMEOUT
+        while expected_times[-1] + timeout < constants.HANDSHAKE_TIMEOUT:
+            expected_times.append(expected_times[-1] + timeout)
+            timeout = min(
+                timeout * constants.SYN_BACKOFF_FACTOR,
+                constants.MAX_SYN_TIMEOUT
+            )
+        expected_times.append(constants.HANDSHAKE_TIMEOUT)
+
+        with mock.patch.object(connection.random, 'uniform', return_value=1):
+            self.clock.advance(0)
+            for prev_time, time in zip(expected_times, expected_times[1:]):
+                self.clock.advance(time - prev_time)
+
+            # Trap any calls after shutdown.
+            self.clock.advance(100 * constants.PACKET_TIMEOUT)
+
+        self.assertEqual(len(send_times), len(expected_times))
+        for send_time, expected_time in zip(send_times, expected_times):
+            self.assertAlmostEqual(send_time, expected_time)
 
         m_calls = self.proto_mock.send_datagram.call_args_list
-        self.assertEqual(len(m_calls), constants.MAX_RETRANSMISSIONS + 1)
 
         first_syn_call = m_calls[0]
         syn_packet = packet.Packet.from_bytes(first_syn_call[0][0])
@@ -181,6 +216,40 @@ class TestConnectionAPI(unittest.TestCase):
         self.assertEqual(m_calls[-1][0][0], expected_fin_packet)
         self.assertEqual(m_calls[-1][0][1], address)
 
+    def test_syn_backoff_during_connecting(self):
+        send_times = []
+        self.proto_mock.send_datagram.side_effect = (
+            lambda *args: send_times.append(self.clock.seconds())
+        )
+
+        with mock.patch.object(connection.random, 'uniform', return_value=1):
+            self.clock.advance(0)
+            self.clock.pump([0.1] * int(constants.HANDSHAKE_TIMEOUT * 10))
+
+        # The SYN retransmission timeout doubles each time.
+        gaps = [b - a for a, b in zip(send_times[:-2], send_times[1:-1])]
+        self.assertAlmostEqual(gaps[0], constants.PACKET_TIMEOUT)
+        for prev_gap, gap in zip(gaps, gaps[1:]):
+            self.assertAlmostEqual(
+                gap,
+                min(
+                    prev_gap * constants.SYN_BACKOFF_FACTOR,
+                    constants.MAX_SYN_TIMEOUT
+                )
+            )
+
+    def test_handshake_timeout_during_connecting(self):
+        self.clock.advance(0)
+        self.clock.advance(constants.HANDSHAKE_TIMEOUT)
+
+        self.assertEqual(self.con.state, connection.State.SHUTDOWN)
+        self.assertEqual(
+            self.con.shutdown_reason,
+            connection.ShutdownReason.HANDSHAKE_TIMEOUT
+        )
+        self.assertIsNone(self.con.handshake_duration)
+        self.handler_mock.handle_shutdown.assert_called_once_with()
+
     def _advance_to_fin(self):
         for _ in range(constants.MAX_RETRANSMISSIONS):
             # Each advance forces a SYN packet retransmission.
@@ -195,7 +264,9 @@ class TestConnectionAPI(unittest.TestCase):
 
     def test_send_casual_during_connecting(self):
         self.con.send_message('Yellow Submarine')
-        self.clock.advance(100 * constants.PACKET_TIMEOUT)
+        self.clock.advance(
+            constants.HANDSHAKE_TIMEOUT - constants.PACKET_TIMEOUT
+        )
         connection.REACTOR.runUntilCurrent()
         m_calls = self.proto_mock.send_datagram.call_args_list
         self.assertEqual(len(m_calls), 1)
@@ -215,6 +286,10 @@ class TestConnectionAPI(unittest.TestCase):
 
         self.assertEqual(self.con.state, connection.State.SHUTDOWN)
         self.handler_mock.handle_shutdown.assert_called_once_with()
+        self.assertEqual(
+            self.con.shutdown_reason,
+            connection.ShutdownReason.REMOTE
+        )
 
     def test_receive_ack_during_connecting(self):
         pass
@@ -228,10 +303,59 @@ class TestConnectionAPI(unittest.TestCase):
             syn=True
         )
 
+        self.clock.advance(0.25)
         self.con.receive_packet(remote_syn_packet, self.con.relay_addr)
         self.clock.advance(0)
         connection.REACTOR.runUntilCurrent()
         self.assertEqual(self.con.state, connection.State.CONNECTED)
+        self.assertEqual(self.con.handshake_duration, 0.25)
+
+        # The handshake deadline no longer applies.
+        self.clock.advance(constants.HANDSHAKE_TIMEOUT)
+        self.assertEqual(self.con.state, connection.State.CONNECTED)
+
+    def _sent_syn_packets(self):
+        sent_packets = (
+            packet.Packet.from_bytes(call[0][0])
+            for call in self.proto_mock.send_datagram.call_args_list
+        )
+        return [sent_packet for sent_packet in sent_packets if sent_packet.syn]
+
+    def test_receive_cookie_during_connecting(self):
+        self.clock.advance(0)
+        syn_seqnum = self._sent_syn_packets()[0].sequence_number
+
+        for ack in (0, syn_seqnum):
+            # A cookie not acknowledging the SYN packet is ignored.
+            bad_cookie_packet = packet.Packet.from_data(
+                0,
+                self.con.own_addr,
+                self.con.dest_addr,
+                ack=ack,
+                cookie=b'bad cookie'
+            )
+            self.con.receive_packet(bad_cookie_packet, self.con.relay_addr)
+        self.assertEqual(len(self._sent_syn_packets()), 1)
+
+        cookie_packet = packet.Packet.from_data(
+            0,
+            self.con.own_addr,
+            self.con.dest_addr,
+            ack=syn_seqnum + 1,
+            cookie=b'cookie'
+        )
+        self.con.receive_packet(cookie_packet, self.con.relay_addr)
+        self.assertEqual(self.con.state, connection.State.CONNECTING)
+
+        # The SYN packet is sent again at once, and retransmitted,
+        # with the cookie.
+        self.assertEqual(len(self._sent_syn_packets()), 2)
+        self.clock.advance(constants.MAX_SYN_TIMEOUT)
+        syn_packets = self._sent_syn_packets()
+        self.assertGreater(len(syn_packets), 2)
+        for syn_packet in syn_packets[1:]:
+            self.assertEqual(syn_packet.sequence_number, syn_seqnum)
+            self.assertEqual(syn_packet.cookie, b'cookie')
 
     def test_receive_synack_during_connecting(self):
         remote_synack_packet = packet.Packet.from_data(
@@ -351,13 +475,461 @@ class TestConnectionAPI(unittest.TestCase):
                 self.con.own_addr,
                 ack=self.next_remote_seqnum,
                 payload=payload * constants.UDP_SAFE_SEGMENT_SIZE,
-                more_fragments=2 - i
+                more_fragments=2 - i,
+                fragment_count=3
             ).to_bytes()
             for i, payload in zip(range(3), b'abc')
         )
 
         self.assertEqual(sent_casual_datagrams, expected_casual_datagrams)
 
+    def _sent_casual_payloads(self):
+        return tuple(
+            packet.Packet.from_bytes(datagram).payload
+            for datagram in self._sent_casual_datagrams()
+        )
+
+    def test_send_buffer_during_connected(self):
+        self._connecting_to_connected()
+
+        buf = bytearray(b'a' * (2 * constants.UDP_SAFE_SEGMENT_SIZE + 1))
+        self.con.send_buffer(buf)
+        self.clock.advance(0)
+
+        self.assertEqual(
+            self._sent_casual_payloads(),
+            (
+                b'a' * constants.UDP_SAFE_SEGMENT_SIZE,
+                b'a' * constants.UDP_SAFE_SEGMENT_SIZE,
+                b'a'
+            )
+        )
+
+    def test_send_file_during_connected(self):
+        self._connecting_to_connected()
+
+        contents = b'a' * constants.UDP_SAFE_SEGMENT_SIZE + b'b'
+        with tempfile.TemporaryFile() as f:
+            f.write(contents)
+            f.flush()
+            self.con.send_file(f)
+        self.clock.advance(0)
+
+        self.assertEqual(
+            self._sent_casual_payloads(),
+            (b'a' * constants.UDP_SAFE_SEGMENT_SIZE, b'b')
+        )
+
+        with tempfile.TemporaryFile() as f:
+            self.assertIsNone(self.successResultOf(self.con.send_file(f)))
+
+    def test_timer_follows_earliest_deadline(self):
+        self._connecting_to_connected()
+        self.con.send_message(b'a')
+        self.con.send_message(b'b')
+        self.clock.advance(0)
+        self.clock.advance(constants.PACKET_TIMEOUT / 2)
+        self.con.send_message(b'c')
+        self.clock.advance(0)
+
+        # Once 'a' and 'b' are resent, 'c' is the first packet due,
+        # although 'b' is the oldest one left after 'a' is ACKed.
+        self.clock.advance(constants.PACKET_TIMEOUT / 2)
+        remote_ack_packet = packet.Packet.from_data(
+            0,
+            self.con.own_addr,
+            self.con.dest_addr,
+            ack=self.next_seqnum + 1
+        )
+        self.con.receive_packet(remote_ack_packet, self.con.relay_addr)
+
+        self.proto_mock.reset_mock()
+        self.clock.advance(constants.PACKET_TIMEOUT / 2)
+        self.assertEqual(self._sent_casual_payloads(), (b'c',))
+
+    def test_send_messages_during_connected(self):
+        self._connecting_to_connected()
+
+        d = self.con.send_messages([b'a', b'', b'b', b'c'])
+        self.clock.advance(0)
+        self.assertEqual(self._sent_casual_payloads(), (b'a', b'b', b'c'))
+
+        self.assertNoResult(d)
+        remote_ack_packet = packet.Packet.from_data(
+            0,
+            self.con.own_addr,
+            self.con.dest_addr,
+            ack=self.next_seqnum + 3
+        )
+        self.con.receive_packet(remote_ack_packet, self.con.relay_addr)
+        self.assertEqual(self.successResultOf(d), [None] * 4)
+
+    def test_send_high_priority_message_during_connected(self):
+        self._connecting_to_connected()
+
+        # The first burst of segments of a big message is sent in the
+        # first iteration; the message then occupies the queue while
+        # the others arrive.
+        big_message = b'a' * (
+            constants.SEND_BURST_SIZE * constants.UDP_SAFE_SEGMENT_SIZE + 1
+        )
+        self.con.send_message(big_message)
+        self.con._dequeue_outbound_message()
+        self.con.send_message(b'normal')
+        self.con.send_message(b'low', connection.Priority.LOW)
+        self.con.send_message(b'high', connection.Priority.HIGH)
+        self.clock.advance(0)
+
+        sent_payloads = tuple(
+            packet.Packet.from_bytes(datagram).payload
+            for datagram in self._sent_casual_datagrams()
+        )
+        self.assertEqual(
+            sent_payloads,
+            constants.SEND_BURST_SIZE * (
+                b'a' * constants.UDP_SAFE_SEGMENT_SIZE,
+            ) + (
+                b'a',
+                b'high',
+                b'normal',
+                b'low'
+            )
+        )
+
+    def test_finalize_burst_in_one_batch_during_connected(self):
+        self._connecting_to_connected()
+
+        finalize_patcher = mock.patch.object(
+            self.con,
+            '_finalize_packets',
+            wraps=self.con._finalize_packets
+        )
+        finalize_mock = finalize_patcher.start()
+        self.addCleanup(finalize_patcher.stop)
+
+        for i in range(constants.SEND_BURST_SIZE + 1):
+            self.con.send_message(str(i))
+        self.clock.advance(0)
+
+        self.assertEqual(
+            [len(call[0][0]) for call in finalize_mock.call_args_list],
+            [constants.SEND_BURST_SIZE, 1]
+        )
+        self.assertEqual(
+            len(self._sent_casual_datagrams()),
+            constants.SEND_BURST_SIZE + 1
+        )
+
+    def test_send_burst_by_priority_during_connected(self):
+        self._connecting_to_connected()
+
+        # Messages queued in the same iteration are dequeued together
+        # in the next one, by priority.
+        self.con.send_message(b'normal')
+        self.con.send_message(b'low', connection.Priority.LOW)
+        self.con.send_message(b'high', connection.Priority.HIGH)
+        self.clock.advance(0)
+
+        sent_payloads = tuple(
+            packet.Packet.from_bytes(datagram).payload
+            for datagram in self._sent_casual_datagrams()
+        )
+        self.assertEqual(sent_payloads, (b'high', b'normal', b'low'))
+
+    def test_acknowledge_message_during_connected(self):
+        self._connecting_to_connected()
+
+        big_message = b'a' * (constants.UDP_SAFE_SEGMENT_SIZE + 1)
+        d1 = self.con.send_message(big_message)
+        d2 = self.con.send_message(b'b')
+        self.clock.advance(0)
+
+        def make_ack_packet(ack):
+            return packet.Packet.from_data(
+                0,
+                self.con.own_addr,
+                self.con.dest_addr,
+                ack=ack
+            )
+
+        # The first message is only confirmed with its last segment.
+        self.con.receive_packet(
+            make_ack_packet(self.next_seqnum + 1),
+            self.con.relay_addr
+        )
+        self.assertNoResult(d1)
+        self.con.receive_packet(
+            make_ack_packet(self.next_seqnum + 2),
+            self.con.relay_addr
+        )
+        self.assertIsNone(self.successResultOf(d1))
+        self.assertNoResult(d2)
+
+        self.con.shutdown()
+        self.failureResultOf(d2, error.ConnectionDone)
+
+    def test_fail_pending_messages_on_timeout(self):
+        self._connecting_to_connected()
+
+        d1 = self.assertFailure(
+            self.con.send_message(b'a'),
+            error.ConnectionLost
+        )
+        self.con.send_message(b'b', connection.Priority.LOW)
+        d2 = self.assertFailure(
+            self.con.send_message(b'c', connection.Priority.LOW),
+            error.ConnectionLost
+        )
+        self._advance_to_fin()
+
+        self.assertEqual(
+            self.con.shutdown_reason,
+            connection.ShutdownReason.TIMEOUT
+        )
+        self.successResultOf(d1)
+        self.successResultOf(d2)
+
+    def test_late_errback_sees_failure(self):
+        self._connecting_to_connected()
+        d = self.con.send_message(b'a')
+        self.con.shutdown()
+        self.failureResultOf(d, error.ConnectionDone)
+
+    def test_write_traps_shutdown_failure(self):
+        self._connecting_to_connected()
+        self.con.write(b'a')
+        self.con.shutdown()
+        gc.collect()
+        self.assertEqual(self.flushLoggedErrors(error.ConnectionDone), [])
+
+    def test_cancel_queued_message_during_connected(self):
+        self._connecting_to_connected()
+
+        big_message = b'a' * (constants.UDP_SAFE_SEGMENT_SIZE + 1)
+        d1 = self.con.send_message(big_message)
+        d2 = self.assertFailure(
+            self.con.send_message(b'b'),
+            defer.CancelledError
+        )
+        d3 = self.con.send_message(b'c')
+        d2.cancel()
+        self.clock.advance(0)
+
+        sent_payloads = tuple(
+            packet.Packet.from_bytes(datagram).payload
+            for datagram in self._sent_casual_datagrams()
+        )
+        self.assertEqual(
+            sent_payloads,
+            (b'a' * constants.UDP_SAFE_SEGMENT_SIZE, b'a', b'c')
+        )
+        self.assertNoResult(d1)
+        self.successResultOf(d2)
+        self.assertNoResult(d3)
+
+    def test_drop_expired_message_during_connected(self):
+        self._connecting_to_connected()
+
+        big_message = b'a' * (constants.UDP_SAFE_SEGMENT_SIZE + 1)
+        self.con.send_message(big_message)
+        d = self.assertFailure(
+            self.con.send_message(b'b', deadline=0),
+            defer.TimeoutError
+        )
+        self.clock.advance(0)
+
+        self.assertEqual(len(self._sent_casual_datagrams()), 2)
+        self.successResultOf(d)
+
+    def _acknowledge_sent_packets(self):
+        remote_ack_packet = packet.Packet.from_data(
+            0,
+            self.con.own_addr,
+            self.con.dest_addr,
+            ack=self.con._next_sequence_number
+        )
+        self.con.receive_packet(remote_ack_packet, self.con.relay_addr)
+        self.clock.advance(0)
+
+    def test_push_producer_during_connected(self):
+        self._connecting_to_connected()
+
+        producer = mock.Mock()
+        self.con.registerProducer(producer, True)
+        self.assertRaises(
+            RuntimeError,
+            self.con.registerProducer,
+            mock.Mock(),
+            True
+        )
+
+        # Nothing is dequeued before the next reactor iteration.
+        self.con.write(b'a' * constants.SEND_HIGH_WATERMARK)
+        producer.pauseProducing.assert_not_called()
+        self.con.write(b'b' * (constants.UDP_SAFE_SEGMENT_SIZE + 1))
+        producer.pauseProducing.assert_called_once_with()
+
+        self.clock.advance(0)
+        while not producer.resumeProducing.called:
+            self._acknowledge_sent_packets()
+        self.assertLessEqual(
+            self.con._queued_bytes,
+            constants.SEND_LOW_WATERMARK
+        )
+
+        self.con.shutdown()
+        producer.stopProducing.assert_called_once_with()
+
+    def test_pull_producer_during_connected(self):
+        self._connecting_to_connected()
+
+        producer = mock.Mock()
+        self.con.registerProducer(producer, False)
+        producer.resumeProducing.assert_called_once_with()
+
+        producer.resumeProducing.reset_mock()
+        self.con.write(b'a' * (constants.UDP_SAFE_SEGMENT_SIZE + 1))
+        producer.resumeProducing.assert_not_called()
+        self.clock.advance(0)
+        producer.resumeProducing.assert_called_once_with()
+
+        self.con.unregisterProducer()
+        self.con.shutdown()
+        producer.stopProducing.assert_not_called()
+
+    def test_respect_remote_window_during_connected(self):
+        self._connecting_to_connected()
+
+        remote_ack_packet = packet.Packet.from_data(
+            0,
+            self.con.own_addr,
+            self.con.dest_addr,
+            ack=self.next_seqnum,
+            window=2
+        )
+        self.con.receive_packet(remote_ack_packet, self.con.relay_addr)
+        for i in range(5):
+            self.con.send_message(str(i))
+        self.clock.advance(0)
+        self.assertEqual(len(self._sent_casual_datagrams()), 2)
+
+        remote_ack_packet = packet.Packet.from_data(
+            0,
+            self.con.own_addr,
+            self.con.dest_addr,
+            ack=self.next_seqnum + 2
+        )
+        self.con.receive_packet(remote_ack_packet, self.con.relay_addr)
+        self.clock.advance(0)
+        self.assertEqual(len(self._sent_casual_datagrams()), 5)
+
+    def test_pause_receiving_during_connected(self):
+        self._connecting_to_connected()
+
+        # The packet beyond the receive buffer is dropped.
+        self.con.pauseProducing()
+        for i in range(constants.RECEIVE_BUFFER_SIZE + 1):
+            remote_casual_packet = packet.Packet.from_data(
+                self.next_remote_seqnum + i,
+                self.con.own_addr,
+                self.con.dest_addr,
+                payload=str(i),
+                ack=self.next_seqnum
+            )
+            self.con.receive_packet(remote_casual_packet, self.con.relay_addr)
+        self.clock.advance(constants.BARE_ACK_TIMEOUT)
+        self.handler_mock.receive_message.assert_not_called()
+
+        last_packet = packet.Packet.from_bytes(
+            self.proto_mock.send_datagram.call_args[0][0]
+        )
+        self.assertEqual(
+            last_packet.ack,
+            self.next_remote_seqnum + constants.RECEIVE_BUFFER_SIZE
+        )
+        self.assertEqual(last_packet.window, 0)
+        self.assertEqual(
+            self.con._buffered_packets,
+            constants.RECEIVE_BUFFER_SIZE
+        )
+
+        # Once the window reopens, the remote host is told at once,
+        # and again until it sends something.
+        self.proto_mock.reset_mock()
+        self.con.resumeProducing()
+        self.clock.advance(0)
+        self.assertEqual(
+            self.handler_mock.receive_message.call_count,
+            constants.RECEIVE_BUFFER_SIZE
+        )
+        expected_ack_packet = packet.Packet.from_data(
+            0,
+            self.con.dest_addr,
+            self.con.own_addr,
+            ack=self.next_remote_seqnum + constants.RECEIVE_BUFFER_SIZE
+        ).to_bytes()
+        self.proto_mock.send_datagram.assert_called_once_with(
+            expected_ack_packet,
+            self.con.relay_addr
+        )
+        self.clock.advance(constants.PACKET_TIMEOUT)
+        self.assertEqual(
+            self.proto_mock.send_datagram.call_args_list,
+            [mock.call(expected_ack_packet, self.con.relay_addr)] * 2
+        )
+
+    def _sent_casual_datagrams(self):
+        sent_packets = tuple(
+            packet.Packet.from_bytes(call[0][0])
+            for call in self.proto_mock.send_datagram.call_args_list
+        )
+        return tuple(
+            sent_packet.to_bytes()
+            for sent_packet in sent_packets
+            if sent_packet.payload and not (sent_packet.syn or sent_packet.fin)
+        )
+
+    def _acknowledge_first_message(self, rtt):
+        self.con.send_message(b'Yellow Submarine')
+        self.clock.advance(0)
+        self.clock.advance(rtt)
+
+        remote_ack_packet = packet.Packet.from_data(
+            0,
+            self.con.own_addr,
+            self.con.dest_addr,
+            ack=self.next_seqnum + 1
+        )
+        self.con.receive_packet(remote_ack_packet, self.con.relay_addr)
+        self.proto_mock.reset_mock()
+        self.next_seqnum += 1
+
+    def test_send_tail_loss_probe_during_connected(self):
+        self._connecting_to_connected()
+        rtt = 0.05
+        self._acknowledge_first_message(rtt)
+
+        self.con.send_message(b'Blue Submarine')
+        self.clock.advance(0)
+        self.assertEqual(len(self._sent_casual_datagrams()), 1)
+
+        self.clock.advance(constants.TLP_RTT_MULTIPLIER * rtt)
+        sent_casual_datagrams = self._sent_casual_datagrams()
+        self.assertEqual(len(sent_casual_datagrams), 2)
+        self.assertEqual(sent_casual_datagrams[0], sent_casual_datagrams[1])
+
+        # A single probe is sent per tail.
+        self.clock.advance(constants.PACKET_TIMEOUT / 2)
+        self.assertEqual(len(self._sent_casual_datagrams()), 2)
+
+    def test_no_tail_loss_probe_without_rtt_estimate(self):
+        self._connecting_to_connected()
+
+        self.con.send_message(b'Yellow Submarine')
+        self.clock.advance(0)
+        self.clock.advance(constants.PACKET_TIMEOUT / 2)
+        self.assertEqual(len(self._sent_casual_datagrams()), 1)
+
     def test_send_ack_during_connected(self):
         self._connecting_to_connected()
 
@@ -443,13 +1015,55 @@ class TestConnectionAPI(unittest.TestCase):
         messages = tuple(call[0][0] for call in r_calls)
         self.assertEqual(payloads, messages)
 
-    def test_receive_fragmented_packet_during_connected(self):
-        self._connecting_to_connected()
-
-        messages = (
-            b'a' * constants.UDP_SAFE_SEGMENT_SIZE,
-            b'b' * constants.UDP_SAFE_SEGMENT_SIZE,
-            b'c' * constants.UDP_SAFE_SEGMENT_SIZE,
+    def test_receive_casual_packets_in_batch_during_connected(self):
+        self.con.shutdown()
+        self.proto_mock.reset_mock()
+        self.handler_mock = mock.Mock(spec_set=connection.BatchHandler)
+        self.con = connection.Connection(
+            self.proto_mock,
+            self.handler_mock,
+            self.own_addr,
+            self.addr1
+        )
+        self._connecting_to_connected()
+
+        payloads = (b'a', b'b', b'c', b'd')
+        remote_casual_packets = tuple(
+            packet.Packet.from_data(
+                self.next_remote_seqnum + i,
+                self.con.own_addr,
+                self.con.dest_addr,
+                payload=payload,
+                ack=self.next_seqnum,
+                stream_id=int(payload == b'c'),
+                stream_prev=self.next_remote_seqnum - 1
+            )
+            for i, payload in enumerate(payloads)
+        )
+
+        self.con.pauseProducing()
+        for p in remote_casual_packets:
+            self.con.receive_packet(p, self.con.relay_addr)
+        self.con.resumeProducing()
+        self.clock.advance(0)
+
+        # A message on another stream splits the batch.
+        self.assertEqual(
+            self.handler_mock.mock_calls,
+            [
+                mock.call.receive_messages([b'a', b'b']),
+                mock.call.receive_stream_message(1, b'c'),
+                mock.call.receive_messages([b'd']),
+            ]
+        )
+
+    def test_receive_fragmented_packet_during_connected(self):
+        self._connecting_to_connected()
+
+        messages = (
+            b'a' * constants.UDP_SAFE_SEGMENT_SIZE,
+            b'b' * constants.UDP_SAFE_SEGMENT_SIZE,
+            b'c' * constants.UDP_SAFE_SEGMENT_SIZE,
         )
         remote_casual_packets = tuple(
             packet.Packet.from_data(
@@ -473,6 +1087,514 @@ class TestConnectionAPI(unittest.TestCase):
             ''.join(messages)
         )
 
+    def test_receive_fragmented_packet_in_chunks_during_connected(self):
+        self.con.shutdown()
+        self.proto_mock.reset_mock()
+        self.handler_mock = mock.Mock(spec_set=connection.StreamingHandler)
+        self.con = connection.Connection(
+            self.proto_mock,
+            self.handler_mock,
+            self.own_addr,
+            self.addr1
+        )
+        self._connecting_to_connected()
+
+        messages = (
+            b'a' * constants.UDP_SAFE_SEGMENT_SIZE,
+            b'b' * constants.UDP_SAFE_SEGMENT_SIZE,
+            b'c' * constants.UDP_SAFE_SEGMENT_SIZE,
+        )
+        remote_casual_packets = tuple(
+            packet.Packet.from_data(
+                self.next_remote_seqnum + i,
+                self.con.own_addr,
+                self.con.dest_addr,
+                payload=payload,
+                ack=self.next_seqnum,
+                more_fragments=len(messages) - i - 1
+            )
+            for i, payload in enumerate(messages)
+        )
+
+        self.con.receive_packet(remote_casual_packets[1], self.con.relay_addr)
+        self.con.receive_packet(remote_casual_packets[0], self.con.relay_addr)
+        self.clock.advance(0)
+        self.assertEqual(
+            self.handler_mock.mock_calls,
+            [
+                mock.call.begin_message(
+                    0,
+                    3 * constants.UDP_SAFE_SEGMENT_SIZE
+                ),
+                mock.call.receive_chunk(0, messages[0]),
+                mock.call.receive_chunk(0, messages[1]),
+            ]
+        )
+
+        self.handler_mock.reset_mock()
+        self.con.receive_packet(remote_casual_packets[2], self.con.relay_addr)
+        self.clock.advance(0)
+        self.assertEqual(
+            self.handler_mock.mock_calls,
+            [
+                mock.call.receive_chunk(0, messages[2]),
+                mock.call.end_message(0),
+            ]
+        )
+
+    def test_receive_fragmented_packet_into_target_during_connected(self):
+        self.con.shutdown()
+        self.proto_mock.reset_mock()
+        self.handler_mock = mock.Mock(spec_set=connection.StreamingHandler)
+        self.con = connection.Connection(
+            self.proto_mock,
+            self.handler_mock,
+            self.own_addr,
+            self.addr1
+        )
+        self._connecting_to_connected()
+
+        target = mmap.mmap(-1, 3 * constants.UDP_SAFE_SEGMENT_SIZE)
+        self.handler_mock.open_message_target.return_value = target
+        messages = (
+            b'a' * constants.UDP_SAFE_SEGMENT_SIZE,
+            b'b' * constants.UDP_SAFE_SEGMENT_SIZE,
+            b'c' * 10,
+        )
+        remote_casual_packets = tuple(
+            packet.Packet.from_data(
+                self.next_remote_seqnum + i,
+                self.con.own_addr,
+                self.con.dest_addr,
+                payload=payload,
+                ack=self.next_seqnum,
+                more_fragments=len(messages) - i - 1,
+                fragment_count=len(messages)
+            )
+            for i, payload in enumerate(messages)
+        )
+
+        for i in (2, 0):
+            self.con.receive_packet(
+                remote_casual_packets[i],
+                self.con.relay_addr
+            )
+        self.clock.advance(0)
+        self.handler_mock.open_message_target.assert_called_once_with(
+            0,
+            3 * constants.UDP_SAFE_SEGMENT_SIZE
+        )
+        self.handler_mock.close_message_target.assert_not_called()
+
+        self.con.receive_packet(remote_casual_packets[1], self.con.relay_addr)
+        self.clock.advance(0)
+        self.handler_mock.close_message_target.assert_called_once_with(
+            0,
+            target,
+            2 * constants.UDP_SAFE_SEGMENT_SIZE + 10
+        )
+        self.assertEqual(target[:-990], ''.join(messages))
+        self.handler_mock.receive_chunk.assert_not_called()
+        self.assertEqual(self.con._buffered_packets, 0)
+
+    def test_receive_bad_fragment_count_during_connected(self):
+        self.con.shutdown()
+        self.proto_mock.reset_mock()
+        self.handler_mock = mock.Mock(spec_set=connection.StreamingHandler)
+        self.con = connection.Connection(
+            self.proto_mock,
+            self.handler_mock,
+            self.own_addr,
+            self.addr1
+        )
+        self._connecting_to_connected()
+        target = mmap.mmap(-1, 3 * constants.UDP_SAFE_SEGMENT_SIZE)
+        self.handler_mock.open_message_target.return_value = target
+
+        def make_packet(i, more_fragments, fragment_count):
+            return packet.Packet.from_data(
+                self.next_remote_seqnum + i,
+                self.con.own_addr,
+                self.con.dest_addr,
+                payload=b'a' * constants.UDP_SAFE_SEGMENT_SIZE,
+                ack=self.next_seqnum,
+                more_fragments=more_fragments,
+                fragment_count=fragment_count
+            )
+
+        self.con.receive_packet(make_packet(2, 0, 3), self.con.relay_addr)
+        self.handler_mock.open_message_target.assert_called_once_with(
+            0,
+            3 * constants.UDP_SAFE_SEGMENT_SIZE
+        )
+
+        # Segments beyond their fragment count, or disagreeing with
+        # the target of their message, are dropped.
+        for bad_packet in (
+            make_packet(0, 3, 3),
+            make_packet(0, 2, 1000),
+            make_packet(1, 1, 1000)
+        ):
+            self.con.receive_packet(bad_packet, self.con.relay_addr)
+        self.assertEqual(self.handler_mock.open_message_target.call_count, 1)
+        self.assertEqual(self.con._message_targets.values()[0].remaining, 2)
+        self.assertEqual(
+            self.con._next_expected_seqnum,
+            self.next_remote_seqnum
+        )
+
+    def test_receive_bad_segment_size_during_connected(self):
+        self.con.shutdown()
+        self.proto_mock.reset_mock()
+        self.handler_mock = mock.Mock(spec_set=connection.StreamingHandler)
+        self.con = connection.Connection(
+            self.proto_mock,
+            self.handler_mock,
+            self.own_addr,
+            self.addr1
+        )
+        self._connecting_to_connected()
+        target = mmap.mmap(-1, 3 * constants.UDP_SAFE_SEGMENT_SIZE)
+        self.handler_mock.open_message_target.return_value = target
+
+        def make_packet(i, size):
+            return packet.Packet.from_data(
+                self.next_remote_seqnum + i,
+                self.con.own_addr,
+                self.con.dest_addr,
+                payload=b'a' * size,
+                ack=self.next_seqnum,
+                more_fragments=2 - i,
+                fragment_count=3
+            )
+
+        # Segments that would overflow their slot in the target, or
+        # leave a gap in it, are dropped before they are acknowledged.
+        max_size = constants.UDP_SAFE_SEGMENT_SIZE
+        for bad_packet in (
+            make_packet(0, max_size + 1),
+            make_packet(1, max_size - 1),
+            make_packet(2, max_size + 1)
+        ):
+            self.con.receive_packet(bad_packet, self.con.relay_addr)
+        self.handler_mock.open_message_target.assert_not_called()
+        self.assertEqual(self.con._out_of_order_seqnums, set())
+        self.assertEqual(
+            self.con._next_expected_seqnum,
+            self.next_remote_seqnum
+        )
+
+        # The message still gets through once resent properly.
+        for i, size in enumerate((max_size, max_size, max_size)):
+            self.con.receive_packet(make_packet(i, size), self.con.relay_addr)
+        self.clock.advance(0)
+        self.handler_mock.close_message_target.assert_called_once_with(
+            0,
+            target,
+            3 * max_size
+        )
+
+    def test_receive_huge_fragmented_packet_during_connected(self):
+        self.con.shutdown()
+        self.proto_mock.reset_mock()
+        self.handler_mock = mock.Mock(spec_set=connection.StreamingHandler)
+        self.con = connection.Connection(
+            self.proto_mock,
+            self.handler_mock,
+            self.own_addr,
+            self.addr1
+        )
+        self._connecting_to_connected()
+
+        # No target is asked for; the message is delivered in chunks.
+        fragment_count = (
+            constants.MAX_MESSAGE_TARGET_SIZE //
+            constants.UDP_SAFE_SEGMENT_SIZE + 1
+        )
+        payload = b'a' * constants.UDP_SAFE_SEGMENT_SIZE
+        remote_casual_packet = packet.Packet.from_data(
+            self.next_remote_seqnum,
+            self.con.own_addr,
+            self.con.dest_addr,
+            payload=payload,
+            ack=self.next_seqnum,
+            more_fragments=fragment_count - 1,
+            fragment_count=fragment_count
+        )
+        self.con.receive_packet(remote_casual_packet, self.con.relay_addr)
+        self.clock.advance(0)
+        self.handler_mock.open_message_target.assert_not_called()
+        self.handler_mock.receive_chunk.assert_called_once_with(0, payload)
+
+    def test_send_stream_messages_during_connected(self):
+        self._connecting_to_connected()
+
+        self.con.send_message(b'a', stream=1)
+        self.con.send_message(b'b', stream=2)
+        self.con.send_message(b'c', stream=1)
+        self.con.send_message(b'd')
+        self.clock.advance(0)
+
+        sent_packets = tuple(
+            packet.Packet.from_bytes(datagram)
+            for datagram in self._sent_casual_datagrams()
+        )
+        syn_seqnum = self.next_seqnum - 1
+        self.assertEqual(
+            tuple((p.stream_id, p.stream_prev) for p in sent_packets),
+            (
+                (1, syn_seqnum),
+                (2, syn_seqnum),
+                (1, self.next_seqnum),
+                (0, 0)
+            )
+        )
+
+    def test_receive_stream_packets_during_connected(self):
+        self._connecting_to_connected()
+        syn_seqnum = self.next_remote_seqnum - 1
+
+        def make_packet(i, payload, **kwargs):
+            return packet.Packet.from_data(
+                self.next_remote_seqnum + i,
+                self.con.own_addr,
+                self.con.dest_addr,
+                payload=payload,
+                ack=self.next_seqnum,
+                **kwargs
+            )
+
+        # The packet of the default stream is lost for a while.
+        delayed_packet = make_packet(0, b'a')
+        remote_stream_packets = (
+            make_packet(1, b'b', stream_id=1, stream_prev=syn_seqnum),
+            make_packet(2, b'c', stream_id=1, stream_prev=syn_seqnum + 2),
+            make_packet(
+                3,
+                b'd',
+                stream_id=1,
+                stream_prev=syn_seqnum + 3,
+                more_fragments=1
+            ),
+            make_packet(4, b'e', stream_id=1)
+        )
+
+        for p in reversed(remote_stream_packets):
+            self.con.receive_packet(p, self.con.relay_addr)
+        self.clock.advance(0)
+
+        self.assertFalse(self.handler_mock.receive_message.called)
+        s_calls = self.handler_mock.receive_stream_message.call_args_list
+        self.assertEqual(
+            tuple(call[0] for call in s_calls),
+            ((1, b'b'), (1, b'c'), (1, b'de'))
+        )
+
+        self.con.receive_packet(delayed_packet, self.con.relay_addr)
+        self.clock.advance(0)
+
+        self.handler_mock.receive_message.assert_called_once_with(b'a')
+        self.assertEqual(
+            self.con._next_expected_seqnum,
+            self.next_remote_seqnum + 5
+        )
+
+    def test_prune_stream_state_during_connected(self):
+        self._connecting_to_connected()
+        syn_seqnum = self.next_remote_seqnum - 1
+
+        for i in range(3):
+            remote_packet = packet.Packet.from_data(
+                self.next_remote_seqnum + i,
+                self.con.own_addr,
+                self.con.dest_addr,
+                payload=str(i),
+                ack=self.next_seqnum,
+                stream_id=1,
+                stream_prev=syn_seqnum + i
+            )
+            self.con.receive_packet(remote_packet, self.con.relay_addr)
+            self.clock.advance(0)
+
+            # Nothing is kept about a stream once its messages are
+            # delivered, and the next message still follows them.
+            self.assertEqual(dict(self.con._receive_heaps), {})
+            self.assertEqual(self.con._last_delivered_seqnums, {})
+
+        s_calls = self.handler_mock.receive_stream_message.call_args_list
+        self.assertEqual(
+            tuple(call[0] for call in s_calls),
+            ((1, '0'), (1, '1'), (1, '2'))
+        )
+
+    def test_receive_packet_on_bad_stream_during_connected(self):
+        self._connecting_to_connected()
+        remote_packet = packet.Packet.from_data(
+            self.next_remote_seqnum,
+            self.con.own_addr,
+            self.con.dest_addr,
+            payload=b'Yellow Submarine',
+            ack=self.next_seqnum,
+            stream_id=constants.MAX_STREAM_ID + 1,
+            stream_prev=self.next_remote_seqnum - 1
+        )
+        self.con.receive_packet(remote_packet, self.con.relay_addr)
+        self.clock.advance(0)
+
+        self.assertFalse(self.handler_mock.receive_stream_message.called)
+        self.assertEqual(dict(self.con._receive_heaps), {})
+        self.assertEqual(
+            self.con._next_expected_seqnum,
+            self.next_remote_seqnum
+        )
+
+    def test_send_message_on_bad_stream(self):
+        for stream in (-1, constants.MAX_STREAM_ID + 1):
+            with self.assertRaises(ValueError):
+                self.con.send_message(b'Yellow Submarine', stream=stream)
+            with self.assertRaises(ValueError):
+                self.con.send_messages([b'Yellow Submarine'], stream=stream)
+
+    def _acknowledge_syn(self):
+        remote_ack_packet = packet.Packet.from_data(
+            0,
+            self.con.own_addr,
+            self.con.dest_addr,
+            ack=self.next_seqnum
+        )
+        self.con.receive_packet(remote_ack_packet, self.con.relay_addr)
+        self.proto_mock.reset_mock()
+
+    def test_send_unreliable_message_during_connected(self):
+        self._connecting_to_connected()
+        self._acknowledge_syn()
+
+        d = self.assertFailure(
+            self.con.send_message(
+                b'Yellow Submarine',
+                reliability=connection.Reliability.UNRELIABLE
+            ),
+            defer.TimeoutError
+        )
+        self.clock.advance(0)
+        sent_casual_datagrams = self._sent_casual_datagrams()
+        self.assertEqual(len(sent_casual_datagrams), 1)
+        sent_packet = packet.Packet.from_bytes(sent_casual_datagrams[0])
+        self.assertTrue(sent_packet.unordered)
+
+        # Instead of a retransmission, the remote host is told to
+        # skip the packet.
+        self.proto_mock.reset_mock()
+        self.clock.advance(constants.PACKET_TIMEOUT)
+        self.assertEqual(self._sent_casual_datagrams(), ())
+        expected_skip_packet = packet.Packet.from_data(
+            0,
+            self.con.dest_addr,
+            self.con.own_addr,
+            ack=self.next_remote_seqnum,
+            skip=self.next_seqnum + 1
+        ).to_bytes()
+        self.proto_mock.send_datagram.assert_called_once_with(
+            expected_skip_packet,
+            self.con.relay_addr
+        )
+
+        remote_ack_packet = packet.Packet.from_data(
+            0,
+            self.con.own_addr,
+            self.con.dest_addr,
+            ack=self.next_seqnum + 1
+        )
+        self.con.receive_packet(remote_ack_packet, self.con.relay_addr)
+        self.assertFalse(self.con._sending_window)
+        self.successResultOf(d)
+
+    def test_send_partially_reliable_message_during_connected(self):
+        self._connecting_to_connected()
+        self._acknowledge_syn()
+
+        self.con.send_message(
+            b'Yellow Submarine',
+            reliability=connection.Reliability.PARTIAL,
+            max_retries=2
+        )
+        self.clock.advance(0)
+        for _ in range(2):
+            self.clock.advance(constants.PACKET_TIMEOUT)
+        sent_casual_datagrams = self._sent_casual_datagrams()
+        self.assertGreaterEqual(len(sent_casual_datagrams), 3)
+
+        # The third retransmission is replaced by a skip notice.
+        self.clock.advance(constants.PACKET_TIMEOUT)
+        self.assertEqual(self._sent_casual_datagrams(), sent_casual_datagrams)
+        last_packet = packet.Packet.from_bytes(
+            self.proto_mock.send_datagram.call_args[0][0]
+        )
+        self.assertEqual(last_packet.skip, self.next_seqnum + 1)
+
+    def test_send_message_with_bad_reliability(self):
+        self._connecting_to_connected()
+
+        with self.assertRaises(ValueError):
+            self.con.send_message(
+                b'a' * (constants.UDP_SAFE_SEGMENT_SIZE + 1),
+                reliability=connection.Reliability.UNRELIABLE
+            )
+        with self.assertRaises(ValueError):
+            self.con.send_message(
+                b'Yellow Submarine',
+                reliability=connection.Reliability.PARTIAL
+            )
+
+    def test_receive_skip_packet_during_connected(self):
+        self._connecting_to_connected()
+
+        remote_casual_packet = packet.Packet.from_data(
+            self.next_remote_seqnum + 1,
+            self.con.own_addr,
+            self.con.dest_addr,
+            payload=b'Yellow Submarine',
+            ack=self.next_seqnum
+        )
+        self.con.receive_packet(remote_casual_packet, self.con.relay_addr)
+        self.clock.advance(0)
+        self.assertFalse(self.handler_mock.receive_message.called)
+
+        remote_skip_packet = packet.Packet.from_data(
+            0,
+            self.con.own_addr,
+            self.con.dest_addr,
+            ack=self.next_seqnum,
+            skip=self.next_remote_seqnum + 1
+        )
+        self.con.receive_packet(remote_skip_packet, self.con.relay_addr)
+        self.clock.advance(0)
+
+        self.handler_mock.receive_message.assert_called_once_with(
+            b'Yellow Submarine'
+        )
+        self.assertEqual(
+            self.con._next_expected_seqnum,
+            self.next_remote_seqnum + 2
+        )
+
+    def test_receive_unordered_packet_during_connected(self):
+        self._connecting_to_connected()
+
+        remote_casual_packet = packet.Packet.from_data(
+            self.next_remote_seqnum + 1,
+            self.con.own_addr,
+            self.con.dest_addr,
+            payload=b'Yellow Submarine',
+            ack=self.next_seqnum,
+            unordered=True
+        )
+        self.con.receive_packet(remote_casual_packet, self.con.relay_addr)
+
+        self.handler_mock.receive_message.assert_called_once_with(
+            b'Yellow Submarine'
+        )
+
     # == Test SHUTDOWN state ==
 
     def test_send_casual_during_shutdown(self):
@@ -487,6 +1609,30 @@ class TestConnectionAPI(unittest.TestCase):
         self.assertEqual(self.con.state, connection.State.SHUTDOWN)
         self.proto_mock.send_datagram.assert_not_called()
 
+    def test_pause_and_resume_during_shutdown(self):
+        self._connecting_to_connected()
+        self.con.pauseProducing()
+        for i in range(constants.RECEIVE_BUFFER_SIZE):
+            remote_casual_packet = packet.Packet.from_data(
+                self.next_remote_seqnum + i,
+                self.con.own_addr,
+                self.con.dest_addr,
+                payload=str(i),
+                ack=self.next_seqnum
+            )
+            self.con.receive_packet(remote_casual_packet, self.con.relay_addr)
+        self.clock.advance(constants.BARE_ACK_TIMEOUT)
+        self.assertEqual(self.con._advertised_window, 0)
+        self.con.shutdown()
+
+        # A closed window is not reopened from a dead connection.
+        self.proto_mock.reset_mock()
+        self.con.resumeProducing()
+        self.con.pauseProducing()
+        self.clock.advance(100 * constants.PACKET_TIMEOUT)
+        self.proto_mock.send_datagram.assert_not_called()
+        self.handler_mock.receive_message.assert_not_called()
+
     def test_receive_syn_during_shutdown(self):
         pass
 
@@ -519,3 +1665,80 @@ class TestConnectionAPI(unittest.TestCase):
 
         self.assertEqual(self.con.state, connection.State.SHUTDOWN)
         self.handler_mock.receive_message.assert_not_called()
+
+
+class TestConnectionAPIWithSharedRetransmissionTimer(TestConnectionAPI):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.patch(connection.REACTOR, 'callLater', self.clock.callLater)
+        self.patch(connection.REACTOR, 'seconds', self.clock.seconds)
+
+        self.proto_mock = mock.Mock(spec_set=rudp.ConnectionMultiplexer)
+        self.handler_mock = mock.Mock(spec_set=connection.Handler)
+        self.con = connection.Connection(
+            self.proto_mock,
+            self.handler_mock,
+            self.own_addr,
+            self.addr1,
+            shared_retransmission_timer=True
+        )
+
+    def test_send_big_casual_message_during_connected(self):
+        # Packets are sent as soon as they are dequeued, so advancing
+        # the clock by a full PACKET_TIMEOUT would also retransmit some.
+        self._connecting_to_connected()
+
+        big_message = ''.join((
+            b'a' * constants.UDP_SAFE_SEGMENT_SIZE,
+            b'b' * constants.UDP_SAFE_SEGMENT_SIZE,
+            b'c' * constants.UDP_SAFE_SEGMENT_SIZE
+        ))
+        self.con.send_message(big_message)
+        self.clock.advance(0)
+
+        expected_casual_datagrams = tuple(
+            packet.Packet.from_data(
+                self.next_seqnum + i,
+                self.con.dest_addr,
+                self.con.own_addr,
+                ack=self.next_remote_seqnum,
+                payload=payload * constants.UDP_SAFE_SEGMENT_SIZE,
+                more_fragments=2 - i,
+                fragment_count=3
+            ).to_bytes()
+            for i, payload in zip(range(3), b'abc')
+        )
+        self.assertEqual(
+            self._sent_casual_datagrams(),
+            expected_casual_datagrams
+        )
+
+    def test_single_timer_for_full_window(self):
+        self._connecting_to_connected()
+        for i in range(2 * constants.WINDOW_SIZE):
+            self.con.send_message(str(i))
+        self.clock.advance(0)
+
+        self.assertEqual(
+            len(self._sent_casual_datagrams()),
+            constants.WINDOW_SIZE - 1
+        )
+        rto_calls = tuple(
+            call
+            for call in self.clock.getDelayedCalls()
+            if call.func == self.con._resend_overdue_packets
+        )
+        self.assertEqual(len(rto_calls), 1)
+        self.assertFalse(any(
+            call.func == self.con._do_send_packet
+            for call in self.clock.getDelayedCalls()
+        ))
+
+        # All packets in flight are resent once the timer expires.
+        self.proto_mock.reset_mock()
+        self.clock.advance(constants.PACKET_TIMEOUT)
+        self.assertEqual(
+            len(self._sent_casual_datagrams()),
+            constants.WINDOW_SIZE - 1
+        )
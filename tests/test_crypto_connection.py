@@ -1,6 +1,9 @@
-import mock
+import gc
+import struct
 from unittest import skipIf
 
+import mock
+
 try:
     from nacl import encoding, exceptions, public, utils
 except ImportError:
@@ -8,9 +11,10 @@ except ImportError:
 else:
     _NO_PYNACL = False
 
-from twisted.internet import reactor, task
+from twisted.internet import defer, error, reactor, task
 from twisted.trial import unittest
 
+from tests.test_threaded_handler import FakeThreadPool
 from txrudp import crypto_connection, connection, constants, packet, rudp
 
 @skipIf(_NO_PYNACL, 'PyNaCl is not installed')
@@ -54,17 +58,36 @@ class TestCryptoConnectionAPI(unittest.TestCase):
 
         cls.other_crypto_box = public.Box(cls.privkey3, cls.pubkey1)
 
-    @classmethod
-    def _remote_encrypt_msg(cls, msg):
-        return cls.remote_crypto_box.encrypt(msg, cls.nonce)
+    def _add_control_fields(self, msg, ack=0, skip=0, window=None):
+        self.remote_encrypted_count += 1
+        return crypto_connection._CONTROL_FIELDS.pack(
+            self.remote_encrypted_count,
+            ack,
+            skip,
+            -1 if window is None else window
+        ) + msg
+
+    def _remote_encrypt_msg(self, msg, **control):
+        return self.remote_crypto_box.encrypt(
+            self._add_control_fields(msg, **control),
+            self.nonce
+        )
 
-    @classmethod
-    def _other_encrypt_msg(cls, msg):
-        return cls.other_crypto_box.encrypt(msg, cls.nonce)
+    def _other_encrypt_msg(self, msg, **control):
+        return self.other_crypto_box.encrypt(
+            self._add_control_fields(msg, **control),
+            self.nonce
+        )
+
+    def _remote_decrypt_msg(self, ciphertext, nonce=None):
+        plaintext = self.remote_crypto_box.decrypt(ciphertext, nonce)
+        return plaintext[crypto_connection._CONTROL_FIELDS.size:]
 
     def setUp(self):
+        self.remote_encrypted_count = 0
         self.clock = task.Clock()
-        connection.REACTOR.callLater = self.clock.callLater
+        self.patch(connection.REACTOR, 'callLater', self.clock.callLater)
+        self.patch(connection.REACTOR, 'seconds', self.clock.seconds)
 
         self.proto_mock = mock.Mock(spec_set=rudp.ConnectionMultiplexer)
         self.handler_mock = mock.Mock(spec_set=connection.Handler)
@@ -79,6 +102,11 @@ class TestCryptoConnectionAPI(unittest.TestCase):
     def tearDown(self):
         self.con.shutdown()
 
+        # Messages pending on shutdown fail, but most tests ignore
+        # their Deferreds.
+        gc.collect()
+        self.flushLoggedErrors(error.ConnectionDone, error.ConnectionLost)
+
     # == Test CONNECTING state ==
 
     def test_send_syn_during_connecting(self):
@@ -87,8 +115,11 @@ class TestCryptoConnectionAPI(unittest.TestCase):
 
         self._advance_to_fin()
 
+        # SYN retransmissions back off exponentially, so they are
+        # fewer than retransmissions of casual packets.
         m_calls = self.proto_mock.send_datagram.call_args_list
-        self.assertEqual(len(m_calls), constants.MAX_RETRANSMISSIONS + 1)
+        self.assertGreater(len(m_calls), 2)
+        self.assertLess(len(m_calls), constants.MAX_RETRANSMISSIONS + 1)
 
         first_syn_call = m_calls[0]
         syn_packet = packet.Packet.from_bytes(first_syn_call[0][0])
@@ -134,7 +165,9 @@ class TestCryptoConnectionAPI(unittest.TestCase):
 
     def test_send_casual_during_connecting(self):
         self.con.send_message(b'Yellow Submarine')
-        self.clock.advance(100 * constants.PACKET_TIMEOUT)
+        self.clock.advance(
+            constants.HANDSHAKE_TIMEOUT - constants.PACKET_TIMEOUT
+        )
         connection.REACTOR.runUntilCurrent()
 
         m_calls = self.proto_mock.send_datagram.call_args_list
@@ -193,6 +226,25 @@ class TestCryptoConnectionAPI(unittest.TestCase):
         self.assertEqual(self.con.state, connection.State.CONNECTING)
         self.assertIsNone(self.con.remote_public_key)
 
+    def test_receive_cookie_during_connecting(self):
+        self.clock.advance(0)
+        m_calls = self.proto_mock.send_datagram.call_args_list
+        syn_seqnum = packet.Packet.from_bytes(m_calls[0][0][0]).sequence_number
+
+        cookie_packet = packet.Packet.from_data(
+            0,
+            self.con.own_addr,
+            self.con.dest_addr,
+            ack=syn_seqnum + 1,
+            cookie=b'cookie'
+        )
+        self.con.receive_packet(cookie_packet, self.con.relay_addr)
+
+        syn_packet = packet.Packet.from_bytes(m_calls[-1][0][0])
+        self.assertTrue(syn_packet.syn)
+        self.assertEqual(syn_packet.cookie, b'cookie')
+        self.assertEqual(syn_packet.payload, self.pubkey1_bytes)
+
     def test_receive_casual_during_connecting(self):
         remote_casual_packet = packet.Packet.from_data(
             42,
@@ -259,9 +311,34 @@ class TestCryptoConnectionAPI(unittest.TestCase):
         ciphertext = packet.Packet.from_bytes(
             sent_casual_datagrams[0]
         ).payload
-        plaintext = self.remote_crypto_box.decrypt(ciphertext)
+        plaintext = self._remote_decrypt_msg(ciphertext)
         self.assertEqual(plaintext, b'Yellow Submarine')
 
+    def test_send_casual_burst_during_connected(self):
+        self._connecting_to_connected()
+        for message in (b'Yellow', b'Submarine', b'Yellow Submarine'):
+            self.con.send_message(message)
+        self.clock.advance(0)
+
+        sent_packets = [
+            packet.Packet.from_bytes(call[0][0])
+            for call in self.proto_mock.send_datagram.call_args_list
+        ]
+        self.assertEqual(
+            [
+                self._remote_decrypt_msg(sent_packet.payload)
+                for sent_packet in sent_packets
+            ],
+            [b'Yellow', b'Submarine', b'Yellow Submarine']
+        )
+
+        # Every packet has its own nonce.
+        nonces = set(
+            sent_packet.payload[:public.Box.NONCE_SIZE]
+            for sent_packet in sent_packets
+        )
+        self.assertEqual(len(nonces), 3)
+
     def test_send_ack_during_connected(self):
         self._connecting_to_connected()
 
@@ -269,7 +346,10 @@ class TestCryptoConnectionAPI(unittest.TestCase):
             self.next_remote_seqnum,
             self.con.own_addr,
             self.con.dest_addr,
-            payload=self._remote_encrypt_msg(b'Yellow Submarine'),
+            payload=self._remote_encrypt_msg(
+                b'Yellow Submarine',
+                ack=self.next_seqnum
+            ),
             ack=self.next_seqnum
         )
         self.con.receive_packet(remote_casual_packet, self.con.relay_addr)
@@ -309,7 +389,10 @@ class TestCryptoConnectionAPI(unittest.TestCase):
             self.next_remote_seqnum,
             self.con.own_addr,
             self.con.dest_addr,
-            payload=self._remote_encrypt_msg(b'Yellow Submarine'),
+            payload=self._remote_encrypt_msg(
+                b'Yellow Submarine',
+                ack=self.next_seqnum
+            ),
             ack=self.next_seqnum
         )
         self.con.receive_packet(remote_casual_packet, self.con.relay_addr)
@@ -328,7 +411,62 @@ class TestCryptoConnectionAPI(unittest.TestCase):
             self.next_remote_seqnum,
             self.con.own_addr,
             self.con.dest_addr,
-            payload=self._other_encrypt_msg(b'Yellow Submarine'),
+            payload=self._other_encrypt_msg(
+                b'Yellow Submarine',
+                ack=self.next_seqnum
+            ),
+            ack=self.next_seqnum
+        )
+        self.con.receive_packet(remote_casual_packet, self.con.relay_addr)
+
+        self.clock.advance(0)
+        connection.REACTOR.runUntilCurrent()
+
+        self.handler_mock.receive_message.assert_not_called()
+
+    # == Test implicit nonces ==
+
+    def test_receive_forged_control_fields_during_connected(self):
+        self._connecting_to_connected()
+
+        remote_casual_packet = packet.Packet.from_data(
+            self.next_remote_seqnum,
+            self.con.own_addr,
+            self.con.dest_addr,
+            payload=self._remote_encrypt_msg(
+                b'Yellow Submarine',
+                ack=self.next_seqnum,
+                window=8
+            ),
+            ack=self.next_seqnum,
+            skip=self.next_remote_seqnum + 5,
+            window=0
+        )
+        self.con.receive_packet(remote_casual_packet, self.con.relay_addr)
+
+        self.clock.advance(0)
+        connection.REACTOR.runUntilCurrent()
+
+        self.handler_mock.receive_message.assert_called_once_with(
+            b'Yellow Submarine'
+        )
+        self.assertEqual(
+            self.con._next_expected_seqnum,
+            self.next_remote_seqnum + 1
+        )
+        self.assertEqual(self.con._remote_window, 8)
+
+    def test_receive_casual_packet_without_control_fields(self):
+        self._connecting_to_connected()
+
+        remote_casual_packet = packet.Packet.from_data(
+            self.next_remote_seqnum,
+            self.con.own_addr,
+            self.con.dest_addr,
+            payload=self.remote_crypto_box.encrypt(
+                b'Yellow Submarine',
+                self.nonce
+            ),
             ack=self.next_seqnum
         )
         self.con.receive_packet(remote_casual_packet, self.con.relay_addr)
@@ -336,8 +474,404 @@ class TestCryptoConnectionAPI(unittest.TestCase):
         self.clock.advance(0)
         connection.REACTOR.runUntilCurrent()
 
+        self.handler_mock.receive_message.assert_not_called()
+        self.assertEqual(
+            self.con._next_expected_seqnum,
+            self.next_remote_seqnum
+        )
+
+    def test_ignore_window_of_replayed_packet_during_connected(self):
+        self._connecting_to_connected()
+
+        closing_payload = self._remote_encrypt_msg(
+            b'Yellow',
+            ack=self.next_seqnum,
+            window=0
+        )
+        opening_payload = self._remote_encrypt_msg(
+            b'Submarine',
+            ack=self.next_seqnum,
+            window=8
+        )
+        for seqnum, payload in (
+            (self.next_remote_seqnum, closing_payload),
+            (self.next_remote_seqnum + 1, opening_payload),
+            (self.next_remote_seqnum, closing_payload)
+        ):
+            remote_casual_packet = packet.Packet.from_data(
+                seqnum,
+                self.con.own_addr,
+                self.con.dest_addr,
+                payload=payload,
+                ack=self.next_seqnum
+            )
+            self.con.receive_packet(
+                remote_casual_packet,
+                self.con.relay_addr
+            )
+            self.clock.advance(0)
+
+        self.assertEqual(self.con._remote_window, 8)
+
+    def _use_implicit_nonces(self, remote_nonce_bytes):
+        # Let the pending SYN of the original connection go first.
+        self.clock.advance(0)
+        self.con.shutdown()
+        self.proto_mock.reset_mock()
+        self.con = crypto_connection.CryptoConnection(
+            self.proto_mock,
+            self.handler_mock,
+            self.own_addr,
+            self.addr1,
+            private_key=self.privkey1_hex,
+            implicit_nonces=True
+        )
+        remote_syn_packet = packet.Packet.from_data(
+            42,
+            self.con.own_addr,
+            self.con.dest_addr,
+            payload=self.pubkey2_bytes + remote_nonce_bytes,
+            syn=True
+        )
+        self.con.receive_packet(remote_syn_packet, self.con.relay_addr)
+        self.clock.advance(0)
+
+        syn_call = self.proto_mock.send_datagram.call_args_list[0]
+        sent_syn_packet = packet.Packet.from_bytes(syn_call[0][0])
+        self.next_seqnum = sent_syn_packet.sequence_number + 1
+        self.next_remote_seqnum = 43
+        self.proto_mock.reset_mock()
+        return sent_syn_packet
+
+    def _make_nonce(self, seqnum, nonce_bytes):
+        return struct.pack('>4xQ', seqnum) + nonce_bytes
+
+    def test_send_syn_with_implicit_nonces(self):
+        sent_syn_packet = self._use_implicit_nonces(b'')
+        self.assertEqual(
+            sent_syn_packet.payload[:public.PublicKey.SIZE],
+            self.pubkey1_bytes
+        )
+        self.assertEqual(
+            len(sent_syn_packet.payload),
+            public.PublicKey.SIZE + public.Box.NONCE_SIZE // 2
+        )
+
+    def test_send_casual_message_with_implicit_nonces(self):
+        sent_syn_packet = self._use_implicit_nonces(12 * b'r')
+        nonce_bytes = sent_syn_packet.payload[public.PublicKey.SIZE:]
+
+        self.con.send_message(b'Yellow Submarine')
+        self.clock.advance(0)
+
+        sent_packet = packet.Packet.from_bytes(
+            self.proto_mock.send_datagram.call_args[0][0]
+        )
+        self.assertEqual(sent_packet.sequence_number, self.next_seqnum)
+        self.assertEqual(
+            len(sent_packet.payload),
+            len(b'Yellow Submarine') +
+            crypto_connection._CONTROL_FIELDS.size +
+            16  # Poly1305 MAC
+        )
+        self.assertEqual(
+            self._remote_decrypt_msg(
+                sent_packet.payload,
+                self._make_nonce(self.next_seqnum, nonce_bytes)
+            ),
+            b'Yellow Submarine'
+        )
+
+    def test_receive_casual_packet_with_implicit_nonces(self):
+        self._use_implicit_nonces(12 * b'r')
+        nonce = self._make_nonce(self.next_remote_seqnum, 12 * b'r')
+        remote_casual_packet = packet.Packet.from_data(
+            self.next_remote_seqnum,
+            self.con.own_addr,
+            self.con.dest_addr,
+            payload=self.remote_crypto_box.encrypt(
+                self._add_control_fields(
+                    b'Yellow Submarine',
+                    ack=self.next_seqnum
+                ),
+                nonce
+            ).ciphertext,
+            ack=self.next_seqnum
+        )
+        self.con.receive_packet(remote_casual_packet, self.con.relay_addr)
+        self.clock.advance(0)
+
+        self.handler_mock.receive_message.assert_called_once_with(
+            b'Yellow Submarine'
+        )
+
+    def test_send_bare_packets_with_implicit_nonces(self):
+        self._use_implicit_nonces(12 * b'r')
+        for seqnum in (self.next_remote_seqnum, self.next_remote_seqnum + 1):
+            remote_casual_packet = packet.Packet.from_data(
+                seqnum,
+                self.con.own_addr,
+                self.con.dest_addr,
+                payload=self.remote_crypto_box.encrypt(
+                    self._add_control_fields(
+                        b'Yellow Submarine',
+                        ack=self.next_seqnum
+                    ),
+                    self._make_nonce(seqnum, 12 * b'r')
+                ).ciphertext,
+                ack=self.next_seqnum
+            )
+            self.con.receive_packet(
+                remote_casual_packet,
+                self.con.relay_addr
+            )
+            self.clock.advance(constants.BARE_ACK_TIMEOUT)
+
+        sent_packets = [
+            packet.Packet.from_bytes(call[0][0])
+            for call in self.proto_mock.send_datagram.call_args_list
+        ]
+        sent_bare_packets = [
+            sent_packet
+            for sent_packet in sent_packets
+            if sent_packet.sequence_number == 0
+        ]
+        self.assertEqual(len(sent_bare_packets), 2)
+
+        # Bare packets share sequence number 0, so each needs its own
+        # explicit nonce.
+        nonces = [
+            sent_packet.payload[:public.Box.NONCE_SIZE]
+            for sent_packet in sent_bare_packets
+        ]
+        self.assertNotEqual(nonces[0], nonces[1])
+        for sent_packet in sent_bare_packets:
+            self.assertEqual(
+                self._remote_decrypt_msg(sent_packet.payload),
+                b''
+            )
+
+    def test_explicit_nonces_unless_offered_by_remote(self):
+        self._use_implicit_nonces(b'')
+        self.con.send_message(b'Yellow Submarine')
+        self.clock.advance(0)
+
+        sent_packet = packet.Packet.from_bytes(
+            self.proto_mock.send_datagram.call_args[0][0]
+        )
+        self.assertEqual(
+            self._remote_decrypt_msg(sent_packet.payload),
+            b'Yellow Submarine'
+        )
+
+    def test_receive_syn_with_bad_nonce_bytes(self):
+        remote_syn_packet = packet.Packet.from_data(
+            42,
+            self.con.own_addr,
+            self.con.dest_addr,
+            payload=self.pubkey2_bytes + b'rrr',
+            syn=True
+        )
+        self.con.receive_packet(remote_syn_packet, self.con.relay_addr)
+        self.clock.advance(0)
+
+        self.assertEqual(self.con.state, connection.State.CONNECTING)
+        self.assertIsNone(self.con.remote_public_key)
+
+    # == Test crypto thread pool ==
+
+    def _use_crypto_threadpool(self):
+        reactor_mock = mock.Mock()
+        reactor_mock.callLater = self.clock.callLater
+        reactor_mock.callFromThread.side_effect = lambda f, *args: f(*args)
+        self.patch(crypto_connection, 'REACTOR', reactor_mock)
+
+        self.clock.advance(0)
+        self.con.shutdown()
+        self.proto_mock.reset_mock()
+        self.threadpool = FakeThreadPool()
+        self.con = crypto_connection.CryptoConnection(
+            self.proto_mock,
+            self.handler_mock,
+            self.own_addr,
+            self.addr1,
+            private_key=self.privkey1_hex,
+            crypto_threadpool=self.threadpool
+        )
+        self._connecting_to_connected()
+
+    def _sent_casual_plaintexts(self):
+        sent_packets = (
+            packet.Packet.from_bytes(call[0][0])
+            for call in self.proto_mock.send_datagram.call_args_list
+        )
+        return [
+            self._remote_decrypt_msg(sent_packet.payload)
+            for sent_packet in sent_packets
+            if sent_packet.sequence_number > 0 and sent_packet.payload
+        ]
+
+    def test_send_casual_messages_with_crypto_threadpool(self):
+        self._use_crypto_threadpool()
+        in_flight = self.con._count_packets_in_flight()
+        self.con.send_message(b'Yellow')
+        self.con.send_message(b'Submarine')
+        self.clock.advance(0)
+
+        # Both packets are encrypted in one batch; they occupy the
+        # send window meanwhile.
+        self.assertEqual(len(self.threadpool.calls), 1)
+        self.assertEqual(self.con._count_packets_in_flight(), in_flight + 2)
+        self.proto_mock.send_datagram.assert_not_called()
+
+        self.threadpool.run_next()
+        self.clock.advance(0)
+
+        self.assertEqual(
+            self._sent_casual_plaintexts(),
+            [b'Yellow', b'Submarine']
+        )
+        self.assertEqual(self.con._count_packets_in_flight(), in_flight + 2)
+
+    def test_send_batches_in_order_with_crypto_threadpool(self):
+        self._use_crypto_threadpool()
+        self.con.send_message(b'Yellow')
+        self.clock.advance(0)
+        self.con.send_message(b'Submarine')
+        self.clock.advance(0)
+        self.assertEqual(len(self.threadpool.calls), 2)
+
+        # The later batch waits for the earlier one.
+        self.threadpool.run_next(1)
+        self.clock.advance(0)
+        self.proto_mock.send_datagram.assert_not_called()
+
+        self.threadpool.run_next()
+        self.clock.advance(0)
+        self.assertEqual(
+            self._sent_casual_plaintexts(),
+            [b'Yellow', b'Submarine']
+        )
+
+    def test_shutdown_during_encryption_with_crypto_threadpool(self):
+        self._use_crypto_threadpool()
+        d = self.assertFailure(
+            self.con.send_message(b'Yellow Submarine'),
+            error.ConnectionDone
+        )
+        self.clock.advance(0)
+        self.con.shutdown()
+        self.successResultOf(d)
+
+        self.threadpool.run_next()
+        self.clock.advance(0)
+        self.assertEqual(self._sent_casual_plaintexts(), [])
+
+    def test_encryption_failure_with_crypto_threadpool(self):
+        self._use_crypto_threadpool()
+        d = self.assertFailure(
+            self.con.send_message(b'Yellow Submarine'),
+            error.ConnectionLost
+        )
+        self.clock.advance(0)
+
+        with mock.patch.object(
+            self.con,
+            '_finalize_packets',
+            side_effect=ValueError
+        ):
+            self.threadpool.run_next()
+        self.clock.advance(0)
+
+        self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
+        self.assertEqual(
+            self.con.shutdown_reason,
+            connection.ShutdownReason.ERROR
+        )
+        self.successResultOf(d)
+        self.assertEqual(self._sent_casual_plaintexts(), [])
+
+    def _receive_ack_with_crypto_threadpool(self, ack):
+        remote_ack_packet = packet.Packet.from_data(
+            0,
+            self.con.own_addr,
+            self.con.dest_addr,
+            payload=self._remote_encrypt_msg(b'', ack=ack),
+            ack=ack
+        )
+        self.con.receive_packet(remote_ack_packet, self.con.relay_addr)
+        self.clock.advance(0)
+        self.threadpool.run_next(-1)
+        self.clock.advance(0)
+
+    def test_skip_during_encryption_with_crypto_threadpool(self):
+        self._use_crypto_threadpool()
+        self._receive_ack_with_crypto_threadpool(self.next_seqnum)
+        d1 = self.assertFailure(
+            self.con.send_message(
+                b'Yellow',
+                reliability=connection.Reliability.UNRELIABLE
+            ),
+            defer.TimeoutError
+        )
+        self.clock.advance(0)
+        self.threadpool.run_next()
+        self.clock.advance(0)
+
+        d2 = self.con.send_message(b'Submarine')
+        self.clock.advance(0)
+        self.proto_mock.reset_mock()
+
+        # The skip notice stops short of the packet being encrypted.
+        self.clock.advance(constants.PACKET_TIMEOUT)
+        skip_packet = packet.Packet.from_bytes(
+            self.proto_mock.send_datagram.call_args[0][0]
+        )
+        self.assertEqual(skip_packet.skip, self.next_seqnum + 1)
+
+        # So does an ACK beyond it.
+        self._receive_ack_with_crypto_threadpool(self.next_seqnum + 2)
+        self.successResultOf(d1)
+        self.assertEqual(self.con._sending_window, {})
+
+        self.threadpool.run_next()
+        self.clock.advance(0)
+        self.assertEqual(self._sent_casual_plaintexts(), [b'Submarine'])
+        self.assertEqual(
+            list(self.con._sending_window),
+            [self.next_seqnum + 1]
+        )
+        self.assertFalse(d2.called)
+
+    def test_receive_casual_packets_with_crypto_threadpool(self):
+        self._use_crypto_threadpool()
+        payloads = (
+            self._remote_encrypt_msg(b'Yellow', ack=self.next_seqnum),
+            self._other_encrypt_msg(b'Rogue', ack=self.next_seqnum),
+            self._remote_encrypt_msg(b'Submarine', ack=self.next_seqnum),
+        )
+        for seqnum, payload in enumerate(payloads, self.next_remote_seqnum):
+            remote_casual_packet = packet.Packet.from_data(
+                seqnum,
+                self.con.own_addr,
+                self.con.dest_addr,
+                payload=payload,
+                ack=self.next_seqnum
+            )
+            self.con.receive_packet(remote_casual_packet, self.con.relay_addr)
+
+        self.clock.advance(0)
         self.handler_mock.receive_message.assert_not_called()
 
+        self.threadpool.run_next()
+        self.clock.advance(0)
+
+        # The rogue packet is dropped, which holds back the next one.
+        self.assertEqual(
+            self.handler_mock.receive_message.call_args_list,
+            [mock.call(b'Yellow')]
+        )
+
     # == Test SHUTDOWN state ==
 
     def test_send_casual_during_shutdown(self):
@@ -384,3 +918,200 @@ class TestCryptoConnectionAPI(unittest.TestCase):
 
         self.assertEqual(self.con.state, connection.State.SHUTDOWN)
         self.handler_mock.receive_message.assert_not_called()
+
+    # == Test key pool ==
+
+    def test_factory_takes_private_key_from_pool(self):
+        key_pool = mock.Mock(spec_set=crypto_connection.KeyPool)
+        key_pool.get_private_key.return_value = self.privkey2
+        factory = crypto_connection.CryptoConnectionFactory(
+            mock.Mock(spec_set=connection.HandlerFactory),
+            key_pool=key_pool
+        )
+        con = factory.make_new_connection(
+            self.proto_mock,
+            self.own_addr,
+            self.addr2,
+            None
+        )
+        self.addCleanup(con.shutdown)
+
+        key_pool.get_private_key.assert_called_once_with()
+        self.assertIs(con._private_key, self.privkey2)
+
+    # == Test box cache ==
+
+    def test_reuse_cached_box(self):
+        box_cache = crypto_connection.BoxCache()
+        cons = []
+        for _ in range(2):
+            con = crypto_connection.CryptoConnection(
+                self.proto_mock,
+                self.handler_mock,
+                self.own_addr,
+                self.addr2,
+                private_key=self.privkey1_hex,
+                box_cache=box_cache
+            )
+            self.addCleanup(con.shutdown)
+            remote_syn_packet = packet.Packet.from_data(
+                42,
+                con.own_addr,
+                con.dest_addr,
+                payload=self.pubkey2_bytes,
+                syn=True
+            )
+            con.receive_packet(remote_syn_packet, con.relay_addr)
+            cons.append(con)
+
+        self.assertEqual(len(box_cache), 1)
+        self.assertIs(cons[0]._crypto_box, cons[1]._crypto_box)
+        self.assertEqual(
+            cons[1]._crypto_box.shared_key(),
+            self.local_crypto_box.shared_key()
+        )
+
+
+@skipIf(_NO_PYNACL, 'PyNaCl is not installed')
+class TestBoxCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        reactor_mock = mock.Mock()
+        reactor_mock.seconds = self.clock.seconds
+        self.patch(crypto_connection, 'REACTOR', reactor_mock)
+
+        self.private_key = public.PrivateKey.generate()
+        self.remote_keys = [
+            public.PrivateKey.generate().public_key for _ in range(3)
+        ]
+
+    def test_get_box(self):
+        box_cache = crypto_connection.BoxCache()
+        box = box_cache.get_box(self.private_key, self.remote_keys[0])
+        self.assertEqual(
+            box.shared_key(),
+            public.Box(self.private_key, self.remote_keys[0]).shared_key()
+        )
+        self.assertIs(
+            box_cache.get_box(self.private_key, self.remote_keys[0]),
+            box
+        )
+        self.assertIsNot(
+            box_cache.get_box(self.private_key, self.remote_keys[1]),
+            box
+        )
+
+    def test_evict_least_recently_used(self):
+        box_cache = crypto_connection.BoxCache(size=2)
+        boxes = [
+            box_cache.get_box(self.private_key, remote_key)
+            for remote_key in self.remote_keys[:2]
+        ]
+        box_cache.get_box(self.private_key, self.remote_keys[0])
+        box_cache.get_box(self.private_key, self.remote_keys[2])
+
+        self.assertEqual(len(box_cache), 2)
+        self.assertIs(
+            box_cache.get_box(self.private_key, self.remote_keys[0]),
+            boxes[0]
+        )
+        self.assertIsNot(
+            box_cache.get_box(self.private_key, self.remote_keys[1]),
+            boxes[1]
+        )
+
+    def test_expire_boxes(self):
+        box_cache = crypto_connection.BoxCache(ttl=10)
+        box = box_cache.get_box(self.private_key, self.remote_keys[0])
+
+        # Using a box does not extend its lifetime.
+        self.clock.advance(9)
+        self.assertIs(
+            box_cache.get_box(self.private_key, self.remote_keys[0]),
+            box
+        )
+        self.clock.advance(1)
+        self.assertIsNot(
+            box_cache.get_box(self.private_key, self.remote_keys[0]),
+            box
+        )
+
+
+@skipIf(_NO_PYNACL, 'PyNaCl is not installed')
+class TestKeyPool(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        reactor_mock = mock.Mock()
+        reactor_mock.callLater = self.clock.callLater
+        reactor_mock.callFromThread.side_effect = lambda f, *args: f(*args)
+        self.patch(crypto_connection, 'REACTOR', reactor_mock)
+
+    def _run_next_reactor_iteration(self):
+        # Clock.advance would run calls scheduled while advancing,
+        # unlike a real reactor.
+        delayed_calls = list(self.clock.getDelayedCalls())
+        for delayed_call in delayed_calls:
+            self.clock.calls.remove(delayed_call)
+        for delayed_call in delayed_calls:
+            delayed_call.func(*delayed_call.args, **delayed_call.kw)
+
+    def test_fill_in_batches(self):
+        key_pool = crypto_connection.KeyPool(size=10, batch_size=4)
+        key_pool.start()
+        self.assertEqual(len(key_pool), 0)
+
+        for expected in (4, 8, 10, 10):
+            self._run_next_reactor_iteration()
+            self.assertEqual(len(key_pool), expected)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_get_private_key(self):
+        key_pool = crypto_connection.KeyPool(size=2, batch_size=2)
+        key_pool.start()
+        self.clock.advance(0)
+        pooled_keys = list(key_pool._keys)
+
+        self.assertIs(key_pool.get_private_key(), pooled_keys[0])
+        self.assertIs(key_pool.get_private_key(), pooled_keys[1])
+        self.assertEqual(len(key_pool), 0)
+
+        # An empty pool generates keys on demand.
+        self.assertIsInstance(key_pool.get_private_key(), public.PrivateKey)
+
+        self.clock.advance(0)
+        self.assertEqual(len(key_pool), 2)
+
+    def test_refill_after_failure(self):
+        key_pool = crypto_connection.KeyPool(size=2, batch_size=2)
+        with mock.patch.object(
+            crypto_connection.public.PrivateKey,
+            'generate',
+            side_effect=ValueError
+        ):
+            key_pool.start()
+            self.clock.advance(0)
+        self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
+        self.assertEqual(len(key_pool), 0)
+
+        # The next key taken schedules another batch.
+        key_pool.get_private_key()
+        self.clock.advance(0)
+        self.assertEqual(len(key_pool), 2)
+
+    def test_fill_on_threadpool(self):
+        threadpool = FakeThreadPool()
+        key_pool = crypto_connection.KeyPool(
+            size=4,
+            threadpool=threadpool,
+            batch_size=3
+        )
+        key_pool.start()
+        self.assertEqual(len(threadpool.calls), 1)
+
+        threadpool.run_next()
+        self.assertEqual(len(key_pool), 3)
+        threadpool.run_next()
+        self.assertEqual(len(key_pool), 4)
+        self.assertEqual(threadpool.calls, [])
@@ -75,3 +75,26 @@ class TestHeapAPI(unittest.TestCase):
         self.assertNotIn(2, h)
         self.assertNotIn(3, h)
         self.assertIn(4, h)
+
+    def test_peek_min(self):
+        h = heap.Heap()
+        self.assertIsNone(h.peek_min())
+
+        p1 = self._make_packet_with_seqnum(1)
+        p2 = self._make_packet_with_seqnum(2)
+        h.push(p2)
+        h.push(p1)
+        self.assertEqual(h.peek_min(), p1)
+        self.assertEqual(len(h), 2)
+
+    def test_pop_min(self):
+        h = heap.Heap()
+        self.assertIsNone(h.pop_min())
+
+        p1 = self._make_packet_with_seqnum(1)
+        p2 = self._make_packet_with_seqnum(2)
+        h.push(p2)
+        h.push(p1)
+        self.assertEqual(h.pop_min(), p1)
+        self.assertNotIn(1, h)
+        self.assertEqual(len(h), 1)
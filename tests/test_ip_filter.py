@@ -0,0 +1,100 @@
+import unittest
+
+from txrudp import ip_filter
+
+
+class TestIPFilterAPI(unittest.TestCase):
+
+    def test_empty(self):
+        rules = ip_filter.IPFilter()
+        self.assertEqual(len(rules), 0)
+        self.assertFalse(rules.is_banned('1.2.3.4'))
+        self.assertFalse(rules.is_banned('2001:db8::1'))
+
+    def test_ban_address(self):
+        rules = ip_filter.IPFilter()
+        rules.ban('1.2.3.4')
+        self.assertEqual(len(rules), 1)
+        self.assertTrue(rules.is_banned('1.2.3.4'))
+        self.assertFalse(rules.is_banned('1.2.3.5'))
+
+    def test_ban_network(self):
+        rules = ip_filter.IPFilter()
+        rules.ban('10.1.0.0/16')
+        self.assertTrue(rules.is_banned('10.1.0.0'))
+        self.assertTrue(rules.is_banned('10.1.255.255'))
+        self.assertFalse(rules.is_banned('10.2.0.0'))
+        self.assertFalse(rules.is_banned('10.0.255.255'))
+
+    def test_ban_ipv6_network(self):
+        rules = ip_filter.IPFilter()
+        rules.ban('2001:db8::/32')
+        self.assertTrue(rules.is_banned('2001:db8:ffff::1'))
+        self.assertTrue(rules.is_banned('2001:0DB8:0:0:0:0:0:1'))
+        self.assertFalse(rules.is_banned('2001:db9::1'))
+
+        # IPv4 rules do not apply to IPv6 addresses, and vice versa.
+        self.assertFalse(rules.is_banned('32.1.13.184'))
+
+    def test_ban_everything(self):
+        rules = ip_filter.IPFilter()
+        rules.ban('0.0.0.0/0')
+        self.assertTrue(rules.is_banned('1.2.3.4'))
+        self.assertFalse(rules.is_banned('::1'))
+
+    def test_longest_network_wins(self):
+        rules = ip_filter.IPFilter()
+        rules.ban('10.0.0.0/8')
+        rules.allow('10.1.0.0/16')
+        rules.ban('10.1.2.0/24')
+        self.assertTrue(rules.is_banned('10.2.0.1'))
+        self.assertFalse(rules.is_banned('10.1.0.1'))
+        self.assertTrue(rules.is_banned('10.1.2.1'))
+
+        rules.ban('10.1.0.0/16')
+        self.assertEqual(len(rules), 3)
+        self.assertTrue(rules.is_banned('10.1.0.1'))
+
+    def test_remove(self):
+        rules = ip_filter.IPFilter()
+        rules.ban('10.0.0.0/8')
+        rules.allow('10.1.0.0/16')
+
+        rules.remove('10.1.0.0/16')
+        self.assertEqual(len(rules), 1)
+        self.assertTrue(rules.is_banned('10.1.0.1'))
+
+        # Removing a missing rule is a no-op.
+        rules.remove('10.1.0.0/16')
+        rules.remove('10.0.0.0/7')
+        self.assertEqual(len(rules), 1)
+
+        rules.remove('10.0.0.0/8')
+        self.assertEqual(len(rules), 0)
+        self.assertFalse(rules.is_banned('10.1.0.1'))
+        self.assertEqual(rules._roots, ip_filter.IPFilter()._roots)
+
+    def test_remove_keeps_longer_networks(self):
+        rules = ip_filter.IPFilter()
+        rules.ban('10.0.0.0/8')
+        rules.ban('10.1.0.0/16')
+        rules.remove('10.0.0.0/8')
+        self.assertTrue(rules.is_banned('10.1.0.1'))
+        self.assertFalse(rules.is_banned('10.2.0.1'))
+
+    def test_bad_networks(self):
+        rules = ip_filter.IPFilter()
+        for network in (
+            'localhost',
+            '1.2.3',
+            '1.2.3.4/33',
+            '1.2.3.4/-1',
+            '1.2.3.4/a',
+            '1.2.3.4/24',
+            '::1/129'
+        ):
+            with self.assertRaises(ValueError):
+                rules.ban(network)
+        with self.assertRaises(ValueError):
+            rules.is_banned('1.2.3')
+        self.assertEqual(len(rules), 0)
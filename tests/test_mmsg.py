@@ -0,0 +1,86 @@
+import socket
+
+from twisted.internet import defer, error, protocol, reactor, task
+from twisted.trial import unittest
+
+from txrudp import mmsg
+
+
+class DatagramRecorder(protocol.DatagramProtocol):
+
+    def __init__(self):
+        self.received = []
+
+    def datagramReceived(self, datagram, addr):
+        self.received.append((datagram, addr))
+
+
+class TestMMsgPortAPI(unittest.TestCase):
+
+    if not mmsg.AVAILABLE:
+        skip = 'recvmmsg/sendmmsg are not available.'
+
+    def _listen(self, interface='127.0.0.1', batch_size=4):
+        recorder = DatagramRecorder()
+        port = mmsg.listen_udp(
+            0,
+            recorder,
+            interface,
+            batch_size=batch_size
+        )
+        self.addCleanup(port.stopListening)
+        return port, recorder
+
+    @defer.inlineCallbacks
+    def _wait_for(self, recorder, count):
+        for _ in range(100):
+            if len(recorder.received) >= count:
+                return
+            yield task.deferLater(reactor, 0.01, lambda: None)
+
+    @defer.inlineCallbacks
+    def _test_send_and_receive(self, interface):
+        port1, _ = self._listen(interface)
+        port2, recorder = self._listen(interface)
+        addr1 = (interface, port1.getHost().port)
+        addr2 = (interface, port2.getHost().port)
+
+        datagrams = ['Yellow Submarine {0}'.format(i) for i in range(10)]
+        for datagram in datagrams:
+            port1.write(datagram, addr2)
+
+        # Datagrams are queued until the next reactor iteration.
+        self.assertEqual(len(port1._send_queue), 10)
+        yield self._wait_for(recorder, 10)
+        self.assertEqual(port1._send_queue, [])
+        self.assertEqual(
+            recorder.received,
+            [(datagram, addr1) for datagram in datagrams]
+        )
+
+    def test_send_and_receive(self):
+        return self._test_send_and_receive('127.0.0.1')
+
+    def test_send_and_receive_ipv6(self):
+        try:
+            socket.socket(socket.AF_INET6, socket.SOCK_DGRAM).bind(('::1', 0))
+        except socket.error:
+            raise unittest.SkipTest('IPv6 is not available.')
+        return self._test_send_and_receive('::1')
+
+    def test_write_to_bad_address(self):
+        port, _ = self._listen()
+        for addr in (('localhost', 12345), ('::1', 12345)):
+            with self.assertRaises(error.InvalidAddressError):
+                port.write('Yellow Submarine', addr)
+        self.assertEqual(port._send_queue, [])
+
+    @defer.inlineCallbacks
+    def test_stop_listening_sends_queued_datagrams(self):
+        port1 = mmsg.listen_udp(0, DatagramRecorder(), '127.0.0.1')
+        port2, recorder = self._listen()
+        port1.write('Yellow Submarine', ('127.0.0.1', port2.getHost().port))
+        yield port1.stopListening()
+
+        yield self._wait_for(recorder, 1)
+        self.assertEqual(len(recorder.received), 1)
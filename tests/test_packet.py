@@ -1,6 +1,7 @@
 import unittest
 
 import six
+from google.protobuf import message
 
 from txrudp import packet
 
@@ -22,6 +23,13 @@ class TestPacketAPI(unittest.TestCase):
         self.assertEqual(p.ack, 0)
         self.assertFalse(p.fin)
         self.assertFalse(p.syn)
+        self.assertEqual(p.stream_id, 0)
+        self.assertEqual(p.stream_prev, 0)
+        self.assertEqual(p.skip, 0)
+        self.assertFalse(p.unordered)
+        self.assertIsNone(p.window)
+        self.assertEqual(p.fragment_count, 0)
+        self.assertEqual(p.cookie, '')
 
     def test_from_data_with_all_parametres(self):
         p = packet.Packet.from_data(
@@ -32,7 +40,14 @@ class TestPacketAPI(unittest.TestCase):
             more_fragments=4,
             ack=28,
             fin=True,
-            syn=True
+            syn=True,
+            stream_id=3,
+            stream_prev=12,
+            skip=7,
+            unordered=True,
+            window=0,
+            fragment_count=5,
+            cookie=b'cookie'
         )
         self.assertEqual(p.sequence_number, 1)
         self.assertEqual(p.dest_addr, self.dest_addr)
@@ -42,6 +57,13 @@ class TestPacketAPI(unittest.TestCase):
         self.assertEqual(p.ack, 28)
         self.assertTrue(p.fin)
         self.assertTrue(p.syn)
+        self.assertEqual(p.stream_id, 3)
+        self.assertEqual(p.stream_prev, 12)
+        self.assertEqual(p.skip, 7)
+        self.assertTrue(p.unordered)
+        self.assertEqual(p.window, 0)
+        self.assertEqual(p.fragment_count, 5)
+        self.assertEqual(p.cookie, b'cookie')
 
     def _make_packet_with_seqnum(self, seqnum):
         return packet.Packet.from_data(seqnum, self.dest_addr, self.source_addr)
@@ -70,6 +92,13 @@ class TestPacketAPI(unittest.TestCase):
         self.assertEqual(p1.ack, p2.ack)
         self.assertEqual(p1.fin, p2.fin)
         self.assertEqual(p1.syn, p2.syn)
+        self.assertEqual(p1.stream_id, p2.stream_id)
+        self.assertEqual(p1.stream_prev, p2.stream_prev)
+        self.assertEqual(p1.skip, p2.skip)
+        self.assertEqual(p1.unordered, p2.unordered)
+        self.assertEqual(p1.window, p2.window)
+        self.assertEqual(p1.fragment_count, p2.fragment_count)
+        self.assertEqual(p1.cookie, p2.cookie)
 
     def test_serialization_and_deserialization(self):
         p1 = packet.Packet.from_data(
@@ -80,7 +109,14 @@ class TestPacketAPI(unittest.TestCase):
             more_fragments=4,
             ack=28,
             fin=True,
-            syn=True
+            syn=True,
+            stream_id=3,
+            stream_prev=12,
+            skip=7,
+            unordered=True,
+            window=0,
+            fragment_count=5,
+            cookie=b'cookie'
         )
         bytes1 = p1.to_bytes()
         self.assertIsInstance(bytes1, six.binary_type)
@@ -88,6 +124,39 @@ class TestPacketAPI(unittest.TestCase):
         p2 = packet.Packet.from_bytes(bytes1)
         self._assert_packets_entirely_equal(p1, p2)
 
+    def test_peek_addrs(self):
+        datagram = packet.Packet.from_data(
+            sequence_number=1,
+            dest_addr=self.dest_addr,
+            source_addr=self.source_addr,
+            payload='Yellow submarine' * 64,
+            ack=28,
+            stream_id=3,
+            cookie=b'cookie'
+        ).to_bytes()
+        self.assertEqual(
+            packet.peek_addrs(datagram),
+            (self.dest_addr, self.source_addr)
+        )
+
+    def test_peek_addrs_of_bad_datagram(self):
+        datagram = packet.Packet.from_data(
+            1,
+            self.dest_addr,
+            self.source_addr,
+            payload='Yellow submarine'
+        ).to_bytes()
+        for bad_datagram in ('!@#4noise%^&*', datagram[:-1], datagram[:20]):
+            with self.assertRaises(message.DecodeError):
+                packet.peek_addrs(bad_datagram)
+
+    def test_validate_addrs(self):
+        packet.Packet.validate_addrs(self.dest_addr, self.source_addr)
+        with self.assertRaises(packet.ValidationError):
+            packet.Packet.validate_addrs(('127.0', 1), self.source_addr)
+        with self.assertRaises(packet.ValidationError):
+            packet.Packet.validate_addrs(self.dest_addr, ('127.0.0.1', 0))
+
     def _assert_packet_fails_validation(self, rudp_packet):
         with self.assertRaises(packet.ValidationError):
             packet.Packet.validate(rudp_packet)
@@ -119,6 +188,10 @@ class TestPacketAPI(unittest.TestCase):
         p.source_addr = ('FE80:0000:0000::z:B3FF:FE1E:8329', 1)
         self._assert_packet_fails_validation(p)
 
+        # Zero-padded octets are rejected, as inet_pton does.
+        p.source_addr = ('010.0.0.1', 1)
+        self._assert_packet_fails_validation(p)
+
     def test_validate_with_bad_source_port(self):
         p = packet.Packet.from_data(1, self.source_addr, self.source_addr)
 
@@ -0,0 +1,95 @@
+import unittest
+
+import mock
+
+from txrudp import constants, rate_limit
+
+
+class TestRateLimiterAPI(unittest.TestCase):
+
+    def test_burst(self):
+        limiter = rate_limit.RateLimiter(rate=10, burst=3)
+        allowed = [limiter.allow('a', 100) for _ in range(5)]
+        self.assertEqual(allowed, [True, True, True, False, False])
+
+    def test_refill(self):
+        limiter = rate_limit.RateLimiter(rate=10, burst=2)
+        self.assertTrue(limiter.allow('a', 100))
+        self.assertTrue(limiter.allow('a', 100))
+        self.assertFalse(limiter.allow('a', 100.05))
+
+        # One token is back after 1 / rate seconds.
+        self.assertTrue(limiter.allow('a', 100.11))
+        self.assertFalse(limiter.allow('a', 100.11))
+
+    def test_sustained_rate(self):
+        # The burst, then the rate: 10 + 2 * 100 events in 2 seconds.
+        limiter = rate_limit.RateLimiter(rate=100, burst=10)
+        allowed = sum(
+            limiter.allow('a', 100 + i * 0.001) for i in range(2000)
+        )
+        self.assertAlmostEqual(allowed, 210, delta=2)
+
+    def test_cost(self):
+        limiter = rate_limit.RateLimiter(rate=1000, burst=1500)
+        self.assertTrue(limiter.allow('a', 100, 1000))
+        self.assertFalse(limiter.allow('a', 100, 1000))
+        self.assertTrue(limiter.allow('a', 100, 500))
+        self.assertTrue(limiter.allow('a', 101, 1000))
+        self.assertFalse(limiter.allow('b', 100, 1501))
+
+    def test_keys_are_independent(self):
+        limiter = rate_limit.RateLimiter(rate=1, burst=1)
+        self.assertTrue(limiter.allow('a', 100))
+        self.assertFalse(limiter.allow('a', 100))
+        self.assertTrue(limiter.allow(('a', 1), 100))
+
+    def test_refilled_buckets_are_forgotten(self):
+        limiter = rate_limit.RateLimiter(rate=1, burst=1)
+        for i in range(100):
+            limiter.allow(i, 100)
+        self.assertEqual(len(limiter), 100)
+
+        limiter.allow('a', 101 + constants.RATE_LIMIT_PRUNE_INTERVAL)
+        self.assertEqual(len(limiter), 1)
+
+    def test_max_keys(self):
+        limiter = rate_limit.RateLimiter(rate=1, burst=1, max_keys=10)
+        for i in range(10):
+            self.assertTrue(limiter.allow(i, 100))
+
+        # New keys beyond the limit share a single bucket.
+        self.assertTrue(limiter.allow('a', 100))
+        self.assertFalse(limiter.allow('b', 100))
+        self.assertFalse(limiter.allow(0, 100))
+        self.assertEqual(len(limiter), 11)
+
+    def test_max_keys_prunes_early(self):
+        limiter = rate_limit.RateLimiter(rate=1, burst=1, max_keys=10)
+        for i in range(10):
+            self.assertTrue(limiter.allow(i, 100 + i * 0.1))
+
+        # The bucket of key 0 has refilled, which makes room for 'a';
+        # no other has, so 'b' and 'c' share the overflow bucket.
+        self.assertTrue(limiter.allow('a', 101.05))
+        self.assertEqual(len(limiter), 10)
+        self.assertTrue(limiter.allow('b', 101.05))
+        self.assertFalse(limiter.allow('c', 101.05))
+        self.assertEqual(len(limiter), 11)
+
+    def test_max_keys_bounds_early_prunes(self):
+        limiter = rate_limit.RateLimiter(rate=1, burst=1, max_keys=10)
+        with mock.patch.object(
+            limiter,
+            '_prune',
+            wraps=limiter._prune
+        ) as prune:
+            # Keys that keep changing, each refilling as a new one
+            # shows up, force a single early prune.
+            for i in range(90):
+                limiter.allow(i, 100 + i * 0.1)
+            self.assertEqual(prune.call_count, 2)
+            self.assertEqual(len(limiter), 11)
+
+            limiter.allow('a', 101 + constants.RATE_LIMIT_PRUNE_INTERVAL)
+            self.assertEqual(prune.call_count, 3)
@@ -5,7 +5,7 @@ import unittest
 import mock
 from twisted.internet import address, protocol, udp
 
-from txrudp import connection, packet, rudp
+from txrudp import connection, constants, packet, rate_limit, rudp
 
 
 class TestConnectionManagerAPI(unittest.TestCase):
@@ -18,12 +18,18 @@ class TestConnectionManagerAPI(unittest.TestCase):
         cls.addr2 = ('132.54.76.98', 54321)
         cls.addr3 = ('231.76.45.89', 15243)
 
-    def _make_cm(self):
-        cf = mock.Mock(spec_set=connection.ConnectionFactory)
+    def setUp(self):
+        reactor_patcher = mock.patch.object(rudp, 'REACTOR')
+        self.reactor_mock = reactor_patcher.start()
+        self.addCleanup(reactor_patcher.stop)
+        self.reactor_mock.seconds.return_value = 1000.5
+
+    def _make_cm(self, **kwargs):
+        kwargs.setdefault('logger', logging.Logger('CM'))
         return rudp.ConnectionMultiplexer(
-            cf,
+            mock.Mock(spec_set=connection.ConnectionFactory),
             self.public_ip,
-            logger=logging.Logger('CM')
+            **kwargs
         )
 
     def test_default_init(self):
@@ -146,8 +152,60 @@ class TestConnectionManagerAPI(unittest.TestCase):
         cm.datagramReceived(datagram, source_addr)
         mock_connection.receive_packet.assert_not_called()
 
-    def _make_connected_cm(self):
+    def test_receive_from_banned_network(self):
         cm = self._make_cm()
+        mock_connection = mock.Mock(spec_set=connection.Connection)
+        cm[self.addr2] = mock_connection
+        cm.ban_ip('132.54.0.0/16')
+        datagram = packet.Packet.from_data(
+            1,
+            (self.public_ip, self.port),
+            self.addr2
+        ).to_bytes()
+
+        # The sender is checked before the packet is parsed.
+        with mock.patch.object(packet.Packet, 'from_bytes') as from_bytes:
+            cm.datagramReceived(datagram, self.addr2)
+            from_bytes.assert_not_called()
+
+        # So is the source of relayed packets, once parsed.
+        cm.datagramReceived(datagram, self.addr3)
+        mock_connection.receive_packet.assert_not_called()
+
+        cm.allow_ip('132.54.76.0/24')
+        cm.datagramReceived(datagram, self.addr2)
+        self.assertEqual(mock_connection.receive_packet.call_count, 1)
+
+        cm.remove_ip_ban('132.54.76.0/24')
+        cm.datagramReceived(datagram, self.addr2)
+        self.assertEqual(mock_connection.receive_packet.call_count, 1)
+
+        cm.remove_ip_ban('132.54.0.0/16')
+        cm.datagramReceived(datagram, self.addr2)
+        self.assertEqual(mock_connection.receive_packet.call_count, 2)
+
+    def test_receive_from_zero_padded_banned_ip(self):
+        cm = self._make_cm()
+        cm.ban_ip('10.0.0.0/8')
+
+        # A zero-padded source IP neither crashes the ban check nor
+        # bypasses the ban.
+        for source_ip in ('010.0.0.1', '01.2.3.4'):
+            datagram = packet.Packet.from_data(
+                1,
+                (self.public_ip, self.port),
+                (source_ip, 12345),
+                syn=True
+            ).to_bytes()
+            cm.datagramReceived(datagram, self.addr3)
+        cm.connection_factory.make_new_connection.assert_not_called()
+
+        # Addresses that the ban rules cannot parse count as banned.
+        self.assertTrue(cm._is_banned('010.0.0.1'))
+        self.assertFalse(cm._is_banned('11.0.0.1'))
+
+    def _make_connected_cm(self, **kwargs):
+        cm = self._make_cm(**kwargs)
         transport = mock.Mock(spec_set=udp.Port)
         ret_val = address.IPv4Address('UDP', self.public_ip, self.port)
         transport.attach_mock(mock.Mock(return_value=ret_val), 'getHost')
@@ -187,6 +245,203 @@ class TestConnectionManagerAPI(unittest.TestCase):
         cm.transport.write.assert_called_once_with(datagram, (dest_ip, 12345))
         cm.connection_factory.make_new_connection.assert_not_called()
 
+    def test_relay_without_decoding(self):
+        cm = self._make_connected_cm()
+        cm.relaying = True
+
+        dest_addr = ('231.54.67.89', 12345)
+        datagram = packet.Packet.from_data(
+            1,
+            dest_addr,
+            self.addr1,
+            payload='Yellow Submarine'
+        ).to_bytes()
+
+        with mock.patch.object(packet.Packet, 'from_bytes') as from_bytes:
+            with mock.patch.object(
+                packet.Packet,
+                'validate_addrs',
+                wraps=packet.Packet.validate_addrs
+            ) as validate_addrs:
+                cm.datagramReceived(datagram, self.addr1)
+                cm.datagramReceived(datagram, self.addr2)
+            from_bytes.assert_not_called()
+
+        # The relay decision is cached per (source, destination) pair.
+        validate_addrs.assert_called_once_with(dest_addr, self.addr1)
+        self.assertEqual(
+            cm.transport.write.call_args_list,
+            [mock.call(datagram, dest_addr)] * 2
+        )
+        # Statistics are kept per sender, though.
+        stats = cm.relay_stats[(self.addr1, self.addr1, dest_addr)]
+        self.assertEqual(stats.packets, 1)
+        stats = cm.relay_stats[(self.addr2, self.addr1, dest_addr)]
+        self.assertEqual(stats.packets, 1)
+        self.assertEqual(stats.bytes, len(datagram))
+
+    def test_relay_from_banned_source(self):
+        cm = self._make_connected_cm()
+        cm.relaying = True
+
+        dest_addr = ('231.54.67.89', 12345)
+        datagram = packet.Packet.from_data(1, dest_addr, self.addr1).to_bytes()
+        cm.datagramReceived(datagram, self.addr2)
+        self.assertEqual(cm.transport.write.call_count, 1)
+
+        # Ban rules apply to cached decisions too.
+        cm.ban_ip(self.addr1[0])
+        cm.datagramReceived(datagram, self.addr2)
+        self.assertEqual(cm.transport.write.call_count, 1)
+        self.assertEqual(
+            cm.relay_stats[(self.addr2, self.addr1, dest_addr)].packets,
+            1
+        )
+
+    def test_relay_from_zero_padded_source(self):
+        cm = self._make_connected_cm()
+        cm.relaying = True
+        cm.ban_ip('10.0.0.0/8')
+
+        dest_addr = ('231.54.67.89', 12345)
+        for source_ip in ('010.0.0.1', '01.2.3.4'):
+            datagram = packet.Packet.from_data(
+                1,
+                dest_addr,
+                (source_ip, 12345)
+            ).to_bytes()
+            cm.datagramReceived(datagram, self.addr2)
+        cm.transport.write.assert_not_called()
+
+        # The ban check does not crash, should validation let one pass.
+        with mock.patch.object(packet.Packet, 'validate_addrs'):
+            self.assertFalse(
+                cm._check_relay_route(dest_addr, ('010.0.0.1', 12345))
+            )
+
+    def test_relay_to_bad_address(self):
+        cm = self._make_connected_cm()
+        cm.relaying = True
+
+        rudp_packet = packet.Packet.from_data(
+            1,
+            ('231.54.67.89', 12345),
+            self.addr1
+        )
+        rudp_packet.dest_addr = ('231.54.67', 12345)
+        cm.datagramReceived(rudp_packet.to_bytes(), self.addr1)
+        cm.transport.write.assert_not_called()
+        self.assertEqual(cm.relay_stats, {})
+
+    def _relay(self, cm, source_addr, dest_addr, size=100, addr=None):
+        datagram = packet.Packet.from_data(
+            1,
+            dest_addr,
+            source_addr,
+            payload='x' * size
+        ).to_bytes()
+        cm.transport.write.reset_mock()
+        cm.datagramReceived(datagram, addr or source_addr)
+        return cm.transport.write.called
+
+    @mock.patch.object(constants, 'RELAY_STATS_SIZE', 2)
+    def test_relay_stats_size(self):
+        cm = self._make_connected_cm()
+        cm.relaying = True
+        dest_addr = ('231.54.67.89', 12345)
+        source_addrs = [('132.54.76.98', port) for port in (1, 2, 3)]
+
+        # The least recently active flow is forgotten first.
+        for i in (0, 1, 0, 2):
+            self._relay(cm, source_addrs[i], dest_addr, addr=self.addr2)
+        self.assertEqual(
+            list(cm.relay_stats),
+            [
+                (self.addr2, source_addrs[0], dest_addr),
+                (self.addr2, source_addrs[2], dest_addr)
+            ]
+        )
+        self.assertEqual(
+            cm.relay_stats[(self.addr2, source_addrs[0], dest_addr)].packets,
+            2
+        )
+
+    def test_relay_flow_quota(self):
+        cm = self._make_connected_cm(
+            relay_flow_limiter=rate_limit.RateLimiter(rate=1000, burst=1500)
+        )
+        cm.relaying = True
+        dest_addr1 = ('231.54.67.89', 12345)
+        dest_addr2 = ('231.54.67.89', 12346)
+
+        self.assertTrue(self._relay(cm, self.addr1, dest_addr1, 1000))
+        self.assertFalse(self._relay(cm, self.addr1, dest_addr1, 1000))
+        self.assertTrue(self._relay(cm, self.addr1, dest_addr2, 1000))
+        self.reactor_mock.seconds.return_value += 1
+        self.assertTrue(self._relay(cm, self.addr1, dest_addr1, 1000))
+
+        # Another sender of the same packets is another flow.
+        self.assertTrue(
+            self._relay(cm, self.addr1, dest_addr1, 1000, addr=self.addr2)
+        )
+
+        stats = cm.relay_stats[(self.addr1, self.addr1, dest_addr1)]
+        self.assertEqual(stats.packets, 2)
+        self.assertEqual(stats.dropped_packets, 1)
+        self.assertGreater(stats.dropped_bytes, 1000)
+        self.assertEqual(
+            cm.dropped_packets,
+            {rudp.DropReason.RELAY_FLOW_QUOTA: 1}
+        )
+
+    def test_relay_source_quota(self):
+        cm = self._make_connected_cm(
+            relay_source_limiter=rate_limit.RateLimiter(rate=1000, burst=1500)
+        )
+        cm.relaying = True
+        dest_addr1 = ('231.54.67.89', 12345)
+        dest_addr2 = ('231.54.67.89', 12346)
+
+        self.assertTrue(self._relay(cm, self.addr1, dest_addr1, 1000))
+        self.assertFalse(self._relay(cm, self.addr1, dest_addr2, 1000))
+        self.assertTrue(self._relay(cm, self.addr2, dest_addr2, 1000))
+
+        # The quota applies to the sender, whatever source it claims.
+        self.assertFalse(
+            self._relay(cm, self.addr3, dest_addr1, 1000, addr=self.addr2)
+        )
+        self.assertEqual(
+            cm.dropped_packets,
+            {rudp.DropReason.RELAY_SOURCE_QUOTA: 2}
+        )
+
+    def test_relay_stats_by_source(self):
+        cm = self._make_connected_cm()
+        cm.relaying = True
+        dest_addr1 = ('231.54.67.89', 12345)
+        dest_addr2 = ('231.54.67.89', 12346)
+        self._relay(cm, self.addr1, dest_addr1)
+        self._relay(cm, self.addr1, dest_addr2)
+        self._relay(cm, (self.addr1[0], 1), dest_addr2)
+        self._relay(cm, self.addr2, dest_addr2)
+
+        # Traffic counts towards its sender, not its claimed source.
+        self._relay(cm, self.addr1, dest_addr2, addr=self.addr2)
+
+        by_source = cm.relay_stats_by_source()
+        self.assertEqual(set(by_source), {self.addr1[0], self.addr2[0]})
+        self.assertEqual(by_source[self.addr1[0]].packets, 3)
+        self.assertEqual(
+            by_source[self.addr1[0]].bytes,
+            sum(
+                stats.bytes
+                for (addr, _, _), stats in cm.relay_stats.items()
+                if addr[0] == self.addr1[0]
+            )
+        )
+        self.assertEqual(by_source[self.addr2[0]].packets, 2)
+        self.assertEqual(by_source[self.addr2[0]].dropped_packets, 0)
+
     def test_receive_datagram_in_existing_connection(self):
         cm = self._make_connected_cm()
 
@@ -254,6 +509,145 @@ class TestConnectionManagerAPI(unittest.TestCase):
         mock_connection = cm[source_addr]
         mock_connection.receive_packet.assert_called_once_with(rudp_packet, relay_addr)
 
+    def _receive_syn(self, cm, cookie=b'', source_addr=None):
+        if source_addr is None:
+            source_addr = self.addr3
+        rudp_packet = packet.Packet.from_data(
+            7,
+            (self.public_ip, self.port),
+            source_addr,
+            syn=True,
+            cookie=cookie
+        )
+        cm.transport.write.reset_mock()
+        cm.datagramReceived(rudp_packet.to_bytes(), source_addr)
+
+        if not cm.transport.write.called:
+            return None
+        datagram, addr = cm.transport.write.call_args[0]
+        self.assertEqual(addr, source_addr)
+        cookie_packet = packet.Packet.from_bytes(datagram)
+        self.assertFalse(cookie_packet.syn)
+        self.assertEqual(cookie_packet.ack, 8)
+        self.assertEqual(cookie_packet.dest_addr, source_addr)
+        return cookie_packet.cookie
+
+    def test_receive_syn_with_syn_cookies(self):
+        cm = self._make_connected_cm(syn_cookies=True)
+
+        # No state is created until the cookie is echoed.
+        cookie = self._receive_syn(cm)
+        self.assertTrue(cookie)
+        cm.connection_factory.make_new_connection.assert_not_called()
+        self.assertNotIn(self.addr3, cm)
+
+        self.reactor_mock.seconds.return_value += 2
+        self.assertIsNone(self._receive_syn(cm, cookie))
+        cm.connection_factory.make_new_connection.assert_called_once_with(
+            cm,
+            (self.public_ip, self.port),
+            self.addr3,
+            self.addr3
+        )
+        self.assertIn(self.addr3, cm)
+
+    def test_receive_syn_with_bad_syn_cookie(self):
+        cm = self._make_connected_cm(syn_cookies=True)
+        cookie = self._receive_syn(cm)
+
+        forged_cookie = cookie[:-1] + chr(ord(cookie[-1]) ^ 1)
+        self.assertIsNotNone(self._receive_syn(cm, forged_cookie))
+        self.assertIsNotNone(self._receive_syn(cm, cookie, self.addr2))
+        self.assertIsNotNone(self._receive_syn(cm, cookie[:-1]))
+        cm.connection_factory.make_new_connection.assert_not_called()
+
+    def test_receive_syn_with_expired_syn_cookie(self):
+        cm = self._make_connected_cm(syn_cookies=True)
+        cookie = self._receive_syn(cm)
+
+        self.reactor_mock.seconds.return_value += (
+            constants.SYN_COOKIE_LIFETIME + 1
+        )
+        self.assertIsNotNone(self._receive_syn(cm, cookie))
+        cm.connection_factory.make_new_connection.assert_not_called()
+
+    def _receive_casual(self, cm, source_addr, addr=None):
+        datagram = packet.Packet.from_data(
+            1,
+            (self.public_ip, self.port),
+            source_addr,
+            payload='Yellow Submarine'
+        ).to_bytes()
+        cm.datagramReceived(datagram, addr or source_addr)
+
+    def test_source_rate_limit(self):
+        cm = self._make_connected_cm(
+            source_limiter=rate_limit.RateLimiter(rate=1, burst=2)
+        )
+        mock_connection = mock.Mock(spec_set=connection.Connection)
+        cm[self.addr3] = mock_connection
+
+        self._receive_casual(cm, self.addr3)
+        self._receive_casual(cm, self.addr3)
+        with mock.patch.object(packet.Packet, 'from_bytes') as from_bytes:
+            self._receive_casual(cm, self.addr3)
+            self._receive_casual(cm, self.addr3, (self.addr3[0], 1))
+            from_bytes.assert_not_called()
+
+        self.assertEqual(mock_connection.receive_packet.call_count, 2)
+        self.assertEqual(
+            cm.dropped_packets,
+            {rudp.DropReason.SOURCE_RATE: 2}
+        )
+
+        # Other IPs are unaffected, and the bucket refills.
+        self._receive_casual(cm, self.addr2)
+        self.reactor_mock.seconds.return_value += 1
+        self._receive_casual(cm, self.addr3)
+        self.assertEqual(mock_connection.receive_packet.call_count, 3)
+
+    def test_address_rate_limit(self):
+        cm = self._make_connected_cm(
+            address_limiter=rate_limit.RateLimiter(rate=1, burst=1)
+        )
+        mock_connection = mock.Mock(spec_set=connection.Connection)
+        cm[self.addr3] = mock_connection
+
+        self._receive_casual(cm, self.addr3)
+        self._receive_casual(cm, self.addr3)
+        self._receive_casual(cm, self.addr3, (self.addr3[0], 1))
+
+        self.assertEqual(mock_connection.receive_packet.call_count, 2)
+        self.assertEqual(
+            cm.dropped_packets,
+            {rudp.DropReason.ADDRESS_RATE: 1}
+        )
+
+    def test_new_connection_rate_limit(self):
+        cm = self._make_connected_cm(
+            new_connection_limiter=rate_limit.RateLimiter(rate=1, burst=1)
+        )
+        other_addr = (self.addr3[0], 1)
+        for source_addr in (self.addr3, other_addr):
+            datagram = packet.Packet.from_data(
+                1,
+                (self.public_ip, self.port),
+                source_addr,
+                syn=True
+            ).to_bytes()
+            cm.datagramReceived(datagram, source_addr)
+
+        self.assertIn(self.addr3, cm)
+        self.assertNotIn(other_addr, cm)
+        self.assertEqual(
+            cm.dropped_packets,
+            {rudp.DropReason.NEW_CONNECTION_RATE: 1}
+        )
+
+        # Packets of existing connections are not limited.
+        self._receive_casual(cm, self.addr3)
+        self.assertEqual(cm[self.addr3].receive_packet.call_count, 2)
+
     def test_make_new_connection(self):
         cm = self._make_cm()
         cm.make_new_connection(self.addr1, self.addr2)
@@ -0,0 +1,113 @@
+import unittest
+
+from txrudp import send_queue
+
+
+class TestSendQueueAPI(unittest.TestCase):
+
+    class Message(object):
+
+        def __init__(self, name, count=1, deadline=None):
+            self.segments = (
+                (count - i - 1, (name, i)) for i in range(count)
+            )
+            self.deadline = deadline
+
+    def _pop_all(self, q):
+        segments = []
+        while q:
+            segments.append(q.popleft()[1][1])
+        return segments
+
+    def test_init(self):
+        q = send_queue.SendQueue(3, 16)
+        self.assertEqual(len(q), 0)
+
+    def test_pop_from_empty_queue(self):
+        q = send_queue.SendQueue(3, 16)
+        self.assertRaises(IndexError, q.popleft)
+
+    def test_fifo_within_level(self):
+        q = send_queue.SendQueue(3, 16)
+        q.push(self.Message('a'), 1)
+        q.push(self.Message('b'), 1)
+        self.assertEqual(len(q), 2)
+        self.assertEqual(self._pop_all(q), [('a', 0), ('b', 0)])
+
+    def test_higher_level_first(self):
+        q = send_queue.SendQueue(3, 16)
+        q.push(self.Message('low'), 2)
+        q.push(self.Message('normal'), 1)
+        q.push(self.Message('high'), 0)
+        self.assertEqual(
+            self._pop_all(q),
+            [('high', 0), ('normal', 0), ('low', 0)]
+        )
+
+    def test_no_switch_within_message(self):
+        q = send_queue.SendQueue(3, 16)
+        m = self.Message('normal', 3)
+        q.push(m, 1)
+        self.assertEqual(q.popleft(), (m, (2, ('normal', 0))))
+        q.push(self.Message('high'), 0)
+        self.assertEqual(len(q), 2)
+        self.assertEqual(
+            self._pop_all(q),
+            [('normal', 1), ('normal', 2), ('high', 0)]
+        )
+
+    def test_starvation_limit(self):
+        q = send_queue.SendQueue(2, 2)
+        q.push(self.Message('low'), 1)
+        for i in range(4):
+            q.push(self.Message(i), 0)
+        self.assertEqual(
+            self._pop_all(q),
+            [(0, 0), (1, 0), ('low', 0), (2, 0), (3, 0)]
+        )
+
+    def test_remove(self):
+        q = send_queue.SendQueue(3, 16)
+        m1 = self.Message('a', 2)
+        m2 = self.Message('b')
+        q.push(m1, 1)
+        q.push(m2, 1)
+
+        q.popleft()
+        self.assertFalse(q.remove(m1))
+        self.assertTrue(q.remove(m2))
+        self.assertFalse(q.remove(m2))
+        self.assertEqual(len(q), 1)
+        self.assertEqual(self._pop_all(q), [('a', 1)])
+
+    def test_clear(self):
+        q = send_queue.SendQueue(3, 16)
+        m1 = self.Message('a', 2)
+        m2 = self.Message('b')
+        q.push(m1, 1)
+        q.push(m2, 2)
+
+        q.popleft()
+        self.assertEqual(q.clear(), [m1, m2])
+        self.assertEqual(len(q), 0)
+        self.assertRaises(IndexError, q.popleft)
+
+    def test_drop_expired(self):
+        q = send_queue.SendQueue(3, 16)
+        m1 = self.Message('a', 2, deadline=1)
+        m2 = self.Message('b', deadline=1)
+        m3 = self.Message('c', deadline=3)
+        m4 = self.Message('d', deadline=1)
+        for m in (m1, m2, m3, m4):
+            q.push(m, 1)
+
+        # A partially sent message is never dropped; an expired
+        # message behind a live one waits until it reaches the front.
+        q.popleft()
+        self.assertEqual(q.drop_expired(2), [m2])
+        self.assertEqual(len(q), 3)
+        self.assertEqual(q.popleft()[1], (0, ('a', 1)))
+        self.assertEqual(q.drop_expired(2), [])
+        self.assertEqual(q.popleft()[1], (0, ('c', 0)))
+        self.assertEqual(q.drop_expired(2), [m4])
+        self.assertEqual(len(q), 0)
@@ -0,0 +1,113 @@
+import mock
+from twisted.trial import unittest
+
+from txrudp import connection, threaded_handler
+
+
+class FakeThreadPool(object):
+
+    """A thread pool running nothing until told to."""
+
+    def __init__(self):
+        self.calls = []
+
+    def callInThreadWithCallback(self, on_result, f, *args, **kwargs):
+        self.calls.append((on_result, f, args, kwargs))
+
+    def run_next(self, index=0):
+        on_result, f, args, kwargs = self.calls.pop(index)
+        try:
+            result = f(*args, **kwargs)
+        except Exception as e:
+            on_result(False, e)
+        else:
+            on_result(True, result)
+
+
+class TestThreadedHandlerAPI(unittest.TestCase):
+
+    def setUp(self):
+        self.reactor_mock = mock.Mock()
+        self.reactor_mock.callFromThread.side_effect = (
+            lambda f, *args: f(*args)
+        )
+        self.patch(threaded_handler, 'REACTOR', self.reactor_mock)
+
+        self.threadpool = FakeThreadPool()
+        self.handler_mock = mock.Mock(spec_set=connection.Handler)
+        self.con_mock = mock.Mock(spec_set=connection.Connection)
+        self.handler = threaded_handler.ThreadedHandler(
+            self.handler_mock,
+            self.threadpool,
+            max_pending=4
+        )
+        self.handler.connection = self.con_mock
+
+    def test_init(self):
+        self.assertIs(self.handler.handler, self.handler_mock)
+        self.assertIs(self.handler_mock.connection, self.con_mock)
+        self.assertIs(self.handler.connection, self.con_mock)
+
+    def test_callbacks_run_in_order(self):
+        self.handler.receive_message(b'a')
+        self.handler.receive_stream_message(1, b'b')
+        self.handler.handle_shutdown()
+
+        # One callback at a time is handed to the pool; the shutdown
+        # callback then runs on the reactor thread.
+        self.assertEqual(len(self.threadpool.calls), 1)
+        for _ in range(2):
+            self.threadpool.run_next()
+
+        self.assertEqual(
+            self.handler_mock.mock_calls,
+            [
+                mock.call.receive_message(b'a'),
+                mock.call.receive_stream_message(1, b'b'),
+                mock.call.handle_shutdown(),
+            ]
+        )
+        self.assertEqual(self.threadpool.calls, [])
+
+    def test_failed_callback_is_logged(self):
+        self.handler_mock.receive_message.side_effect = [ValueError, None]
+        self.handler.receive_message(b'a')
+        self.handler.receive_message(b'b')
+        self.threadpool.run_next()
+        self.threadpool.run_next()
+
+        self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
+        self.assertEqual(self.handler_mock.receive_message.call_count, 2)
+
+    def test_pause_connection_when_backlogged(self):
+        for i in range(4):
+            self.handler.receive_message(str(i))
+        self.con_mock.pauseProducing.assert_not_called()
+
+        self.handler.receive_message(b'4')
+        self.con_mock.pauseProducing.assert_called_once_with()
+
+        for _ in range(2):
+            self.threadpool.run_next()
+        self.con_mock.resumeProducing.assert_not_called()
+        self.threadpool.run_next()
+        self.con_mock.resumeProducing.assert_called_once_with()
+
+    def test_no_resume_after_shutdown(self):
+        for i in range(5):
+            self.handler.receive_message(str(i))
+        self.con_mock.pauseProducing.assert_called_once_with()
+
+        self.con_mock.state = connection.State.SHUTDOWN
+        for _ in range(3):
+            self.threadpool.run_next()
+        self.con_mock.resumeProducing.assert_not_called()
+
+    def test_handle_shutdown_runs_on_reactor_thread(self):
+        self.handler.receive_message(b'a')
+        self.handler.handle_shutdown()
+        self.handler_mock.handle_shutdown.assert_not_called()
+
+        self.threadpool.run_next()
+        self.handler_mock.handle_shutdown.assert_called_once_with()
+        self.assertEqual(self.threadpool.calls, [])
@@ -9,18 +9,31 @@ Classes:
 import abc
 import collections
 import enum
+import mmap
+import os
 import random
 
-from twisted.internet import reactor, task
+from twisted.internet import defer, error, interfaces, reactor, task
+from zope.interface import implementer
 
-from txrudp import constants, heap, packet
+from txrudp import constants, heap, packet, send_queue
 
 
 REACTOR = reactor
 
 State = enum.Enum('State', ('CONNECTING', 'CONNECTED', 'SHUTDOWN'))
 
+ShutdownReason = enum.Enum(
+    'ShutdownReason',
+    ('LOCAL', 'REMOTE', 'TIMEOUT', 'HANDSHAKE_TIMEOUT', 'ERROR')
+)
 
+Priority = enum.Enum('Priority', ('HIGH', 'NORMAL', 'LOW'))
+
+Reliability = enum.Enum('Reliability', ('RELIABLE', 'PARTIAL', 'UNRELIABLE'))
+
+
+@implementer(interfaces.IConsumer, interfaces.IPushProducer)
 class Connection(object):
 
     """
@@ -29,15 +42,108 @@ class Connection(object):
     It sequences inbound and outbound packets, acknowledges inbound
     packets, and retransmits lost outbound packets. It may also relay
     packets via other connections, to help with NAT traversal.
+
+    As an IConsumer, it accepts outbound data from a registered
+    producer, which it pauses while too much data is queued. As an
+    IPushProducer, it lets the application pause the delivery of
+    inbound messages, which in turn closes the receive window
+    advertised to the remote host.
     """
 
     _Address = collections.namedtuple('Address', ['ip', 'port'])
 
+    class OutboundMessage(object):
+
+        """A message queued for sending, with its delivery options."""
+
+        def __init__(
+            self,
+            segments,
+            size,
+            stream=0,
+            unordered=False,
+            max_retries=None,
+            expires_at=None,
+            deadline=None
+        ):
+            """
+            Create a new outbound message.
+
+            Args:
+                segments: An iterator over the segments of the message,
+                    as produced by `_gen_segments`.
+                size: The size of the message, in bytes.
+                stream: The stream of the message, as an integer.
+                unordered: Whether the message is delivered unordered.
+                max_retries: Number of retransmissions after which
+                    each packet is abandoned, as an integer, or None.
+                expires_at: Time after which each packet is abandoned,
+                    or None.
+                deadline: Time after which the message is dropped if
+                    none of it has been sent, or None.
+
+            The `deferred` attribute holds the Deferred returned to the
+            sender of the message.
+            """
+            self.segments = segments
+            self.size = size
+            self.stream = stream
+            self.unordered = unordered
+            self.max_retries = max_retries
+            self.expires_at = expires_at
+            self.deadline = deadline
+            self.deferred = None
+
+    class MessageTarget(object):
+
+        """A fragmented message written to a target as it arrives."""
+
+        def __init__(self, target, fragment_count):
+            """
+            Create a new message target.
+
+            Args:
+                target: The writable file or mmap supplied by the
+                    StreamingHandler.
+                fragment_count: The number of segments of the message.
+
+            Duplicate packets are discarded before they get here, so
+            counting the segments written is enough to tell when the
+            message is complete.
+            """
+            self.target = target
+            self.fragment_count = fragment_count
+            self.remaining = fragment_count
+            self.size = 0
+
+        def write(self, rudp_packet):
+            """
+            Write a segment at its offset in the message.
+
+            Args:
+                rudp_packet: A packet.Packet of the message, whose
+                    `more_fragments` is below the fragment count.
+            """
+            index = self.fragment_count - rudp_packet.more_fragments - 1
+            self.target.seek(index * constants.UDP_SAFE_SEGMENT_SIZE)
+            self.target.write(rudp_packet.payload)
+            self.remaining -= 1
+            self.size += len(rudp_packet.payload)
+
     class ScheduledPacket(object):
 
         """A packet scheduled for sending or currently in flight."""
 
-        def __init__(self, rudp_packet, timeout, timeout_cb, retries=0):
+        def __init__(
+            self,
+            rudp_packet,
+            timeout,
+            timeout_cb,
+            retries=0,
+            backoff=1,
+            max_retries=None,
+            expires_at=None
+        ):
             """
             Create a new scheduled packet.
 
@@ -47,13 +153,55 @@ class Connection(object):
                     as an integer.
                 timeout_cb: Callback to invoke upon timer expiration;
                     the callback should implement a `cancel` method.
+                    None if the connection uses a shared
+                    retransmission timer.
                 retries: Number of times this package has already
                     been sent, as an integer.
+                backoff: Factor by which the timeout grows after
+                    each transmission; if other than 1, the timeout
+                    is also randomly jittered.
+                max_retries: Number of retransmissions after which
+                    the packet is abandoned, as an integer, or None.
+                expires_at: Time after which the packet is abandoned
+                    instead of retransmitted, or None.
+
+            The `sent_at` attribute holds the time of the first
+            transmission of the packet; it is reset to None as soon as
+            the packet is sent again, since an ACK for a retransmitted
+            packet yields no trustworthy round-trip time sample.
+
+            The `deadline` attribute holds the time the packet is due
+            for retransmission, if the connection uses a shared
+            retransmission timer.
+
+            The `abandoned` attribute is set once the packet is no
+            longer retransmitted; it stays in the send window until
+            the remote host has been told to skip it.
+
+            The `deferred` attribute holds the Deferred of the message
+            whose last segment the packet carries, or None.
             """
             self.rudp_packet = rudp_packet
             self.timeout = timeout
             self.timeout_cb = timeout_cb
             self.retries = retries
+            self.backoff = backoff
+            self.max_retries = max_retries
+            self.expires_at = expires_at
+            self.sent_at = None
+            self.deadline = None
+            self.abandoned = False
+            self.deferred = None
+
+        def is_expired(self):
+            """Check whether the packet should be abandoned."""
+            return (
+                self.max_retries is not None and
+                self.retries > self.max_retries
+            ) or (
+                self.expires_at is not None and
+                REACTOR.seconds() >= self.expires_at
+            )
 
         def __repr__(self):
             return '{0}({1}, {2}, {3}, {4})'.format(
@@ -64,7 +212,17 @@ class Connection(object):
                 self.retries
             )
 
-    def __init__(self, proto, handler, own_addr, dest_addr, relay_addr=None):
+    def __init__(
+        self,
+        proto,
+        handler,
+        own_addr,
+        dest_addr,
+        relay_addr=None,
+        shared_retransmission_timer=False,
+        high_watermark=constants.SEND_HIGH_WATERMARK,
+        low_watermark=constants.SEND_LOW_WATERMARK
+    ):
         """
         Create a new connection and register it with the protocol.
 
@@ -72,14 +230,30 @@ class Connection(object):
             proto: Handler to underlying protocol.
             handler: Upstream recipient of received messages and
                 handler of other events. Should minimally implement
-                `receive_message` and `handle_shutdown`.
+                `receive_message` and `handle_shutdown`. If it is a
+                StreamingHandler, fragmented messages are passed to it
+                chunk by chunk; if it is a BatchHandler, messages are
+                passed to it in batches.
             own_addr: Tuple of local host address (ip, port).
             dest_addr: Tuple of remote host address (ip, port).
             relay_addr: Tuple of relay host address (ip, port).
+            shared_retransmission_timer: If True, use a single
+                retransmission timer for the whole send window,
+                instead of one timer per packet in flight.
+            high_watermark: Number of queued outbound bytes above
+                which a registered producer is paused.
+            low_watermark: Number of queued outbound bytes at or
+                below which a paused producer is resumed.
 
         If a relay address is specified, all outgoing packets are
         sent to that adddress, but the packets contain the address
         of their final destination. This is used for routing.
+
+        A shared retransmission timer is armed for the deadline of the
+        oldest packet in flight and is re-armed whenever an ACK retires
+        it; on expiry, every overdue packet in the window is resent.
+        This trades a walk of the send window on expiry for far fewer
+        live timers, which pays off with many concurrent connections.
         """
         self.own_addr = self._Address(*own_addr)
         self.dest_addr = self._Address(*dest_addr)
@@ -89,18 +263,82 @@ class Connection(object):
             self.relay_addr = self._Address(*relay_addr)
 
         self.handler = handler
+        self._streaming_handler = isinstance(handler, StreamingHandler)
+        self._batch_handler = isinstance(handler, BatchHandler)
 
         self._proto = proto
         self._state = State.CONNECTING
+        self._shutdown_reason = None
 
-        self._next_sequence_number = random.randrange(2**16 - 2)
-        self._next_expected_seqnum = 0
-        self._next_delivered_seqnum = 0
+        self._started_at = REACTOR.seconds()
+        self._handshake_duration = None
 
-        self._segment_queue = collections.deque()
+        self._next_sequence_number = random.randrange(1, 2**16 - 2)
+        self._next_expected_seqnum = 0
+        self._out_of_order_seqnums = set()
+
+        # The SYN cookie issued by the remote host, if any, is echoed
+        # by every SYN packet.
+        self._syn_cookie = ''
+
+        # The first message on each non-default stream is chained to
+        # the SYN packet of its sender, every later one to the last
+        # segment of the previous message on the same stream.
+        self._syn_seqnum = self._next_sequence_number
+        self._last_sent_seqnums = {}
+        self._at_message_boundary = True
+        self._remote_syn_seqnum = 0
+        self._last_delivered_seqnums = {}
+
+        self._segment_queue = send_queue.SendQueue(
+            len(Priority),
+            constants.STARVATION_LIMIT
+        )
         self._sending_window = collections.OrderedDict()
 
-        self._receive_heap = heap.Heap()
+        # Outbound flow control: a registered producer is paused while
+        # more than `high_watermark` bytes are queued, and the receive
+        # window of the remote host (None if unlimited) caps the send
+        # window. Only windows carried by packets that acknowledge at
+        # least as much as the last one are trusted.
+        self._producer = None
+        self._streaming_producer = False
+        self._producer_paused = False
+        self._queued_bytes = 0
+        self._high_watermark = high_watermark
+        self._low_watermark = low_watermark
+        self._remote_window = None
+        self._remote_window_ack = 0
+
+        self._receive_heaps = collections.defaultdict(heap.Heap)
+
+        # For a StreamingHandler, the sequence number of the next
+        # fragment of the message being delivered on each stream, and
+        # the MessageTarget (or None, if it declined to supply one) of
+        # each fragmented message, by its last sequence number.
+        self._next_fragment_seqnums = {}
+        self._message_targets = {}
+
+        # For a BatchHandler, the messages on the default stream
+        # delivered in the current reactor pass.
+        self._delivery_batch = []
+
+        # Inbound flow control: while delivery is paused, received
+        # packets pile up in the reorder buffers and the advertised
+        # window shrinks. Once it reopens after having been closed,
+        # the remote host is told so, repeatedly in case of loss.
+        # Buffered packets are counted even while delivery runs, so
+        # that the window is right as soon as it is paused.
+        self._receiving_paused = False
+        self._buffered_packets = 0
+        self._advertised_window = None
+        self._window_update_retries = 0
+
+        # Smoothed round-trip time; unknown until the first ACK for a
+        # packet that was sent exactly once arrives.
+        self._srtt = None
+
+        self._shared_retransmission_timer = shared_retransmission_timer
 
         self._looping_send = task.LoopingCall(self._dequeue_outbound_message)
         self._looping_receive = task.LoopingCall(self._pop_received_packet)
@@ -108,17 +346,51 @@ class Connection(object):
         # Initiate SYN sequence after receiving any pending SYN message.
         REACTOR.callLater(0, self._send_syn)
 
+        # Give up if the connection is not established in time.
+        self._handshake_handle = REACTOR.callLater(
+            constants.HANDSHAKE_TIMEOUT,
+            self._handshake_timed_out
+        )
+
         # Setup and immediately cancel the ACK loop; it should only
         # be activated once the connection is in CONNECTED state.
         # However, initializing here helps avoiding `is None` checks.
         self._ack_handle = REACTOR.callLater(1, self._send_ack)
         self._ack_handle.cancel()
 
+        # Same for the tail loss probe; it is armed whenever the send
+        # queue drains while packets are still in flight.
+        self._tlp_handle = REACTOR.callLater(1, self._send_tail_loss_probe)
+        self._tlp_handle.cancel()
+        self._tlp_seqnum = None
+
+        # Same for the shared retransmission timer, if used.
+        self._rto_handle = REACTOR.callLater(1, self._resend_overdue_packets)
+        self._rto_handle.cancel()
+
     @property
     def state(self):
         """Get the current state."""
         return self._state
 
+    @property
+    def shutdown_reason(self):
+        """
+        Get the reason of shutdown, as a ShutdownReason.
+
+        None if the connection has not been shutdown.
+        """
+        return self._shutdown_reason
+
+    @property
+    def handshake_duration(self):
+        """
+        Get the seconds it took to establish the connection.
+
+        None if the connection has not (yet) been established.
+        """
+        return self._handshake_duration
+
     def set_relay_address(self, relay_addr):
         """
         Change the relay address used on this connection.
@@ -128,19 +400,443 @@ class Connection(object):
         """
         self.relay_addr = self._Address(*relay_addr)
 
-    def send_message(self, message):
+    def send_message(
+        self,
+        message,
+        priority=Priority.NORMAL,
+        stream=0,
+        reliability=Reliability.RELIABLE,
+        max_retries=None,
+        lifetime=None,
+        deadline=None
+    ):
         """
         Send a message to the connected remote host, asynchronously.
 
         If the message is too large for proper transmission over UDP,
         it is first segmented appropriately.
 
+        Messages of higher priority are sent first, but a message
+        is never interrupted once its first segment has been sent.
+
+        Messages are delivered in the order they are sent only with
+        respect to messages on the same stream; a lost packet does
+        not hold back messages on other streams. Messages on the
+        default stream 0 are also ordered after any message sent
+        before them, on any stream.
+
+        An UNRELIABLE message is sent once and delivered as soon as
+        it arrives, if at all. A PARTIAL message keeps its place on
+        its stream, but it is abandoned, and skipped by the receiver,
+        once it has been retransmitted `max_retries` times or
+        `lifetime` seconds have passed since this call.
+
+        A message none of which has been sent within `deadline` (or
+        `lifetime`) seconds is dropped. Cancelling the returned
+        Deferred withdraws the message, unless some of it has already
+        been sent; the Deferred then fails with CancelledError
+        regardless.
+
+        If the connection is shutdown, every pending Deferred fails.
+        Like any Deferred, one whose failure is never handled logs it
+        as an unhandled error once garbage collected; applications
+        that ignore the outcome of their messages should at least trap
+        the failures they expect, e.g. error.ConnectionDone and
+        error.ConnectionLost.
+
         Args:
             message: The message to be sent, as bytes.
+            priority: The priority of the message, as a Priority.
+            stream: The stream of the message, as an integer from 0
+                to MAX_STREAM_ID.
+            reliability: The delivery mode, as a Reliability.
+            max_retries: The retransmission limit of a PARTIAL
+                message, as an integer.
+            lifetime: The lifetime of a PARTIAL message, in seconds.
+            deadline: Seconds after which the message is dropped if
+                none of it has been sent, or None.
+
+        Returns:
+            A Deferred that fires once the whole message has been
+            acknowledged by the remote host. It fails with
+            defer.TimeoutError if the message was dropped or
+            abandoned, and with error.ConnectionDone or
+            error.ConnectionLost if the connection is shutdown first.
+
+        Raises:
+            ValueError: A message that is not RELIABLE does not fit
+                in a single segment, a PARTIAL message has neither
+                `max_retries` nor `lifetime`, or the stream is out
+                of range.
+        """
+        self._check_stream(stream)
+        if reliability != Reliability.RELIABLE:
+            if len(message) > constants.UDP_SAFE_SEGMENT_SIZE:
+                raise ValueError('Unreliable messages cannot be segmented.')
+            if reliability == Reliability.UNRELIABLE:
+                max_retries = 0
+            elif max_retries is None and lifetime is None:
+                raise ValueError('Partial reliability requires a limit.')
+
+        return self._enqueue_message(
+            self._gen_segments(message),
+            len(message),
+            priority,
+            stream,
+            reliability == Reliability.UNRELIABLE,
+            max_retries,
+            lifetime,
+            deadline
+        )
+
+    def send_messages(self, messages, priority=Priority.NORMAL, stream=0):
+        """
+        Send several messages to the connected remote host, at once.
+
+        This is equivalent to calling `send_message` for each message,
+        with RELIABLE delivery, but the send queue is only trimmed and
+        checked once.
+
+        Args:
+            messages: An iterable of messages, as bytes.
+            priority: The priority of the messages, as a Priority.
+            stream: The stream of the messages, as an integer from 0
+                to MAX_STREAM_ID.
+
+        Returns:
+            A Deferred that fires with a list of None once every
+            message has been acknowledged, or fails with a
+            defer.FirstError wrapping the first failure.
+
+        Raises:
+            ValueError: The stream is out of range.
+        """
+        self._check_stream(stream)
+        self._drop_expired_messages()
+        deferreds = []
+        for message in messages:
+            if not message:
+                deferreds.append(defer.succeed(None))
+                continue
+            outbound_message = self._make_outbound_message(
+                self._gen_segments(message),
+                len(message),
+                stream,
+                False,
+                None,
+                None,
+                None
+            )
+            self._push_outbound_message(outbound_message, priority)
+            deferreds.append(outbound_message.deferred)
+        self._attempt_enabling_looping_send()
+        return defer.gatherResults(deferreds, consumeErrors=True)
+
+    def send_buffer(
+        self,
+        data,
+        priority=Priority.NORMAL,
+        stream=0,
+        deadline=None
+    ):
+        """
+        Send the contents of a buffer as a message, asynchronously.
+
+        Unlike `send_message`, any object supporting `len` and slicing
+        is accepted (e.g. a bytearray or an mmap); each segment is only
+        copied out of the buffer when it is about to be sent. The
+        message is RELIABLE, and the buffer must not change until the
+        returned Deferred has fired.
+
+        Args:
+            data: A buffer holding the contents of the message.
+            priority: The priority of the message, as a Priority.
+            stream: The stream of the message, as an integer from 0
+                to MAX_STREAM_ID.
+            deadline: Seconds after which the message is dropped if
+                none of it has been sent, or None.
+
+        Returns:
+            A Deferred, as for `send_message`.
+
+        Raises:
+            ValueError: The stream is out of range.
+        """
+        self._check_stream(stream)
+        segments = (
+            (more_fragments, bytes(segment))
+            for more_fragments, segment in self._gen_segments(data)
+        )
+        return self._enqueue_message(
+            segments,
+            len(data),
+            priority,
+            stream,
+            deadline=deadline
+        )
+
+    def send_file(
+        self,
+        file_obj,
+        priority=Priority.NORMAL,
+        stream=0,
+        deadline=None
+    ):
+        """
+        Send the contents of a file as a message, asynchronously.
+
+        The file is memory-mapped and each segment is read from the
+        map when it is about to be sent, so that only the packets in
+        flight are held in memory, whatever the size of the file. The
+        map is closed once its last segment has been read, or once
+        the message is dropped; `file_obj` itself may be closed as
+        soon as this method returns.
+
+        Args:
+            file_obj: A file object open for reading, backed by
+                a file descriptor.
+            priority: The priority of the message, as a Priority.
+            stream: The stream of the message, as an integer from 0
+                to MAX_STREAM_ID.
+            deadline: Seconds after which the message is dropped if
+                none of it has been sent, or None.
+
+        Returns:
+            A Deferred, as for `send_message`.
+
+        Raises:
+            EnvironmentError: The file cannot be mapped.
+            ValueError: The stream is out of range.
+        """
+        self._check_stream(stream)
+        # Empty files cannot be mapped.
+        if not os.fstat(file_obj.fileno()).st_size:
+            return defer.succeed(None)
+
+        mapped = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._enqueue_message(
+            self._gen_mapped_segments(mapped),
+            len(mapped),
+            priority,
+            stream,
+            deadline=deadline
+        )
+
+    @staticmethod
+    def _check_stream(stream):
+        """
+        Check that a stream is valid for an outbound message.
+
+        Args:
+            stream: The stream, as an integer.
+
+        Raises:
+            ValueError: The stream is out of range.
+        """
+        if not 0 <= stream <= constants.MAX_STREAM_ID:
+            raise ValueError('Stream out of range: {0}'.format(stream))
+
+    def _enqueue_message(
+        self,
+        segments,
+        size,
+        priority,
+        stream,
+        unordered=False,
+        max_retries=None,
+        lifetime=None,
+        deadline=None
+    ):
+        """
+        Queue the segments of a message for sending.
+
+        Args:
+            segments: An iterator over the segments of the message,
+                as produced by `_gen_segments`.
+            size: The size of the message, in bytes.
+            priority: The priority of the message, as a Priority.
+            stream: The stream of the message, as an integer.
+            unordered: Whether the message is delivered unordered.
+            max_retries: Number of retransmissions after which each
+                packet is abandoned, or None.
+            lifetime: Seconds after which each packet is abandoned,
+                or None.
+            deadline: Seconds after which the message is dropped if
+                none of it has been sent, or None.
+
+        Returns:
+            The Deferred of the message.
         """
-        for segment in self._gen_segments(message):
-            self._segment_queue.append(segment)
+        if not size:
+            return defer.succeed(None)
+
+        outbound_message = self._make_outbound_message(
+            segments,
+            size,
+            stream,
+            unordered,
+            max_retries,
+            lifetime,
+            deadline
+        )
+
+        # Shed stale messages before the queue grows any further.
+        self._drop_expired_messages()
+        self._push_outbound_message(outbound_message, priority)
         self._attempt_enabling_looping_send()
+        return outbound_message.deferred
+
+    def _make_outbound_message(
+        self,
+        segments,
+        size,
+        stream,
+        unordered,
+        max_retries,
+        lifetime,
+        deadline
+    ):
+        """
+        Create an OutboundMessage and its Deferred.
+
+        Args:
+            See `_enqueue_message`.
+
+        Returns:
+            The OutboundMessage.
+        """
+        now = REACTOR.seconds()
+        expires_at = None if lifetime is None else now + lifetime
+        if deadline is not None:
+            deadline = now + deadline
+            if expires_at is not None:
+                deadline = min(deadline, expires_at)
+        else:
+            deadline = expires_at
+
+        outbound_message = self.OutboundMessage(
+            segments,
+            size,
+            stream,
+            unordered,
+            max_retries,
+            expires_at,
+            deadline
+        )
+        outbound_message.deferred = defer.Deferred(
+            lambda _: self._withdraw_message(outbound_message)
+        )
+        return outbound_message
+
+    def _push_outbound_message(self, outbound_message, priority):
+        """
+        Push an OutboundMessage to the send queue.
+
+        Pause the registered producer if the queue grows too long.
+
+        Args:
+            outbound_message: The OutboundMessage.
+            priority: The priority of the message, as a Priority.
+        """
+        self._segment_queue.push(outbound_message, priority.value - 1)
+        self._queued_bytes += outbound_message.size
+        if (
+            self._streaming_producer and
+            not self._producer_paused and
+            self._queued_bytes > self._high_watermark
+        ):
+            self._producer_paused = True
+            self._producer.pauseProducing()
+
+    def registerProducer(self, producer, streaming):
+        """
+        Register a producer of outbound data.
+
+        A streaming (push) producer is paused once more than
+        `high_watermark` bytes are queued, and resumed once at most
+        `low_watermark` bytes remain. A non-streaming (pull) producer
+        is asked for more data after each write, once at most
+        `low_watermark` bytes remain queued.
+
+        Args:
+            producer: An IPushProducer if `streaming` is True, an
+                IPullProducer otherwise.
+            streaming: Whether the producer is a push producer.
+
+        Raises:
+            RuntimeError: Another producer is already registered.
+        """
+        if self._producer is not None:
+            raise RuntimeError(
+                'Cannot register producer {0}, because producer {1} '
+                'was never unregistered.'.format(producer, self._producer)
+            )
+        if self._state == State.SHUTDOWN:
+            producer.stopProducing()
+            return
+
+        self._producer = producer
+        self._streaming_producer = streaming
+        if not streaming:
+            producer.resumeProducing()
+
+    def unregisterProducer(self):
+        """Stop consuming data from the registered producer."""
+        self._producer = None
+        self._streaming_producer = False
+        self._producer_paused = False
+
+    def write(self, data):
+        """
+        Send data as a single RELIABLE message.
+
+        Unlike `send_message`, no Deferred is returned; a failure
+        to deliver the data shows as a shutdown of the connection.
+
+        Args:
+            data: The data to send, as bytes.
+        """
+        self.send_message(data).addErrback(
+            lambda failure: failure.trap(
+                error.ConnectionDone,
+                error.ConnectionLost
+            )
+        )
+        if self._producer is not None and not self._streaming_producer:
+            self._producer_paused = True
+
+    def pauseProducing(self):
+        """
+        Stop delivering inbound messages to the handler.
+
+        Received packets are buffered meanwhile, and the window
+        advertised to the remote host shrinks accordingly, until it
+        stops sending. UNRELIABLE messages received meanwhile are
+        dropped. Nothing happens once the connection is SHUTDOWN.
+        """
+        if self._state == State.SHUTDOWN:
+            return
+        self._receiving_paused = True
+        self._attempt_disabling_looping_receive()
+
+    def resumeProducing(self):
+        """
+        Resume delivering inbound messages to the handler.
+
+        Nothing happens once the connection is SHUTDOWN; in
+        particular, no window update is sent.
+        """
+        if self._state == State.SHUTDOWN:
+            return
+        self._receiving_paused = False
+        if self._advertised_window == 0:
+            self._send_window_update()
+        self._attempt_enabling_looping_receive()
+
+    def stopProducing(self):
+        """Shutdown the connection, unless it is already SHUTDOWN."""
+        if self._state != State.SHUTDOWN:
+            self.shutdown()
 
     def receive_packet(self, rudp_packet, from_addr):
         """
@@ -171,11 +867,14 @@ class Connection(object):
         elif rudp_packet.syn:
             if self._state == State.CONNECTING:
                 self._process_syn_packet(rudp_packet)
+        elif rudp_packet.cookie:
+            if self._state == State.CONNECTING:
+                self._process_cookie_packet(rudp_packet)
         else:
             if self._state == State.CONNECTED:
                 self._process_casual_packet(rudp_packet)
 
-    def shutdown(self):
+    def shutdown(self, reason=ShutdownReason.LOCAL):
         """
         Terminate connection with remote endpoint.
 
@@ -187,14 +886,27 @@ class Connection(object):
         The handler should prevent the connection from receiving
         any future messages. The simplest way to do this is to
         remove the connection from the protocol.
+
+        Args:
+            reason: Why the connection is terminated, as a
+                ShutdownReason; it is exposed to the handler via
+                the `shutdown_reason` property.
         """
         self._state = State.SHUTDOWN
+        if self._shutdown_reason is None:
+            self._shutdown_reason = reason
 
         self._send_fin()
+        self._cancel_handshake_timeout()
         self._cancel_ack_timeout()
+        self._cancel_tlp_timeout()
         self._attempt_disabling_looping_send(force=True)
         self._attempt_disabling_looping_receive()
+        self._fail_pending_messages()
         self._clear_sending_window()
+        if self._producer is not None:
+            self._producer.stopProducing()
+            self.unregisterProducer()
 
         self.handler.handle_shutdown()
 
@@ -232,17 +944,115 @@ class Connection(object):
         )
         return segments
 
+    @staticmethod
+    def _gen_mapped_segments(mapped):
+        """
+        Split a memory map into segments, then close it.
+
+        Args:
+            mapped: An mmap.mmap.
+
+        Yields:
+            Tuples as `_gen_segments` does.
+        """
+        try:
+            for segment in Connection._gen_segments(mapped):
+                yield segment
+        finally:
+            mapped.close()
+
+    def _withdraw_message(self, outbound_message):
+        """
+        Remove a message none of which has been sent from the queue.
+
+        Args:
+            outbound_message: The OutboundMessage to withdraw.
+        """
+        if self._segment_queue.remove(outbound_message):
+            self._release_queued_bytes(outbound_message.size)
+
+    def _drop_expired_messages(self):
+        """Drop queued messages past their deadline."""
+        for outbound_message in self._segment_queue.drop_expired(
+            REACTOR.seconds()
+        ):
+            self._release_queued_bytes(outbound_message.size)
+            outbound_message.deferred.errback(
+                defer.TimeoutError('Message expired before being sent.')
+            )
+
+    def _release_queued_bytes(self, size):
+        """
+        Account for bytes leaving the queue; resume the producer.
+
+        Args:
+            size: The number of bytes, as an integer.
+        """
+        self._queued_bytes -= size
+        if self._producer_paused and self._queued_bytes <= self._low_watermark:
+            self._producer_paused = False
+            self._producer.resumeProducing()
+
+    def _get_send_window_size(self):
+        """Return the number of packets allowed in flight."""
+        if self._remote_window is None:
+            return constants.WINDOW_SIZE
+        return min(constants.WINDOW_SIZE, self._remote_window)
+
+    def _get_receive_window(self):
+        """
+        Return the receive window to advertise, or None.
+
+        The window is the number of packets that still fit in the
+        receive buffer; it is only advertised while delivery is
+        paused, and once it limits the remote host, that is, once it
+        is below WINDOW_SIZE. While delivery runs, packets are only
+        buffered for reordering and reassembly, and a message larger
+        than the buffer must still get through.
+        """
+        if not self._receiving_paused:
+            return None
+        window = max(
+            0,
+            constants.RECEIVE_BUFFER_SIZE - self._buffered_packets
+        )
+        if window < constants.WINDOW_SIZE:
+            return window
+        return None
+
+    def _count_packets_in_flight(self):
+        """
+        Return the number of packets occupying the send window.
+
+        Subclasses that finalize packets asynchronously should count
+        the packets still being finalized.
+        """
+        return len(self._sending_window)
+
+    def _get_unscheduled_seqnum(self):
+        """
+        Return the lowest sequence number not yet in the send window.
+
+        Neither a skip notice nor an ACK may reach past it. Subclasses
+        that finalize packets asynchronously should return the lowest
+        sequence number still being finalized.
+        """
+        return self._next_sequence_number
+
     def _attempt_enabling_looping_send(self):
         """
         Enable dequeuing if a packet can be scheduled immediately.
+
+        Dequeuing starts on the next reactor iteration, so that
+        segments queued meanwhile go out in the same burst.
         """
         if (
             not self._looping_send.running and
             self._state == State.CONNECTED and
-            len(self._sending_window) < constants.WINDOW_SIZE and
+            self._count_packets_in_flight() < self._get_send_window_size() and
             len(self._segment_queue)
         ):
-            self._looping_send.start(0, now=True)
+            self._looping_send.start(0, now=False)
 
     def _attempt_disabling_looping_send(self, force=False):
         """
@@ -254,7 +1064,10 @@ class Connection(object):
         if (
             self._looping_send.running and (
                 force or
-                len(self._sending_window) >= constants.WINDOW_SIZE or
+                (
+                    self._count_packets_in_flight() >=
+                    self._get_send_window_size()
+                ) or
                 not len(self._segment_queue)
             )
         ):
@@ -273,14 +1086,31 @@ class Connection(object):
         The current ACK number is included; if it is greater than
         0, then this actually is a SYNACK packet.
         """
-        syn_packet = packet.Packet.from_data(
-            self._get_next_sequence_number(),
+        syn_packet = self._make_syn_packet(self._get_next_sequence_number())
+        self._schedule_send_in_order(
+            syn_packet,
+            constants.PACKET_TIMEOUT,
+            constants.SYN_BACKOFF_FACTOR
+        )
+
+    def _make_syn_packet(self, seqnum):
+        """
+        Create a SYN packet, echoing the SYN cookie if there is one.
+
+        Args:
+            seqnum: The sequence number of the SYN packet.
+
+        Returns:
+            A packet.Packet with SYN flag set.
+        """
+        return packet.Packet.from_data(
+            seqnum,
             self.dest_addr,
             self.own_addr,
             ack=self._next_expected_seqnum,
-            syn=True
+            syn=True,
+            cookie=self._syn_cookie
         )
-        self._schedule_send_in_order(syn_packet, constants.PACKET_TIMEOUT)
 
     def _send_ack(self):
         """
@@ -300,6 +1130,21 @@ class Connection(object):
         )
         self._schedule_send_out_of_order(ack_packet)
 
+        if self._window_update_retries:
+            self._window_update_retries -= 1
+            self._reset_ack_timeout(constants.PACKET_TIMEOUT)
+
+    def _send_window_update(self):
+        """
+        Tell the remote host that the receive window has reopened.
+
+        The remote host may be waiting for nothing else, so the bare
+        ACK packet is repeated, up to MAX_RETRANSMISSIONS times, until
+        a new packet arrives.
+        """
+        self._window_update_retries = constants.MAX_RETRANSMISSIONS
+        self._send_ack()
+
     def _send_fin(self):
         """
         Create and schedule a FIN packet.
@@ -319,6 +1164,33 @@ class Connection(object):
         )
         self._schedule_send_out_of_order(fin_packet)
 
+    def _send_skip(self):
+        """
+        Create and schedule a bare packet skipping abandoned packets.
+
+        The remote host is told to consider received every packet
+        up to the first one in flight that has not been abandoned,
+        and none still being finalized. Nothing is sent if the oldest
+        packet in flight has not been abandoned; the notice is sent
+        again whenever an abandoned packet times out, until it is
+        acknowledged.
+        """
+        skip = self._get_unscheduled_seqnum()
+        for seqnum, sch_packet in self._sending_window.iteritems():
+            if not sch_packet.abandoned:
+                skip = seqnum
+                break
+
+        if skip > next(iter(self._sending_window), skip):
+            skip_packet = packet.Packet.from_data(
+                0,
+                self.dest_addr,
+                self.own_addr,
+                ack=self._next_expected_seqnum,
+                skip=skip
+            )
+            self._schedule_send_out_of_order(skip_packet)
+
     def _schedule_send_out_of_order(self, rudp_packet):
         """
         Schedule a package to be sent out of order.
@@ -328,47 +1200,189 @@ class Connection(object):
         Args:
             rudp_packet: The packet.Packet to be sent.
         """
+        self._set_advertised_window(rudp_packet)
         final_packet = self._finalize_packet(rudp_packet)
         self._proto.send_datagram(final_packet, self.relay_addr)
 
-    def _schedule_send_in_order(self, rudp_packet, timeout):
+    def _set_advertised_window(self, rudp_packet):
+        """
+        Advertise the current receive window on an outbound packet.
+
+        Args:
+            rudp_packet: The packet.Packet to be sent.
+        """
+        self._advertised_window = self._get_receive_window()
+        rudp_packet.window = self._advertised_window
+
+    def _schedule_send_in_order(
+        self,
+        rudp_packet,
+        timeout,
+        backoff=1,
+        max_retries=None,
+        expires_at=None,
+        deferred=None
+    ):
         """
         Schedule a package to be sent and set the timeout timer.
 
         Args:
             rudp_packet: The packet.Packet to be sent.
             timeout: The timeout for this packet type.
+            backoff: Factor by which the timeout grows after each
+                retransmission.
+            max_retries: Number of retransmissions after which the
+                packet is abandoned, or None.
+            expires_at: Time after which the packet is abandoned,
+                or None.
+            deferred: The Deferred of the message whose last segment
+                the packet carries, or None.
         """
-        final_packet = self._finalize_packet(rudp_packet)
-        seqnum = rudp_packet.sequence_number
-        timeout_cb = REACTOR.callLater(0, self._do_send_packet, seqnum)
-        self._sending_window[seqnum] = self.ScheduledPacket(
+        args = (timeout, backoff, max_retries, expires_at, deferred)
+        self._schedule_batch_in_order([(rudp_packet, args)])
+
+    def _schedule_batch_in_order(self, items):
+        """
+        Finalize packets at once, then schedule each to be sent.
+
+        Args:
+            items: A list of tuples of a packet.Packet and a tuple of
+                the remaining arguments of `_schedule_send_in_order`.
+        """
+        rudp_packets = [rudp_packet for rudp_packet, _ in items]
+        for rudp_packet in rudp_packets:
+            self._set_advertised_window(rudp_packet)
+        final_packets = self._finalize_packets(rudp_packets)
+        for (rudp_packet, args), final_packet in zip(items, final_packets):
+            self._schedule_finalized_packet(
+                rudp_packet.sequence_number,
+                final_packet,
+                *args
+            )
+
+    def _schedule_finalized_packet(
+        self,
+        seqnum,
+        final_packet,
+        timeout,
+        backoff=1,
+        max_retries=None,
+        expires_at=None,
+        deferred=None
+    ):
+        """
+        Add a finalized packet to the send window and send it.
+
+        Args:
+            seqnum: The sequence number of the packet.
+            final_packet: The packet, as returned by `_finalize_packet`.
+            timeout: The timeout for this packet type.
+            backoff: Factor by which the timeout grows after each
+                retransmission.
+            max_retries: Number of retransmissions after which the
+                packet is abandoned, or None.
+            expires_at: Time after which the packet is abandoned,
+                or None.
+            deferred: The Deferred of the message whose last segment
+                the packet carries, or None.
+        """
+        if self._shared_retransmission_timer:
+            timeout_cb = None
+        else:
+            timeout_cb = REACTOR.callLater(0, self._do_send_packet, seqnum)
+        sch_packet = self.ScheduledPacket(
             final_packet,
             timeout,
             timeout_cb,
-            0
+            0,
+            backoff,
+            max_retries,
+            expires_at
         )
+        sch_packet.deferred = deferred
+        self._sending_window[seqnum] = sch_packet
+        if self._shared_retransmission_timer:
+            self._do_send_packet(seqnum)
 
     def _dequeue_outbound_message(self):
         """
-        Deque a message, wrap it into an RUDP packet and schedule it.
+        Deque a burst of segments, wrap them into RUDP packets and
+        schedule them.
 
-        Pause dequeueing if it would overflow the send window.
+        Up to SEND_BURST_SIZE segments are dequeued at once, as long
+        as the send window allows; their packets are finalized
+        together. Pause dequeueing if it would overflow the send window.
         """
         assert self._segment_queue, 'Looping send active despite empty queue.'
-        more_fragments, message = self._segment_queue.popleft()
+        items = []
+        window_size = self._get_send_window_size()
+        while (
+            len(items) < constants.SEND_BURST_SIZE and
+            self._count_packets_in_flight() + len(items) < window_size
+        ):
+            self._drop_expired_messages()
+            if not self._segment_queue:
+                break
+            items.append(self._dequeue_segment())
+
+        if items:
+            self._schedule_batch_in_order(items)
+            if not self._segment_queue:
+                self._reset_tlp_timeout()
+        self._attempt_disabling_looping_send()
 
-        rudp_packet = packet.Packet.from_data(
-            self._get_next_sequence_number(),
-            self.dest_addr,
+    def _dequeue_segment(self):
+        """
+        Deque a segment and wrap it into an RUDP packet.
+
+        Returns:
+            A tuple of the packet.Packet and a tuple of the remaining
+            arguments of `_schedule_send_in_order`.
+        """
+        outbound_message, segment = self._segment_queue.popleft()
+        more_fragments, message = segment
+        seqnum = self._get_next_sequence_number()
+
+        max_size = constants.UDP_SAFE_SEGMENT_SIZE
+        fragment_count = (outbound_message.size + max_size - 1) // max_size
+        if fragment_count == 1:
+            fragment_count = 0
+
+        # Only the first segment of a message is chained to the
+        # previous message on its stream; unordered messages are
+        # not chained at all.
+        stream = outbound_message.stream
+        stream_prev = 0
+        if stream and not outbound_message.unordered:
+            if self._at_message_boundary:
+                stream_prev = self._last_sent_seqnums.get(
+                    stream,
+                    self._syn_seqnum
+                )
+            if not more_fragments:
+                self._last_sent_seqnums[stream] = seqnum
+        self._at_message_boundary = not more_fragments
+
+        rudp_packet = packet.Packet.from_data(
+            seqnum,
+            self.dest_addr,
             self.own_addr,
             message,
             more_fragments,
-            ack=self._next_expected_seqnum
+            ack=self._next_expected_seqnum,
+            stream_id=stream,
+            stream_prev=stream_prev,
+            unordered=outbound_message.unordered,
+            fragment_count=fragment_count
+        )
+        self._release_queued_bytes(len(message))
+        return rudp_packet, (
+            constants.PACKET_TIMEOUT,
+            1,
+            outbound_message.max_retries,
+            outbound_message.expires_at,
+            None if more_fragments else outbound_message.deferred
         )
-        self._schedule_send_in_order(rudp_packet, constants.PACKET_TIMEOUT)
-
-        self._attempt_disabling_looping_send()
 
     def _finalize_packet(self, rudp_packet):
         """
@@ -387,6 +1401,27 @@ class Connection(object):
         """
         return rudp_packet.to_bytes()
 
+    def _finalize_packets(self, rudp_packets):
+        """
+        Convert a batch of packet.Packets to bytes.
+
+        Packets sent in order are finalized in batches through this
+        method; override it to amortize the cost of processing packets
+        one at a time. The default implementation calls
+        `_finalize_packet` for each packet; overrides must process
+        each packet as `_finalize_packet` would.
+
+        Args:
+            rudp_packets: A list of packet.Packets.
+
+        Returns:
+            A list of the protobuf-encoded packets, in the same order.
+        """
+        return [
+            self._finalize_packet(rudp_packet)
+            for rudp_packet in rudp_packets
+        ]
+
     def _do_send_packet(self, seqnum):
         """
         Immediately dispatch packet with given sequence number.
@@ -399,6 +1434,10 @@ class Connection(object):
         shutdown sequence is initiated. Finally, the timeout for the
         looping ACK sender is reset.
 
+        A packet that has outlived its delivery limits is abandoned;
+        instead of the packet, the remote host is told to skip it,
+        until that is acknowledged.
+
         Args:
             seqnum: Sequence number of a ScheduledPacket, as an integer.
 
@@ -407,18 +1446,136 @@ class Connection(object):
                 invariant has been violated.
         """
         sch_packet = self._sending_window[seqnum]
+        if not sch_packet.abandoned and sch_packet.is_expired():
+            sch_packet.abandoned = True
+
         if sch_packet.retries >= constants.MAX_RETRANSMISSIONS:
-            self.shutdown()
+            self.shutdown(ShutdownReason.TIMEOUT)
         else:
-            self._proto.send_datagram(sch_packet.rudp_packet, self.relay_addr)
-            sch_packet.timeout_cb = REACTOR.callLater(
-                sch_packet.timeout,
-                self._do_send_packet,
-                seqnum
-            )
+            if sch_packet.abandoned:
+                self._send_skip()
+            else:
+                self._proto.send_datagram(
+                    sch_packet.rudp_packet,
+                    self.relay_addr
+                )
+            timeout = self._get_retransmission_timeout(sch_packet)
+            if self._shared_retransmission_timer:
+                sch_packet.deadline = REACTOR.seconds() + timeout
+                if (
+                    not self._rto_handle.active() or
+                    self._rto_handle.getTime() > sch_packet.deadline
+                ):
+                    self._set_retransmission_timer(timeout)
+            else:
+                sch_packet.timeout_cb = REACTOR.callLater(
+                    timeout,
+                    self._do_send_packet,
+                    seqnum
+                )
+            if sch_packet.retries == 0:
+                sch_packet.sent_at = REACTOR.seconds()
+            else:
+                sch_packet.sent_at = None
             sch_packet.retries += 1
             self._cancel_ack_timeout()
 
+    @staticmethod
+    def _get_retransmission_timeout(sch_packet):
+        """
+        Return the seconds to wait before resending a packet.
+
+        Packets with a backoff factor other than 1 wait exponentially
+        longer after each transmission, up to MAX_SYN_TIMEOUT; the
+        result is jittered, so that peers retrying at the same time
+        drift apart.
+
+        Args:
+            sch_packet: A ScheduledPacket that is about to be sent.
+        """
+        if sch_packet.backoff == 1:
+            return sch_packet.timeout
+        timeout = min(
+            sch_packet.timeout * sch_packet.backoff ** sch_packet.retries,
+            constants.MAX_SYN_TIMEOUT
+        )
+        return timeout * random.uniform(
+            1 - constants.SYN_TIMEOUT_JITTER,
+            1 + constants.SYN_TIMEOUT_JITTER
+        )
+
+    def _resend_overdue_packets(self):
+        """
+        Resend every packet in the send window that is overdue.
+
+        This is the callback of the shared retransmission timer; once
+        done, the timer is re-armed for the earliest pending deadline.
+        """
+        now = REACTOR.seconds()
+        for seqnum, sch_packet in list(self._sending_window.items()):
+            if sch_packet.deadline <= now:
+                self._do_send_packet(seqnum)
+                if self._state == State.SHUTDOWN:
+                    return
+
+        self._reset_retransmission_timer()
+
+    def _reset_retransmission_timer(self):
+        """
+        Re-arm the shared retransmission timer for the earliest deadline.
+
+        The oldest packet in flight need not be the first one due, since
+        retransmitted packets get a new deadline. Cancel the timer if no
+        packet is in flight.
+        """
+        if not self._sending_window:
+            self._cancel_retransmission_timer()
+            return
+
+        deadline = min(
+            sch_packet.deadline
+            for sch_packet in self._sending_window.itervalues()
+        )
+        self._set_retransmission_timer(
+            max(deadline - REACTOR.seconds(), 0)
+        )
+
+    def _set_retransmission_timer(self, timeout):
+        """
+        Set the shared retransmission timer to expire after timeout.
+
+        Postponing an active timer is cheap, but bringing it forward
+        costs a linear search in the reactor's timer queue; it is
+        cheaper to cancel the timer and schedule a new one.
+
+        Args:
+            timeout: Seconds until the timer expires.
+        """
+        if self._rto_handle.active():
+            if self._rto_handle.getTime() <= REACTOR.seconds() + timeout:
+                self._rto_handle.reset(timeout)
+                return
+            self._rto_handle.cancel()
+        self._rto_handle = REACTOR.callLater(
+            timeout,
+            self._resend_overdue_packets
+        )
+
+    def _cancel_retransmission_timer(self):
+        """Cancel the shared retransmission timer."""
+        if self._rto_handle.active():
+            self._rto_handle.cancel()
+
+    def _handshake_timed_out(self):
+        """Shutdown a connection that failed to be established."""
+        if self._state == State.CONNECTING:
+            self.shutdown(ShutdownReason.HANDSHAKE_TIMEOUT)
+
+    def _cancel_handshake_timeout(self):
+        """Cancel the handshake deadline."""
+        if self._handshake_handle.active():
+            self._handshake_handle.cancel()
+
     def _reset_ack_timeout(self, timeout):
         """
         Reset timeout for next bare ACK packet.
@@ -436,15 +1593,119 @@ class Connection(object):
         if self._ack_handle.active():
             self._ack_handle.cancel()
 
+    def _reset_tlp_timeout(self):
+        """
+        Reset timeout for the next tail loss probe.
+
+        The probe is armed only if packets are in flight and a
+        round-trip time estimate is available; if the probe would
+        not fire before the retransmission timeout, it is of no use.
+        """
+        self._tlp_seqnum = None
+        if self._srtt is None or not self._sending_window:
+            self._cancel_tlp_timeout()
+            return
+
+        timeout = max(
+            constants.TLP_RTT_MULTIPLIER * self._srtt,
+            constants.MIN_TLP_TIMEOUT
+        )
+        if timeout >= constants.PACKET_TIMEOUT:
+            self._cancel_tlp_timeout()
+        elif self._tlp_handle.active():
+            self._tlp_handle.reset(timeout)
+        else:
+            self._tlp_handle = REACTOR.callLater(
+                timeout,
+                self._send_tail_loss_probe
+            )
+
+    def _cancel_tlp_timeout(self):
+        """Cancel timeout for next tail loss probe."""
+        if self._tlp_handle.active():
+            self._tlp_handle.cancel()
+
+    def _send_tail_loss_probe(self):
+        """
+        Resend the highest outstanding packet to elicit an ACK.
+
+        If the tail of a message is lost, there is no later packet
+        whose ACK could reveal the loss, so recovery would otherwise
+        have to wait for the retransmission timeout. The probe does
+        not count as a retransmission, nor does it reset the
+        retransmission timer of the probed packet.
+        """
+        if not self._sending_window:
+            return
+        seqnum = next(reversed(self._sending_window))
+        sch_packet = self._sending_window[seqnum]
+        if sch_packet.is_expired():
+            return
+        self._proto.send_datagram(sch_packet.rudp_packet, self.relay_addr)
+        sch_packet.sent_at = None
+        self._tlp_seqnum = seqnum
+
+    def _update_rtt(self, sample):
+        """
+        Fold a round-trip time sample into the smoothed estimate.
+
+        Args:
+            sample: Measured round-trip time, in seconds.
+        """
+        if self._srtt is None:
+            self._srtt = sample
+        else:
+            self._srtt += constants.RTT_ALPHA * (sample - self._srtt)
+
+    def _fail_pending_messages(self):
+        """
+        Fail the Deferred of every message not yet acknowledged.
+
+        Both messages in flight and messages still queued are failed;
+        the queue is emptied.
+        """
+        deferreds = [
+            sch_packet.deferred
+            for sch_packet in self._sending_window.itervalues()
+            if sch_packet.deferred is not None
+        ]
+        deferreds.extend(
+            outbound_message.deferred
+            for outbound_message in self._segment_queue.clear()
+        )
+        self._queued_bytes = 0
+        for d in deferreds:
+            if not d.called:
+                d.errback(self._make_shutdown_error())
+
+    def _make_shutdown_error(self):
+        """
+        Return the exception failing messages cut off by shutdown.
+
+        Returns:
+            error.ConnectionDone after a regular shutdown (by either
+            host), error.ConnectionLost otherwise.
+        """
+        if self._shutdown_reason in (
+            ShutdownReason.LOCAL,
+            ShutdownReason.REMOTE
+        ):
+            exc_class = error.ConnectionDone
+        else:
+            exc_class = error.ConnectionLost
+        return exc_class(self._shutdown_reason.name)
+
     def _clear_sending_window(self):
         """
         Purge send window from scheduled packets.
 
         Cancel all retransmission timers.
         """
+        self._cancel_retransmission_timer()
         for sch_packet in self._sending_window.values():
-            if sch_packet.timeout_cb.active():
-                sch_packet.timeout_cb.cancel()
+            if sch_packet.timeout_cb is not None:
+                if sch_packet.timeout_cb.active():
+                    sch_packet.timeout_cb.cancel()
         self._sending_window.clear()
 
     def _process_ack_packet(self, rudp_packet):
@@ -454,10 +1715,25 @@ class Connection(object):
         Args:
             rudp_packet: A packet.Packet with positive ACK field.
         """
-        if self._sending_window:
-            self._retire_packets_with_seqnum_up_to(
-                min(rudp_packet.ack, self._next_sequence_number)
-            )
+        if not self._sending_window:
+            return
+
+        lowest_seqnum = next(iter(self._sending_window))
+        acknum = min(rudp_packet.ack, self._get_unscheduled_seqnum())
+        if acknum > lowest_seqnum:
+            self._retire_packets_with_seqnum_up_to(acknum)
+        elif self._tlp_seqnum is not None:
+            # A duplicate ACK after a tail loss probe means that the
+            # probe arrived but the head of the window did not; resend
+            # the latter right away instead of waiting for its timer.
+            self._tlp_seqnum = None
+            head = self._sending_window[lowest_seqnum]
+            if head.is_expired():
+                head.abandoned = True
+                self._send_skip()
+            else:
+                self._proto.send_datagram(head.rudp_packet, self.relay_addr)
+                head.sent_at = None
 
     def _process_fin_packet(self, rudp_packet):
         """
@@ -469,7 +1745,7 @@ class Connection(object):
         Args:
             rudp_packet: A packet.Packet with FIN flag set.
         """
-        self.shutdown()
+        self.shutdown(ShutdownReason.REMOTE)
 
     def _process_casual_packet(self, rudp_packet):
         """
@@ -481,17 +1757,164 @@ class Connection(object):
         Args:
             rudp_packet: A packet.Packet with SYN and FIN flags unset.
         """
+        self._update_remote_window(rudp_packet)
         if rudp_packet.ack > 0:
             self._process_ack_packet(rudp_packet)
 
+        if rudp_packet.skip > self._next_expected_seqnum:
+            self._reset_ack_timeout(constants.BARE_ACK_TIMEOUT)
+            self._skip_to_seqnum(rudp_packet.skip)
+            self._attempt_enabling_looping_receive()
+
         seqnum = rudp_packet.sequence_number
         if seqnum > 0:
+            self._window_update_retries = 0
             self._reset_ack_timeout(constants.BARE_ACK_TIMEOUT)
-            if seqnum >= self._next_expected_seqnum:
-                self._receive_heap.push(rudp_packet)
-                if seqnum == self._next_expected_seqnum:
-                    self._next_expected_seqnum += 1
-                    self._attempt_enabling_looping_receive()
+            if (
+                seqnum >= self._next_expected_seqnum and
+                seqnum not in self._out_of_order_seqnums
+            ):
+                if not self._is_acceptable(rudp_packet):
+                    return
+                self._update_next_expected_seqnum(seqnum)
+                if rudp_packet.unordered:
+                    # Under backpressure, unreliable messages are shed
+                    # instead of buffered.
+                    if not self._receiving_paused:
+                        self._deliver_message(
+                            rudp_packet.stream_id,
+                            rudp_packet.payload
+                        )
+                        self._flush_delivery_batch()
+                else:
+                    self._buffer_packet(rudp_packet)
+                self._attempt_enabling_looping_receive()
+
+    def _is_acceptable(self, rudp_packet):
+        """
+        Check whether a new inbound packet can be taken in.
+
+        Packets that cannot are dropped, unacknowledged: packets on
+        a stream out of range, segments whose position contradicts
+        their fragment count or that of their message target, or
+        whose size does not fit their offset in the message, and,
+        so that the receive buffer stays bounded while delivery is
+        paused, ordered packets beyond the advertised window.
+
+        Args:
+            rudp_packet: A packet.Packet with a new sequence number.
+
+        Returns:
+            True if the packet can be taken in, False otherwise.
+        """
+        if rudp_packet.stream_id > constants.MAX_STREAM_ID:
+            return False
+
+        fragment_count = rudp_packet.fragment_count
+        more_fragments = rudp_packet.more_fragments
+        if fragment_count:
+            if more_fragments >= fragment_count:
+                return False
+            # Segments are written at fixed offsets; only the last
+            # one may fall short of its slot.
+            size = len(rudp_packet.payload)
+            max_size = constants.UDP_SAFE_SEGMENT_SIZE
+            if size > max_size or (more_fragments and size != max_size):
+                return False
+            message_target = self._message_targets.get(
+                rudp_packet.sequence_number + more_fragments
+            )
+            if (
+                message_target is not None and
+                message_target.fragment_count != fragment_count
+            ):
+                return False
+
+        return rudp_packet.unordered or self._get_receive_window() != 0
+
+    def _buffer_packet(self, rudp_packet):
+        """
+        Keep a received packet until its message can be delivered.
+
+        A segment of a fragmented message for which the
+        StreamingHandler supplied a target is written to the target
+        right away instead; only the first segment is kept, without
+        its payload, to deliver the message in order.
+
+        Args:
+            rudp_packet: A received packet.Packet, not unordered.
+        """
+        fragment_count = rudp_packet.fragment_count
+        more_fragments = rudp_packet.more_fragments
+        if self._streaming_handler and fragment_count > more_fragments:
+            last_seqnum = rudp_packet.sequence_number + more_fragments
+            try:
+                message_target = self._message_targets[last_seqnum]
+            except KeyError:
+                message_target = self._open_message_target(
+                    rudp_packet.stream_id,
+                    last_seqnum,
+                    fragment_count
+                )
+            if message_target is not None:
+                message_target.write(rudp_packet)
+                if more_fragments + 1 < fragment_count:
+                    return
+                rudp_packet.payload = b''
+
+        self._receive_heaps[rudp_packet.stream_id].push(rudp_packet)
+        self._buffered_packets += 1
+
+    def _open_message_target(self, stream, last_seqnum, fragment_count):
+        """
+        Ask the StreamingHandler for the target of a new message.
+
+        Messages that could exceed MAX_MESSAGE_TARGET_SIZE get no
+        target, and are delivered chunk by chunk instead.
+
+        Args:
+            stream: The stream of the message, as an integer.
+            last_seqnum: The sequence number of the last segment.
+            fragment_count: The number of segments.
+
+        Returns:
+            A MessageTarget, or None if the handler supplied none.
+        """
+        max_size = fragment_count * constants.UDP_SAFE_SEGMENT_SIZE
+        if max_size > constants.MAX_MESSAGE_TARGET_SIZE:
+            target = None
+        else:
+            target = self.handler.open_message_target(stream, max_size)
+        if target is None:
+            message_target = None
+        else:
+            message_target = self.MessageTarget(target, fragment_count)
+        self._message_targets[last_seqnum] = message_target
+        return message_target
+
+    def _process_cookie_packet(self, rudp_packet):
+        """
+        Process a SYN cookie issued by the remote host.
+
+        The remote host keeps no state about this connection until
+        the SYN packet comes back with its cookie. The SYN packet is
+        sent again at once, with the cookie, as are its later
+        retransmissions. A cookie not acknowledging the SYN packet
+        is ignored.
+
+        Args:
+            rudp_packet: A packet.Packet carrying a cookie.
+        """
+        sch_packet = self._sending_window.get(self._syn_seqnum)
+        if sch_packet is None or rudp_packet.ack != self._syn_seqnum + 1:
+            return
+
+        self._syn_cookie = rudp_packet.cookie
+        syn_packet = self._make_syn_packet(self._syn_seqnum)
+        self._set_advertised_window(syn_packet)
+        sch_packet.rudp_packet = self._finalize_packet(syn_packet)
+        sch_packet.sent_at = REACTOR.seconds()
+        self._proto.send_datagram(sch_packet.rudp_packet, self.relay_addr)
 
     def _process_syn_packet(self, rudp_packet):
         """
@@ -506,26 +1929,71 @@ class Connection(object):
         Args:
             rudp_packet: A packet.Packet with SYN flag set.
         """
+        self._update_remote_window(rudp_packet)
         if rudp_packet.ack > 0:
             self._process_ack_packet(rudp_packet)
 
-        self._update_next_expected_seqnum(rudp_packet.sequence_number)
-        self._update_next_delivered_seqnum(rudp_packet.sequence_number)
+        self._remote_syn_seqnum = rudp_packet.sequence_number
+        self._next_expected_seqnum = rudp_packet.sequence_number + 1
         self._state = State.CONNECTED
+        self._cancel_handshake_timeout()
+        self._handshake_duration = REACTOR.seconds() - self._started_at
         self._attempt_enabling_looping_send()
 
+    def _update_remote_window(self, rudp_packet):
+        """
+        Record the receive window advertised by the remote host.
+
+        Args:
+            rudp_packet: A received packet.Packet.
+        """
+        if rudp_packet.ack >= self._remote_window_ack:
+            self._remote_window_ack = rudp_packet.ack
+            self._remote_window = rudp_packet.window
+            self._attempt_enabling_looping_send()
+
     def _update_next_expected_seqnum(self, seqnum):
-        if self._next_expected_seqnum <= seqnum:
-            self._next_expected_seqnum = seqnum + 1
+        """
+        Record the reception of a new packet.
 
-    def _update_next_delivered_seqnum(self, seqnum):
-        if self._next_delivered_seqnum <= seqnum:
-            self._next_delivered_seqnum = seqnum + 1
+        The ACK number advances past every packet received so far
+        without gaps, whether its message was delivered or not.
+
+        Args:
+            seqnum: Sequence number of the received packet.
+        """
+        if seqnum == self._next_expected_seqnum:
+            self._next_expected_seqnum += 1
+            self._absorb_out_of_order_seqnums()
+        else:
+            self._out_of_order_seqnums.add(seqnum)
+
+    def _skip_to_seqnum(self, seqnum):
+        """
+        Consider received every packet below the given seqnum.
+
+        Args:
+            seqnum: Sequence number of the first packet that the
+                remote host has not abandoned.
+        """
+        self._out_of_order_seqnums = set(
+            s for s in self._out_of_order_seqnums if s >= seqnum
+        )
+        self._next_expected_seqnum = seqnum
+        self._absorb_out_of_order_seqnums()
+
+    def _absorb_out_of_order_seqnums(self):
+        """Advance the ACK number past packets received in advance."""
+        while self._next_expected_seqnum in self._out_of_order_seqnums:
+            self._out_of_order_seqnums.remove(self._next_expected_seqnum)
+            self._next_expected_seqnum += 1
 
     def _retire_packets_with_seqnum_up_to(self, acknum):
         """
         Remove from send window any ACKed packets.
 
+        Sequence numbers missing from the send window are passed over.
+
         Args:
             acknum: Acknowledgement number of next expected
                 outbound packet.
@@ -533,27 +2001,66 @@ class Connection(object):
         if not self._sending_window:
             return
         lowest_seqnum = iter(self._sending_window).next()
-        if acknum >= lowest_seqnum:
-            for seqnum in range(lowest_seqnum, acknum):
-                self._retire_scheduled_packet_with_seqnum(seqnum)
+        if acknum > lowest_seqnum:
+            completed = []
+            while self._sending_window:
+                seqnum = next(iter(self._sending_window))
+                if seqnum >= acknum:
+                    break
+                sch_packet = self._retire_scheduled_packet_with_seqnum(seqnum)
+                if sch_packet.deferred is not None:
+                    completed.append(sch_packet)
+            if sch_packet.sent_at is not None:
+                self._update_rtt(REACTOR.seconds() - sch_packet.sent_at)
+            if self._shared_retransmission_timer:
+                self._reset_retransmission_timer()
+            if not self._segment_queue:
+                self._reset_tlp_timeout()
             self._attempt_enabling_looping_send()
 
+            # Fire only once the connection state is consistent, since
+            # callbacks may send messages or even shutdown.
+            for sch_packet in completed:
+                self._complete_message(sch_packet)
+
+    def _complete_message(self, sch_packet):
+        """
+        Report the outcome of a message whose last packet is retired.
+
+        Args:
+            sch_packet: The retired ScheduledPacket.
+        """
+        d = sch_packet.deferred
+        if d.called:
+            # It was cancelled after it had started.
+            return
+        if sch_packet.abandoned:
+            d.errback(defer.TimeoutError('Message abandoned.'))
+        else:
+            d.callback(None)
+
     def _retire_scheduled_packet_with_seqnum(self, seqnum):
         """
         Retire ScheduledPacket with given seqnum.
 
         Args:
             seqnum: Sequence number of retired packet.
+
+        Returns:
+            The retired ScheduledPacket.
         """
         sch_packet = self._sending_window.pop(seqnum)
-        sch_packet.timeout_cb.cancel()
+        if sch_packet.timeout_cb is not None:
+            sch_packet.timeout_cb.cancel()
+        return sch_packet
 
     def _attempt_enabling_looping_receive(self):
         """Activate looping receive."""
         if (
             not self._looping_receive.running and
+            not self._receiving_paused and
             self._state == State.CONNECTED and
-            self._receive_heap
+            any(self._receive_heaps.itervalues())
         ):
             self._looping_receive.start(0, now=True)
 
@@ -566,20 +2073,241 @@ class Connection(object):
         """
         Attempt to reconstruct a received packet and process payload.
 
-        If successful, advance ACK number.
+        If successful, record the message as delivered on its stream.
         """
-        fragments = self._receive_heap.pop_min_and_all_fragments()
-        if fragments is None:
+        stream = self._find_deliverable_stream()
+        if stream is None:
             self._attempt_disabling_looping_receive()
+            return
+
+        if self._batch_handler:
+            # Deliver everything that is due in one go, stopping
+            # short if the handler pauses or shuts down the connection.
+            while (
+                stream is not None and
+                not self._receiving_paused and
+                self._state == State.CONNECTED
+            ):
+                self._deliver_from_stream(stream)
+                stream = self._find_deliverable_stream()
+            self._flush_delivery_batch()
         else:
+            self._deliver_from_stream(stream)
+
+        if self._find_deliverable_stream() is None:
+            self._attempt_disabling_looping_receive()
+
+    def _deliver_from_stream(self, stream):
+        """
+        Deliver the next message, or fragment, due on a stream.
+
+        Args:
+            stream: A stream with a deliverable message.
+        """
+        receive_heap = self._receive_heaps[stream]
+        first_packet = receive_heap.peek_min()
+        if self._streaming_handler and (
+            first_packet.more_fragments or
+            stream in self._next_fragment_seqnums
+        ):
+            self._flush_delivery_batch()
+            last_seqnum = (
+                first_packet.sequence_number +
+                first_packet.more_fragments
+            )
+            if self._message_targets.get(last_seqnum) is None:
+                self._deliver_fragment(stream, receive_heap.pop_min())
+            else:
+                receive_heap.pop_min()
+                self._deliver_target(stream, last_seqnum)
+        else:
+            fragments = receive_heap.pop_min_and_all_fragments()
             last_seqnum = fragments[-1].sequence_number
-            self._update_next_expected_seqnum(last_seqnum)
-            self._update_next_delivered_seqnum(last_seqnum)
-            payload = ''.join(f.payload for f in fragments)
-            self.handler.receive_message(payload)
+            self._last_delivered_seqnums[stream] = last_seqnum
+            self._release_buffered_packets(len(fragments))
+            self._deliver_message(
+                stream,
+                ''.join(f.payload for f in fragments)
+            )
+        self._prune_stream(stream)
+
+    def _prune_stream(self, stream):
+        """
+        Forget the reorder buffer of a stream, once it is empty.
+
+        The last message delivered on the stream is forgotten too if
+        every packet sent before it has been received: the next
+        message on the stream is then chained to a predecessor below
+        the ACK number, which `_is_deliverable` accepts as is.
+
+        Args:
+            stream: The stream, as an integer.
+        """
+        if self._receive_heaps[stream]:
+            return
+        del self._receive_heaps[stream]
+        delivered_seqnum = self._last_delivered_seqnums.get(stream)
+        if (
+            delivered_seqnum is not None and
+            delivered_seqnum < self._next_expected_seqnum
+        ):
+            del self._last_delivered_seqnums[stream]
+
+    def _release_buffered_packets(self, count):
+        """
+        Account for packets leaving the reorder buffers.
+
+        Args:
+            count: The number of packets, as an integer.
+        """
+        self._buffered_packets -= count
+        if self._advertised_window == 0 and self._get_receive_window() != 0:
+            self._send_window_update()
+
+    def _deliver_fragment(self, stream, rudp_packet):
+        """
+        Pass a fragment of a message to the StreamingHandler.
+
+        Args:
+            stream: The stream of the message, as an integer.
+            rudp_packet: The next packet.Packet of the message.
+        """
+        seqnum = rudp_packet.sequence_number
+        more_fragments = rudp_packet.more_fragments
+        first = stream not in self._next_fragment_seqnums
+        if more_fragments:
+            self._next_fragment_seqnums[stream] = seqnum + 1
+        else:
+            del self._next_fragment_seqnums[stream]
+            self._message_targets.pop(seqnum, None)
+            self._last_delivered_seqnums[stream] = seqnum
+        self._release_buffered_packets(1)
+
+        if first:
+            self.handler.begin_message(
+                stream,
+                (more_fragments + 1) * constants.UDP_SAFE_SEGMENT_SIZE
+            )
+        self.handler.receive_chunk(stream, rudp_packet.payload)
+        if not more_fragments:
+            self.handler.end_message(stream)
+
+    def _deliver_message(self, stream, message):
+        """
+        Pass a received message to the handler.
+
+        For a BatchHandler, messages on the default stream are only
+        collected; see `_flush_delivery_batch`.
+
+        Args:
+            stream: The stream of the message, as an integer.
+            message: The reassembled message, as a string.
+        """
+        if stream:
+            self._flush_delivery_batch()
+            self.handler.receive_stream_message(stream, message)
+        elif self._batch_handler:
+            self._delivery_batch.append(message)
+        else:
+            self.handler.receive_message(message)
+
+    def _flush_delivery_batch(self):
+        """Pass the collected messages to the BatchHandler, if any."""
+        if self._delivery_batch:
+            messages = self._delivery_batch
+            self._delivery_batch = []
+            self.handler.receive_messages(messages)
+
+    def _deliver_target(self, stream, last_seqnum):
+        """
+        Hand a message written to a target back to the handler.
+
+        Args:
+            stream: The stream of the message, as an integer.
+            last_seqnum: The sequence number of its last segment.
+        """
+        message_target = self._message_targets.pop(last_seqnum)
+        self._last_delivered_seqnums[stream] = last_seqnum
+        self._release_buffered_packets(1)
+        self.handler.close_message_target(
+            stream,
+            message_target.target,
+            message_target.size
+        )
+
+    def _find_deliverable_stream(self):
+        """
+        Find a stream whose next message can be delivered.
+
+        Returns:
+            The stream whose deliverable message was sent first, or
+            None if no message can be delivered yet.
+        """
+        deliverable_stream = None
+        deliverable_seqnum = None
+        for stream, receive_heap in self._receive_heaps.iteritems():
+            first_packet = receive_heap.peek_min()
+            if first_packet is None:
+                continue
+            seqnum = first_packet.sequence_number
+            if deliverable_seqnum is not None and seqnum > deliverable_seqnum:
+                continue
+            if self._is_deliverable(stream, first_packet, receive_heap):
+                deliverable_stream = stream
+                deliverable_seqnum = seqnum
+        return deliverable_stream
+
+    def _is_deliverable(self, stream, first_packet, receive_heap):
+        """
+        Check whether the earliest pending message of a stream is due.
+
+        A message on the default stream is due once it and every
+        packet sent before it have been received. A message on any
+        other stream is due once all its segments have been received
+        and the message it is chained to has been delivered or
+        skipped.
+
+        For a StreamingHandler, only the first segment of a message
+        has to be due, and each later one is due once it arrives; a
+        message written to a target is due once it is complete.
 
-            if self._next_delivered_seqnum not in self._receive_heap:
-                self._attempt_disabling_looping_receive()
+        Args:
+            stream: The stream, as an integer.
+            first_packet: The pending packet.Packet with the lowest
+                sequence number on the stream.
+            receive_heap: The reorder buffer of the stream.
+        """
+        seqnum = first_packet.sequence_number
+        if stream in self._next_fragment_seqnums:
+            return seqnum == self._next_fragment_seqnums[stream]
+        more_fragments = first_packet.more_fragments
+        if self._streaming_handler:
+            message_target = self._message_targets.get(
+                seqnum + more_fragments
+            )
+            if message_target is not None and message_target.remaining:
+                return False
+            more_fragments = 0
+        if not stream:
+            return seqnum + more_fragments < self._next_expected_seqnum
+
+        delivered_seqnum = self._last_delivered_seqnums.get(
+            stream,
+            self._remote_syn_seqnum
+        )
+        # A predecessor below the ACK number that is not pending (it
+        # would be on top of the heap) has been skipped.
+        stream_prev = first_packet.stream_prev
+        return (
+            (
+                stream_prev == delivered_seqnum or
+                delivered_seqnum < stream_prev < self._next_expected_seqnum
+            ) and
+            all(
+                seqnum + i in receive_heap
+                for i in range(1, more_fragments + 1)
+            )
+        )
 
 
 class Handler(object):
@@ -607,11 +2335,139 @@ class Handler(object):
             message: The payload of a Packet, as a string.
         """
 
+    def receive_stream_message(self, stream, message):
+        """
+        Receive a message on a stream other than the default one.
+
+        By default, the stream is ignored and the message is passed
+        on to `receive_message`.
+
+        Args:
+            stream: The stream of the message, as a positive integer.
+            message: The payload of a Packet, as a string.
+        """
+        self.receive_message(message)
+
     @abc.abstractmethod
     def handle_shutdown(self):
         """Handle connection shutdown."""
 
 
+class StreamingHandler(Handler):
+
+    """
+    Abstract base class for handlers receiving messages in chunks.
+
+    A message that spans several packets is not reassembled; its
+    segments are passed on in order, as soon as they are contiguous,
+    so that large messages can be processed without being buffered
+    whole. Single-packet messages are still passed to
+    `receive_message` (or `receive_stream_message`).
+
+    Alternatively, the handler may supply a writable file or mmap for
+    each fragmented message; segments are then written to it at their
+    offsets as they arrive, in any order, and the target is handed
+    back once the message is complete and due.
+
+    If the connection is shutdown in the middle of a message,
+    `end_message` (or `close_message_target`) is not called for it.
+    """
+
+    def open_message_target(self, stream, max_size):
+        """
+        Supply the target of a fragmented message.
+
+        Called when the first packet of the message arrives, whichever
+        segment it is. By default, no target is supplied.
+
+        Args:
+            stream: The stream of the message, as an integer.
+            max_size: An upper bound of the size of the message,
+                in bytes.
+
+        Returns:
+            A writable object with `seek` and `write` methods (e.g.
+            a file or an mmap at least `max_size` bytes long), or
+            None to receive the message through `begin_message`,
+            `receive_chunk` and `end_message`.
+        """
+        return None
+
+    def close_message_target(self, stream, target, size):
+        """
+        Receive a message written to a target.
+
+        Messages are handed back in the order they would have been
+        delivered otherwise.
+
+        Args:
+            stream: The stream of the message, as an integer.
+            target: The target supplied by `open_message_target`.
+            size: The size of the message, in bytes.
+        """
+
+    @abc.abstractmethod
+    def begin_message(self, stream, max_size):
+        """
+        Start receiving a fragmented message.
+
+        Args:
+            stream: The stream of the message, as an integer.
+            max_size: An upper bound of the size of the message,
+                in bytes.
+        """
+
+    @abc.abstractmethod
+    def receive_chunk(self, stream, chunk):
+        """
+        Receive the next chunk of the current message on a stream.
+
+        Args:
+            stream: The stream of the message, as an integer.
+            chunk: The payload of a Packet, as a string.
+        """
+
+    @abc.abstractmethod
+    def end_message(self, stream):
+        """
+        Finish receiving the current message on a stream.
+
+        Args:
+            stream: The stream of the message, as an integer.
+        """
+
+
+class BatchHandler(Handler):
+
+    """
+    Abstract base class for handlers receiving messages in batches.
+
+    All messages on the default stream that are due in the same
+    reactor pass are passed to `receive_messages` at once, to
+    amortize the cost of a call per message. Messages on other
+    streams are still passed to `receive_stream_message`, in order.
+    """
+
+    def receive_message(self, message):
+        """
+        Receive a single message, as a batch of one.
+
+        Args:
+            message: The payload of a Packet, as a string.
+        """
+        self.receive_messages([message])
+
+    @abc.abstractmethod
+    def receive_messages(self, messages):
+        """
+        Receive a batch of messages on the default stream.
+
+        Args:
+            messages: A list of message payloads, as strings, in
+                order of delivery.
+        """
+
+
 class HandlerFactory(object):
 
     """Abstract base class for handler factory."""
@@ -635,15 +2491,18 @@ class ConnectionFactory(object):
     Subclass according to need.
     """
 
-    def __init__(self, handler_factory):
+    def __init__(self, handler_factory, **connection_kwargs):
         """
         Create a new ConnectionFactory.
 
         Args:
             handler_factory: An instance of a HandlerFactory,
                 providing a `make_new_handler` method.
+            connection_kwargs: Keyword arguments passed to every
+                new Connection (e.g. `shared_retransmission_timer`).
         """
         self.handler_factory = handler_factory
+        self.connection_kwargs = connection_kwargs
 
     def make_new_connection(
         self,
@@ -667,7 +2526,8 @@ class ConnectionFactory(object):
             handler,
             own_addr,
             source_addr,
-            relay_addr
+            relay_addr,
+            **self.connection_kwargs
         )
         handler.connection = connection
         return connection
@@ -18,3 +18,95 @@ MAX_PACKET_DELAY = 5
 # If a packet is retransmitted more than that many times,
 # the connection should be considered broken.
 MAX_RETRANSMISSIONS = int(MAX_PACKET_DELAY // PACKET_TIMEOUT)
+
+# Smoothing factor of the round-trip time estimator (see RFC 6298).
+RTT_ALPHA = 0.125
+
+# A tail loss probe is sent after that many smoothed round-trip
+# times have passed without the tail of the send window being ACKed.
+TLP_RTT_MULTIPLIER = 2
+
+# [seconds]
+MIN_TLP_TIMEOUT = 0.01
+
+# Each retransmission of a SYN packet multiplies its timeout by that
+# factor, up to MAX_SYN_TIMEOUT.
+SYN_BACKOFF_FACTOR = 2
+
+# [seconds]
+MAX_SYN_TIMEOUT = 4 * PACKET_TIMEOUT
+
+# Fraction by which each SYN timeout is randomly stretched or shrunk,
+# so that peers retrying together do not stay synchronized.
+SYN_TIMEOUT_JITTER = 0.2
+
+# [seconds]
+HANDSHAKE_TIMEOUT = MAX_PACKET_DELAY
+
+# [seconds]
+SYN_COOKIE_LIFETIME = HANDSHAKE_TIMEOUT
+
+# Segments dequeued for sending per reactor iteration, at most; their
+# packets are finalized (e.g. encrypted) in one batch.
+SEND_BURST_SIZE = 16
+
+# A queued message may be overtaken by at most that many messages
+# of higher priority before it is sent.
+STARVATION_LIMIT = 16
+
+# [bytes]
+SEND_HIGH_WATERMARK = 4 * 65535
+
+# [bytes]
+SEND_LOW_WATERMARK = 65535
+
+# Streams are numbered from 0 to MAX_STREAM_ID; received packets on
+# any other stream are dropped, so that the remote host cannot make
+# a connection keep state for arbitrarily many streams.
+MAX_STREAM_ID = 255
+
+# [bytes]
+MAX_MESSAGE_TARGET_SIZE = 2**30
+
+# Received packets not yet delivered that a connection buffers before
+# its advertised window closes.
+RECEIVE_BUFFER_SIZE = 2 * WINDOW_SIZE
+
+# Once more than that many handler callbacks of a connection are
+# pending on a thread pool, delivery on the connection is paused.
+MAX_PENDING_CALLBACKS = 64
+
+# Private keys a KeyPool keeps ready for new connections.
+KEY_POOL_SIZE = 256
+
+# Keys a KeyPool generates at once, per reactor iteration when it
+# has no thread pool.
+KEY_POOL_REFILL_BATCH = 8
+
+# Crypto boxes of recent peers a BoxCache keeps.
+BOX_CACHE_SIZE = 1024
+
+# [seconds]
+BOX_CACHE_TTL = 3600
+
+# [seconds]
+RATE_LIMIT_PRUNE_INTERVAL = 10
+
+# Keys a RateLimiter tracks at most; beyond that, new keys share
+# a single bucket until old ones are pruned.
+RATE_LIMIT_MAX_KEYS = 65536
+
+# (source, destination) pairs whose relay decision a
+# ConnectionMultiplexer caches.
+RELAY_ROUTE_CACHE_SIZE = 4096
+
+# Relayed (source, destination) pairs whose statistics a
+# ConnectionMultiplexer keeps; the least recently active pairs are
+# forgotten first.
+RELAY_STATS_SIZE = 4096
+
+# Datagrams an mmsg.MMsgPort reads or writes per system call.
+MMSG_BATCH_SIZE = 64
+
+# Peer addresses whose socket address encoding an mmsg.MMsgPort caches.
+MMSG_ADDRESS_CACHE_SIZE = 4096
@@ -3,19 +3,128 @@ RUDP state machine implementation over confidential channel
 
 Classes:
     CryptoConnection: Endpoint of an encrypted RUDP connection
+    KeyPool: Store of pre-generated private keys.
+    BoxCache: LRU cache of crypto boxes of recent peers.
     ConnectionFactory: Creator of CryptoConnections.
 """
 
-from nacl import encoding, exceptions, public, utils
-from twisted.internet import reactor, task
+import collections
+import itertools
+import struct
 
-from txrudp import connection 
+from nacl import bindings, encoding, exceptions, public, utils
+from twisted.internet import defer, reactor, task, threads
+from twisted.python import log
+
+from txrudp import connection, constants
+
+
+REACTOR = reactor
+
+# Binary encoding of the sequence number in the counter half of a
+# nonce; it fills NONCE_SIZE // 2 bytes.
+_NONCE_COUNTER = struct.Struct('>4xQ')
+
+# Binary encoding of the header fields that the connection acts on,
+# repeated at the start of each encrypted payload so that they are
+# authenticated: the number of packets the sender encrypted so far,
+# the ACK and skip numbers, and the advertised window (-1 if none).
+_CONTROL_FIELDS = struct.Struct('>QQQi')
 
 
 class CryptoConnection(connection.Connection):
 
     """An encrypted RUDP connection."""
 
+    class BatchWorker(object):
+
+        """
+        Run a function over batches of items on a thread pool.
+
+        Items submitted during the same reactor iteration form a
+        batch, which is handed to the pool as a whole on the next
+        iteration. Several batches may be processed at once, but
+        results are handled in the reactor thread, in the order
+        the items were submitted.
+        """
+
+        def __init__(self, threadpool, process_batch, handle_result):
+            """
+            Create a new BatchWorker.
+
+            Args:
+                threadpool: A started twisted.python.threadpool.ThreadPool.
+                process_batch: Function run on the pool, taking a list
+                    of items and returning a list of results.
+                handle_result: Function called in the reactor thread
+                    with each item and its result.
+            """
+            self._threadpool = threadpool
+            self._process_batch = process_batch
+            self._handle_result = handle_result
+            self._batch = []
+            self._in_progress = collections.deque()
+
+        def __len__(self):
+            """Return the number of items whose result is pending."""
+            return len(self._batch) + sum(
+                len(items) for items, _ in self._in_progress
+            )
+
+        def submit(self, item):
+            """
+            Queue an item for the next batch.
+
+            Args:
+                item: The item to process.
+            """
+            if not self._batch:
+                REACTOR.callLater(0, self._flush)
+            self._batch.append(item)
+
+        def pending_items(self):
+            """Return a list of the items whose result is pending."""
+            items = [item for batch, _ in self._in_progress for item in batch]
+            items.extend(self._batch)
+            return items
+
+        def peek(self):
+            """Return the earliest item whose result is pending."""
+            for items, _ in self._in_progress:
+                if items:
+                    return items[0]
+            return self._batch[0]
+
+        def _flush(self):
+            """Hand the current batch to the pool."""
+            items, self._batch = self._batch, []
+            entry = [collections.deque(items), None]
+            self._in_progress.append(entry)
+            d = threads.deferToThreadPool(
+                REACTOR,
+                self._threadpool,
+                self._process_batch,
+                items
+            )
+            d.addErrback(self._batch_failed, entry)
+            d.addCallback(self._batch_done, entry)
+
+        def _batch_failed(self, failure, entry):
+            """Log a failed batch; its items get None as result."""
+            log.err(failure, 'Crypto batch failed.')
+            return [None] * len(entry[0])
+
+        def _batch_done(self, results, entry):
+            """Handle the results of all batches done, in order."""
+            entry[1] = collections.deque(results)
+            while self._in_progress and self._in_progress[0][1] is not None:
+                items, results = self._in_progress[0]
+                # Items leave the queue one by one, so that those not
+                # yet handled are still pending if a handler looks.
+                while items:
+                    self._handle_result(items.popleft(), results.popleft())
+                self._in_progress.popleft()
+
     def __init__(
         self,
         proto,
@@ -23,7 +132,11 @@ class CryptoConnection(connection.Connection):
         own_addr,
         dest_addr,
         relay_addr=None,
-        private_key=None
+        private_key=None,
+        crypto_threadpool=None,
+        implicit_nonces=False,
+        box_cache=None,
+        **kwargs
     ):
         """
         Create a new connection and register it with the protocol.
@@ -37,20 +150,56 @@ class CryptoConnection(connection.Connection):
             dest_addr: Tuple of remote host address (ip, port).
             relay_addr: Tuple of relay host address (ip, port).
             private_key: A private key for Curve25519, as a
-                hex-encoded public.PrivateKey. The instance will
+                public.PrivateKey or hex-encoded. The instance will
                 automatically generate a new such key if one is not
                 provided.
+            crypto_threadpool: A started
+                twisted.python.threadpool.ThreadPool running the
+                encryption of in-order packets and the decryption
+                of all packets but SYNs, or None to run them inline
+                in the reactor thread. The pool may be shared among
+                connections.
+            implicit_nonces: If True, offer to leave out the nonce
+                of encrypted packets; it is used if the remote host
+                offers it as well. See `_finalize_packet`.
+            box_cache: A BoxCache, possibly shared among connections,
+                holding the crypto boxes of recent peers, or None.
+            kwargs: Further keyword arguments, passed to
+                connection.Connection.
 
         If a relay address is specified, all outgoing packets are
         sent to that adddress, but the packets contain the address
         of their final destination. This is used for routing.
         """
+        self._implicit_nonces = implicit_nonces
+        self._remote_nonce_bytes = None
+        self._encrypted_count = itertools.count(1)
+        self._remote_encrypted_count = 0
+        self._box_cache = box_cache
+
+        if crypto_threadpool is None:
+            self._encryption_worker = None
+            self._decryption_worker = None
+        else:
+            self._encryption_worker = self.BatchWorker(
+                crypto_threadpool,
+                self._encrypt_batch,
+                self._handle_encrypted_packet
+            )
+            self._decryption_worker = self.BatchWorker(
+                crypto_threadpool,
+                self._decrypt_batch,
+                self._handle_decrypted_packet
+            )
+
         super(CryptoConnection, self).__init__(
-            proto, handler, own_addr, dest_addr, relay_addr
+            proto, handler, own_addr, dest_addr, relay_addr, **kwargs
         )
 
         if private_key is None:
             self._private_key = public.PrivateKey.generate()
+        elif isinstance(private_key, public.PrivateKey):
+            self._private_key = private_key
         else:
             self._private_key = public.PrivateKey(
                 private_key,
@@ -67,22 +216,6 @@ class CryptoConnection(connection.Connection):
         """Return the byte-encoded remote public key."""
         return self._remote_public_key
 
-    def _make_nonce_from_num(self, num):
-        """
-        Construct a nonce from the num provided and the cached nonce bytes.
-
-        Args:
-            num: Seed integer.
-
-        Returns:
-            A bytes sequence of appropriate length.
-        """
-        right_nonce_bytes = '{0:0{1}}'.format(
-            num,
-            self._crypto_box.NONCE_SIZE // 2
-        )
-        return right_nonce_bytes + self._left_nonce_bytes
-
     def _finalize_packet(self, rudp_packet):
         """
         Convert a packet.Packet to bytes and apply crypto stuff.
@@ -90,6 +223,16 @@ class CryptoConnection(connection.Connection):
         If it is a SYN packet, attach the public key; if not,
         encrypt the payload (unless it is empty).
 
+        With implicit nonces, the SYN packet also carries the random
+        half of the local nonces. Once both hosts have sent theirs,
+        the nonce is no longer prepended to encrypted payloads, as
+        the receiver rebuilds it from the sequence number; bare
+        packets, whose sequence number is 0, still carry theirs.
+
+        The ACK and skip numbers and the advertised window are
+        encrypted along with the payload, so that the remote host can
+        tell whether they were tampered with; see `_decrypt_payloads`.
+
         Args:
             rudp_packet: A packet.Packet
 
@@ -100,69 +243,540 @@ class CryptoConnection(connection.Connection):
             rudp_packet.payload = self._public_key.encode(
                 encoder=encoding.RawEncoder
             )
+            if self._implicit_nonces:
+                rudp_packet.payload += self._left_nonce_bytes
         elif self._crypto_box is not None:
-            # Use a "mixed nonce"; half of the nonce bytes vary
-            # deterministically, as they depend on the sequence number;
-            # half are randomly generated upon connection setup and
-            # used until shutdown. Reusing the same nonce within the
-            # session is impossible, reusing the same nonce across
-            # different sessions (with the same key) is highly unilikely.
-            rudp_packet.payload = self._crypto_box.encrypt(
-                rudp_packet.payload,
-                self._make_nonce_from_num(rudp_packet.sequence_number)
-            )
+            self._encrypt_payloads([rudp_packet])
         return super(CryptoConnection, self)._finalize_packet(rudp_packet)
 
+    def _finalize_packets(self, rudp_packets):
+        """
+        Convert a batch of packet.Packets to bytes and encrypt them.
+
+        Payloads other than those of SYN packets are encrypted in
+        one pass; see `_finalize_packet`.
+
+        Args:
+            rudp_packets: A list of packet.Packets.
+
+        Returns:
+            A list of the protobuf-encoded packets, in the same order.
+        """
+        if self._crypto_box is None or any(p.syn for p in rudp_packets):
+            return super(CryptoConnection, self)._finalize_packets(
+                rudp_packets
+            )
+
+        self._encrypt_payloads(rudp_packets)
+        finalize = super(CryptoConnection, self)._finalize_packet
+        return [finalize(rudp_packet) for rudp_packet in rudp_packets]
+
+    def _encrypt_payloads(self, rudp_packets):
+        """
+        Encrypt the payloads of packet.Packets in place.
+
+        The box is bypassed in favor of the underlying binding, with
+        the shared key and nonce halves looked up once per batch.
+        Each payload is prefixed with the control fields of its
+        packet before encryption.
+
+        Args:
+            rudp_packets: A list of packet.Packets.
+        """
+        # Use a "mixed nonce"; half of the nonce bytes vary
+        # deterministically, as they depend on the sequence number;
+        # half are randomly generated upon connection setup and
+        # used until shutdown. Reusing the same nonce within the
+        # session is impossible, reusing the same nonce across
+        # different sessions (with the same key) is highly unilikely.
+        # Bare packets all have sequence number 0, so each gets a
+        # random nonce instead.
+        shared_key = self._crypto_box.shared_key()
+        left_nonce_bytes = self._left_nonce_bytes
+        implicit = self._remote_nonce_bytes is not None
+        pack_counter = _NONCE_COUNTER.pack
+        pack_control = _CONTROL_FIELDS.pack
+        encrypted_count = self._encrypted_count
+        encrypt = bindings.crypto_box_afternm
+        for rudp_packet in rudp_packets:
+            seqnum = rudp_packet.sequence_number
+            window = rudp_packet.window
+            plaintext = pack_control(
+                next(encrypted_count),
+                rudp_packet.ack,
+                rudp_packet.skip,
+                -1 if window is None else window
+            ) + rudp_packet.payload
+            if seqnum:
+                nonce = pack_counter(seqnum) + left_nonce_bytes
+            else:
+                nonce = utils.random(public.Box.NONCE_SIZE)
+            ciphertext = encrypt(plaintext, nonce, shared_key)
+            if implicit and seqnum:
+                rudp_packet.payload = ciphertext
+            else:
+                rudp_packet.payload = nonce + ciphertext
+
+    def _decrypt_payloads(self, rudp_packets):
+        """
+        Decrypt the payloads of packet.Packets in place.
+
+        The control fields of each packet are replaced with the
+        authenticated ones that prefix its payload, whatever its
+        header says.
+
+        Args:
+            rudp_packets: A list of packet.Packets.
+
+        Returns:
+            A list holding, for each packet, the number of packets the
+            remote host had encrypted up to it, or None if the payload
+            was not decrypted; it was not if it was forged or otherwise
+            malformed.
+        """
+        shared_key = self._crypto_box.shared_key()
+        remote_nonce_bytes = self._remote_nonce_bytes
+        pack_counter = _NONCE_COUNTER.pack
+        unpack_control = _CONTROL_FIELDS.unpack_from
+        control_size = _CONTROL_FIELDS.size
+        decrypt = bindings.crypto_box_open_afternm
+        nonce_size = public.Box.NONCE_SIZE
+        counts = []
+        for rudp_packet in rudp_packets:
+            payload = rudp_packet.payload
+            seqnum = rudp_packet.sequence_number
+            if remote_nonce_bytes is None or not seqnum:
+                nonce, ciphertext = payload[:nonce_size], payload[nonce_size:]
+            else:
+                nonce = pack_counter(seqnum) + remote_nonce_bytes
+                ciphertext = payload
+            try:
+                plaintext = decrypt(ciphertext, nonce, shared_key)
+                count, ack, skip, window = unpack_control(plaintext)
+            except (
+                exceptions.CryptoError,
+                exceptions.BadSignatureError,
+                ValueError,
+                struct.error
+            ):
+                counts.append(None)
+            else:
+                rudp_packet.payload = plaintext[control_size:]
+                rudp_packet.ack = ack
+                rudp_packet.skip = skip
+                rudp_packet.window = None if window < 0 else window
+                counts.append(count)
+        return counts
+
+    def _receive_decrypted_packet(self, rudp_packet, from_addr, count):
+        """
+        Process a packet whose payload has been decrypted.
+
+        A replayed packet is genuine, but its advertised window may
+        be outdated; the window of a packet encrypted before the last
+        one processed is ignored.
+
+        Args:
+            rudp_packet: The decrypted packet.Packet.
+            from_addr: Sender's address as Tuple (ip, port).
+            count: The number of packets the remote host had
+                encrypted up to this one.
+        """
+        if count > self._remote_encrypted_count:
+            self._remote_encrypted_count = count
+        else:
+            rudp_packet.window = self._remote_window
+        super(CryptoConnection, self).receive_packet(rudp_packet, from_addr)
+
+    def _schedule_batch_in_order(self, items):
+        """
+        Finalize packets at once, then schedule each to be sent.
+
+        If a crypto thread pool is used, packets other than SYNs
+        are encrypted there; each takes its place in the send window
+        once encrypted, in sequence number order.
+
+        Args:
+            See connection.Connection._schedule_batch_in_order.
+        """
+        if self._encryption_worker is None:
+            super(CryptoConnection, self)._schedule_batch_in_order(items)
+            return
+
+        for item in items:
+            rudp_packet = item[0]
+            if rudp_packet.syn:
+                super(CryptoConnection, self)._schedule_batch_in_order([item])
+            else:
+                self._set_advertised_window(rudp_packet)
+                self._encryption_worker.submit(item)
+
+    def _encrypt_batch(self, items):
+        """
+        Encrypt and finalize a batch of packets; runs on the pool.
+
+        Args:
+            items: A list of tuples of a packet.Packet and the
+                arguments for scheduling it.
+
+        Returns:
+            A list of the finalized packets.
+        """
+        return self._finalize_packets(
+            [rudp_packet for rudp_packet, _ in items]
+        )
+
+    def _handle_encrypted_packet(self, item, final_packet):
+        """
+        Add a packet encrypted on the pool to the send window.
+
+        If the encryption failed, the sequence number of the packet
+        is lost, and the remote host would wait for it forever; the
+        connection is shutdown instead.
+
+        Args:
+            item: A tuple of a packet.Packet and the arguments for
+                scheduling it.
+            final_packet: The finalized packet, or None if the
+                encryption failed.
+        """
+        rudp_packet, args = item
+        if self._state == connection.State.SHUTDOWN:
+            return
+        if final_packet is None:
+            # The packet has left the worker already, so its message
+            # is not failed by the shutdown.
+            self.shutdown(connection.ShutdownReason.ERROR)
+            d = args[-1]
+            if d is not None and not d.called:
+                d.errback(self._make_shutdown_error())
+            return
+
+        self._schedule_finalized_packet(
+            rudp_packet.sequence_number,
+            final_packet,
+            *args
+        )
+        if not self._encryption_worker and not self._segment_queue:
+            self._reset_tlp_timeout()
+
+    def _count_packets_in_flight(self):
+        """
+        Return the number of packets occupying the send window.
+
+        Packets being encrypted on the pool are included.
+        """
+        count = super(CryptoConnection, self)._count_packets_in_flight()
+        if self._encryption_worker is not None:
+            count += len(self._encryption_worker)
+        return count
+
+    def _get_unscheduled_seqnum(self):
+        """
+        Return the lowest sequence number not yet in the send window.
+
+        Packets being encrypted on the pool have their sequence
+        numbers already, but must be neither skipped nor retired
+        until they take their place in the send window.
+        """
+        if self._encryption_worker:
+            rudp_packet, _ = self._encryption_worker.peek()
+            return rudp_packet.sequence_number
+        return super(CryptoConnection, self)._get_unscheduled_seqnum()
+
+    def _fail_pending_messages(self):
+        """
+        Fail the Deferred of every message not yet acknowledged.
+
+        This includes messages whose last packet is still being
+        encrypted on the pool.
+        """
+        super(CryptoConnection, self)._fail_pending_messages()
+        if self._encryption_worker is not None:
+            for _, args in self._encryption_worker.pending_items():
+                d = args[-1]
+                if d is not None and not d.called:
+                    d.errback(self._make_shutdown_error())
+
+    def _decrypt_batch(self, items):
+        """
+        Decrypt a batch of packets in place; runs on the pool.
+
+        Args:
+            items: A list of tuples of a packet.Packet and the
+                address it was received from.
+
+        Returns:
+            A list of the results of `_decrypt_payloads`.
+        """
+        return self._decrypt_payloads(
+            [rudp_packet for rudp_packet, _ in items]
+        )
+
+    def _handle_decrypted_packet(self, item, count):
+        """
+        Process a packet decrypted on the pool.
+
+        Args:
+            item: A tuple of a packet.Packet and the address it was
+                received from.
+            count: The result of `_decrypt_payloads` for the packet,
+                or None if the decryption failed unexpectedly.
+        """
+        if count is not None:
+            rudp_packet, from_addr = item
+            self._receive_decrypted_packet(rudp_packet, from_addr, count)
+
     def receive_packet(self, rudp_packet, from_addr):
         """
         Process received packet and update connection state.
 
         Called by protocol when a packet arrives for this connection.
 
+        If the packet carries a SYN cookie, pass it on as is.
         If the packet is a SYN, setup encryption infrastructure;
         if not, ensure packet is successfully decrypted before
         further processing. Silently drop malicious packages.
+        If a crypto thread pool is used, packets are decrypted there
+        and processed in the order they arrived.
 
         Args:
             rudp_packet: Received packet.Packet.
             from_addr: Sender's address as Tuple (ip, port).
         """
-        if rudp_packet.syn and self._crypto_box is None:
+        if rudp_packet.cookie and not rudp_packet.syn:
+            # A SYN cookie arrives before any key exchange, hence
+            # unencrypted; at worst, a forged one delays the handshake.
+            super(CryptoConnection, self).receive_packet(rudp_packet, from_addr)
+        elif rudp_packet.syn and self._crypto_box is None:
+            # A public key may be followed by the random half of the
+            # remote nonces, if the remote host offers implicit nonces.
+            key_bytes = rudp_packet.payload[:public.PublicKey.SIZE]
+            nonce_bytes = rudp_packet.payload[public.PublicKey.SIZE:]
+            if len(nonce_bytes) not in (0, public.Box.NONCE_SIZE // 2):
+                return
+
             # Try to create a crypto box for this connection, by
             # combining remote public key and local private key.
             try:
                 remote_public_key = public.PublicKey(
-                    rudp_packet.payload,
+                    key_bytes,
                     encoder=encoding.RawEncoder
                 )
-                self._crypto_box = public.Box(
-                    self._private_key,
-                    remote_public_key
-                )
+                if self._box_cache is None:
+                    self._crypto_box = public.Box(
+                        self._private_key,
+                        remote_public_key
+                    )
+                else:
+                    self._crypto_box = self._box_cache.get_box(
+                        self._private_key,
+                        remote_public_key
+                    )
             except (exceptions.CryptoError, ValueError):
                 pass
             else:
-                self._remote_public_key = rudp_packet.payload
+                self._remote_public_key = key_bytes
+                if self._implicit_nonces and nonce_bytes:
+                    self._remote_nonce_bytes = nonce_bytes
                 super(CryptoConnection, self).receive_packet(rudp_packet, from_addr)
         elif not rudp_packet.syn and self._crypto_box is not None:
-            try:
-                rudp_packet.payload = self._crypto_box.decrypt(
-                    rudp_packet.payload
-                )
-            except (
-                exceptions.CryptoError,
-                exceptions.BadSignatureError,
-                ValueError
-            ):
-                pass
+            if self._decryption_worker is not None:
+                self._decryption_worker.submit((rudp_packet, from_addr))
             else:
-                super(CryptoConnection, self).receive_packet(rudp_packet, from_addr)
+                count = self._decrypt_payloads([rudp_packet])[0]
+                if count is not None:
+                    self._receive_decrypted_packet(
+                        rudp_packet,
+                        from_addr,
+                        count
+                    )
+
+
+class KeyPool(object):
+
+    """
+    A store of pre-generated private keys.
+
+    Generating a key pair takes a scalar multiplication, which would
+    otherwise run on the reactor thread for every new connection.
+    The pool is refilled a few keys per reactor iteration, or on a
+    thread pool if one is given; if it runs dry, keys are generated
+    on demand.
+    """
+
+    def __init__(
+        self,
+        size=constants.KEY_POOL_SIZE,
+        threadpool=None,
+        batch_size=constants.KEY_POOL_REFILL_BATCH
+    ):
+        """
+        Create a new (empty) KeyPool.
+
+        Args:
+            size: The number of keys to keep ready.
+            threadpool: A started twisted.python.threadpool.ThreadPool
+                generating the keys, or None to generate them on the
+                reactor thread.
+            batch_size: The number of keys generated at once.
+        """
+        self._keys = collections.deque()
+        self._size = size
+        self._threadpool = threadpool
+        self._batch_size = batch_size
+        self._refilling = False
+
+    def __len__(self):
+        """Return the number of keys ready."""
+        return len(self._keys)
+
+    def start(self):
+        """Start filling the pool."""
+        self._schedule_refill()
+
+    def get_private_key(self):
+        """
+        Take a private key out of the pool.
+
+        Returns:
+            A new public.PrivateKey.
+        """
+        try:
+            key = self._keys.popleft()
+        except IndexError:
+            key = public.PrivateKey.generate()
+        self._schedule_refill()
+        return key
+
+    def _schedule_refill(self):
+        """Generate a batch of keys soon, unless the pool is full."""
+        if self._refilling or len(self._keys) >= self._size:
+            return
+
+        self._refilling = True
+        count = min(self._batch_size, self._size - len(self._keys))
+        if self._threadpool is None:
+            REACTOR.callLater(0, self._refill, count)
+        else:
+            d = threads.deferToThreadPool(
+                REACTOR,
+                self._threadpool,
+                self._generate_keys,
+                count
+            )
+            d.addCallbacks(self._add_keys, self._refill_failed)
+
+    @staticmethod
+    def _generate_keys(count):
+        """Return a list of `count` new private keys."""
+        return [public.PrivateKey.generate() for _ in range(count)]
+
+    def _refill(self, count):
+        """Generate a batch of keys on the reactor thread."""
+        d = defer.maybeDeferred(self._generate_keys, count)
+        d.addCallbacks(self._add_keys, self._refill_failed)
+
+    def _add_keys(self, keys):
+        """Add a batch of generated keys, and go on if not full."""
+        self._refilling = False
+        self._keys.extend(keys)
+        self._schedule_refill()
+
+    def _refill_failed(self, failure):
+        """Log a failed batch; taking a key schedules another one."""
+        self._refilling = False
+        log.err(failure, 'Key generation failed.')
+
+
+class BoxCache(object):
+
+    """
+    An LRU cache of crypto boxes, keyed by local and remote key.
+
+    Creating a public.Box takes a Curve25519 scalar multiplication,
+    the costliest step of the handshake; peers reconnecting to a host
+    with a long-lived private key get the box computed last time.
+    Boxes expire `ttl` seconds after they are computed, and the least
+    recently used is evicted once more than `size` are cached.
+    """
+
+    def __init__(
+        self,
+        size=constants.BOX_CACHE_SIZE,
+        ttl=constants.BOX_CACHE_TTL
+    ):
+        """
+        Create a new (empty) BoxCache.
+
+        Args:
+            size: The maximum number of cached boxes.
+            ttl: Seconds for which a box is cached.
+        """
+        self._boxes = collections.OrderedDict()
+        self._size = size
+        self._ttl = ttl
+
+    def __len__(self):
+        """Return the number of cached boxes."""
+        return len(self._boxes)
+
+    def get_box(self, private_key, remote_public_key):
+        """
+        Get the box for a pair of keys, computing it if needed.
+
+        Args:
+            private_key: The local public.PrivateKey.
+            remote_public_key: The remote public.PublicKey.
+
+        Returns:
+            A public.Box.
+
+        Raises:
+            exceptions.CryptoError: The box could not be created.
+        """
+        key = (
+            private_key.public_key.encode(encoder=encoding.RawEncoder),
+            remote_public_key.encode(encoder=encoding.RawEncoder)
+        )
+        now = REACTOR.seconds()
+        try:
+            box, expires_at = self._boxes.pop(key)
+        except KeyError:
+            expires_at = None
+        if expires_at is None or expires_at <= now:
+            box = public.Box(private_key, remote_public_key)
+            expires_at = now + self._ttl
+
+        self._boxes[key] = (box, expires_at)
+        if len(self._boxes) > self._size:
+            self._boxes.popitem(last=False)
+        return box
 
 
 class CryptoConnectionFactory(connection.ConnectionFactory):
 
     """A factory for CryptoConnections."""
 
+    def __init__(self, handler_factory, key_pool=None, **connection_kwargs):
+        """
+        Create a new CryptoConnectionFactory.
+
+        Args:
+            handler_factory: An instance of a HandlerFactory,
+                providing a `make_new_handler` method.
+            key_pool: A started KeyPool providing the private keys
+                of new connections, or None to generate each key
+                as the connection is created.
+            connection_kwargs: Keyword arguments passed to every
+                new CryptoConnection.
+        """
+        super(CryptoConnectionFactory, self).__init__(
+            handler_factory,
+            **connection_kwargs
+        )
+        self.key_pool = key_pool
+
     def make_new_connection(
         self,
         proto_handle,
@@ -175,7 +789,11 @@ class CryptoConnectionFactory(connection.ConnectionFactory):
         Create a new CryptoConnection.
 
         In addition, create a handler and attach the connection to it.
+        Unless a private key is given, take one from the key pool,
+        if any.
         """
+        if private_key is None and self.key_pool is not None:
+            private_key = self.key_pool.get_private_key()
         handler = self.handler_factory.make_new_handler(
             own_addr,
             source_addr,
@@ -187,7 +805,8 @@ class CryptoConnectionFactory(connection.ConnectionFactory):
             own_addr,
             source_addr,
             relay_addr,
-            private_key
+            private_key,
+            **self.connection_kwargs
         )
         handler.connection = connection
         return connection
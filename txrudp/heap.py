@@ -42,6 +42,26 @@ class Heap(collections.Container, collections.Sized):
             heapq.heappush(self._heap, rudp_packet)
             self._seqnum_set.add(rudp_packet.sequence_number)
 
+    def peek_min(self):
+        """
+        Return the packet at the top of the heap, without popping it.
+
+        Returns:
+            A packet.Packet, or None if the heap is empty.
+        """
+        return self._heap[0] if self._heap else None
+
+    def pop_min(self):
+        """
+        Pop the packet at the top of the heap.
+
+        Returns:
+            A packet.Packet, or None if the heap is empty.
+        """
+        if not self._heap:
+            return None
+        return self._pop_min()
+
     def _pop_min(self):
         """Pop the packet at the top of the heap."""
         rudp_packet = heapq.heappop(self._heap)
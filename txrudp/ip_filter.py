@@ -0,0 +1,188 @@
+"""Ban and allow rules on IPv4/IPv6 networks, in CIDR notation."""
+
+import binascii
+import collections
+import socket
+
+# The rule a network node holds, if any.
+_BAN = True
+_ALLOW = False
+
+_ADDRESS_BITS = {socket.AF_INET: 32, socket.AF_INET6: 128}
+
+
+def _parse_ip(ip):
+    """
+    Parse an IPv4/IPv6 address.
+
+    Args:
+        ip: The address, as a string.
+
+    Returns:
+        A tuple of the address family and the address, as an integer.
+
+    Raises:
+        ValueError: The address is invalid.
+    """
+    family = socket.AF_INET6 if ':' in ip else socket.AF_INET
+    try:
+        packed = socket.inet_pton(family, ip)
+    except (socket.error, TypeError):
+        raise ValueError('Bad IP: {0}.'.format(ip))
+    return family, int(binascii.hexlify(packed), 16)
+
+
+def _parse_network(network):
+    """
+    Parse an IPv4/IPv6 network in CIDR notation.
+
+    Args:
+        network: The network, as a string (e.g. '10.1.0.0/16'); a
+            plain address stands for a network of that address only.
+
+    Returns:
+        A tuple of the address family, the network address, as an
+        integer, and the prefix length.
+
+    Raises:
+        ValueError: The network is invalid, or has host bits set.
+    """
+    ip, _, prefix_len = network.partition('/')
+    family, address = _parse_ip(ip)
+    bits = _ADDRESS_BITS[family]
+    if not prefix_len:
+        return family, address, bits
+
+    if not prefix_len.isdigit() or int(prefix_len) > bits:
+        raise ValueError('Bad prefix length: {0}.'.format(network))
+    prefix_len = int(prefix_len)
+    if address & ((1 << (bits - prefix_len)) - 1):
+        raise ValueError('Host bits set: {0}.'.format(network))
+    return family, address, prefix_len
+
+
+class IPFilter(collections.Sized):
+
+    """
+    A set of ban and allow rules on IPv4/IPv6 networks.
+
+    The rule of the longest network containing an address applies,
+    so that e.g. an address may be allowed within a banned network;
+    addresses no rule applies to are allowed.
+
+    Rules are held in a binary prefix trie per address family, so
+    that a lookup costs at most one step per bit of the longest
+    network on the address' path, regardless of the number of rules.
+    A trie node is a list of its two children and its rule.
+    """
+
+    def __init__(self):
+        """Create a new IPFilter, without rules."""
+        self._roots = dict(
+            (family, [None, None, None]) for family in _ADDRESS_BITS
+        )
+        self._len = 0
+
+    def __len__(self):
+        """Return the number of rules."""
+        return self._len
+
+    def ban(self, network):
+        """
+        Ban a network, replacing any rule on the same network.
+
+        Args:
+            network: The network, in CIDR notation, as a string.
+
+        Raises:
+            ValueError: The network is invalid.
+        """
+        self._set_rule(network, _BAN)
+
+    def allow(self, network):
+        """
+        Allow a network, replacing any rule on the same network.
+
+        Args:
+            network: The network, in CIDR notation, as a string.
+
+        Raises:
+            ValueError: The network is invalid.
+        """
+        self._set_rule(network, _ALLOW)
+
+    def remove(self, network):
+        """
+        Remove the rule on a network, if any.
+
+        Args:
+            network: The network, in CIDR notation, as a string.
+
+        Raises:
+            ValueError: The network is invalid.
+        """
+        family, address, prefix_len = _parse_network(network)
+        bits = _ADDRESS_BITS[family]
+        path = [self._roots[family]]
+        for shift in range(bits - 1, bits - prefix_len - 1, -1):
+            node = path[-1][(address >> shift) & 1]
+            if node is None:
+                return
+            path.append(node)
+
+        if path[-1][2] is None:
+            return
+        path[-1][2] = None
+        self._len -= 1
+
+        # Prune the nodes left without rules or children.
+        for shift in range(bits - prefix_len, bits):
+            node = path.pop()
+            if node != [None, None, None]:
+                break
+            path[-1][(address >> shift) & 1] = None
+
+    def is_banned(self, ip):
+        """
+        Check whether an address is banned.
+
+        Args:
+            ip: The address, as a string.
+
+        Raises:
+            ValueError: The address is invalid.
+        """
+        family, address = _parse_ip(ip)
+        node = self._roots[family]
+        rule = node[2]
+        for shift in range(_ADDRESS_BITS[family] - 1, -1, -1):
+            node = node[(address >> shift) & 1]
+            if node is None:
+                break
+            if node[2] is not None:
+                rule = node[2]
+        return rule is _BAN
+
+    def _set_rule(self, network, rule):
+        """
+        Set the rule on a network.
+
+        Args:
+            network: The network, in CIDR notation, as a string.
+            rule: _BAN or _ALLOW.
+
+        Raises:
+            ValueError: The network is invalid.
+        """
+        family, address, prefix_len = _parse_network(network)
+        bits = _ADDRESS_BITS[family]
+        node = self._roots[family]
+        for shift in range(bits - 1, bits - prefix_len - 1, -1):
+            bit = (address >> shift) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+
+        if node[2] is None:
+            self._len += 1
+        node[2] = rule
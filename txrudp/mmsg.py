@@ -0,0 +1,415 @@
+"""
+UDP port reading and writing datagrams in batches, on Linux.
+
+Classes:
+    MMsgPort: UDP port using recvmmsg(2) and sendmmsg(2).
+
+Functions:
+    listen_udp: Listen for datagrams on an MMsgPort.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import socket
+import struct
+import sys
+
+from twisted.internet import error, udp
+from twisted.python import log
+
+from txrudp import constants
+
+
+# Buffer pointers are declared as c_char_p, so that strings can be
+# assigned to them without copies; ctypes then keeps a reference to
+# the string while it is assigned.
+class _IOVec(ctypes.Structure):
+    _fields_ = [
+        ('iov_base', ctypes.c_char_p),
+        ('iov_len', ctypes.c_size_t),
+    ]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_char_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(_IOVec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int),
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_hdr', _MsgHdr),
+        ('msg_len', ctypes.c_uint),
+    ]
+
+
+def _load_libc_functions():
+    """
+    Look up recvmmsg and sendmmsg in the C library.
+
+    Returns:
+        A tuple of both functions, or of None if either is missing.
+    """
+    if not sys.platform.startswith('linux'):
+        return None, None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        recvmmsg, sendmmsg = libc.recvmmsg, libc.sendmmsg
+    except (OSError, AttributeError):
+        return None, None
+
+    recvmmsg.argtypes = [
+        ctypes.c_int,
+        ctypes.POINTER(_MMsgHdr),
+        ctypes.c_uint,
+        ctypes.c_int,
+        ctypes.c_void_p,
+    ]
+    sendmmsg.argtypes = [
+        ctypes.c_int,
+        ctypes.POINTER(_MMsgHdr),
+        ctypes.c_uint,
+        ctypes.c_int,
+    ]
+    return recvmmsg, sendmmsg
+
+
+_recvmmsg, _sendmmsg = _load_libc_functions()
+
+# Whether MMsgPort can be used on this system.
+AVAILABLE = _recvmmsg is not None
+
+_MSG_DONTWAIT = 0x40
+
+# The leading fields of struct sockaddr_in and sockaddr_in6: the
+# family, in native byte order, and the port.
+_SOCKADDR_HEAD = struct.Struct('=H')
+_SOCKADDR_PORT = struct.Struct('!H')
+
+# Large enough for a struct sockaddr_in6.
+_SOCKADDR_SIZE = 28
+
+_SEND_DROP_ERRORS = (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS)
+
+
+def _pack_sockaddr(family, addr):
+    """
+    Encode an address as a struct sockaddr_in or sockaddr_in6.
+
+    Args:
+        family: socket.AF_INET or socket.AF_INET6.
+        addr: Tuple of address (ip, port).
+
+    Raises:
+        twisted.internet.error.InvalidAddressError: The IP is not
+            an IP address of the given family.
+    """
+    ip, port = addr[:2]
+    try:
+        packed_ip = socket.inet_pton(family, ip)
+    except (socket.error, TypeError, ValueError):
+        raise error.InvalidAddressError(ip, 'Not an IP of the port family.')
+
+    head = _SOCKADDR_HEAD.pack(family) + _SOCKADDR_PORT.pack(port)
+    if family == socket.AF_INET:
+        return head + packed_ip + 8 * b'\0'
+    return head + 4 * b'\0' + packed_ip + 4 * b'\0'
+
+
+def _unpack_sockaddr(sockaddr):
+    """
+    Decode a struct sockaddr_in or sockaddr_in6.
+
+    Args:
+        sockaddr: The encoded address, as a string.
+
+    Returns:
+        Tuple of address (ip, port).
+    """
+    family, = _SOCKADDR_HEAD.unpack_from(sockaddr)
+    port, = _SOCKADDR_PORT.unpack_from(sockaddr, 2)
+    if family == socket.AF_INET:
+        return socket.inet_ntop(family, sockaddr[4:8]), port
+    return socket.inet_ntop(family, sockaddr[8:24]), port
+
+
+def _make_msgvec(count):
+    """
+    Allocate an array of struct mmsghdr, each with a single iovec.
+
+    Args:
+        count: The number of elements of the array.
+
+    Returns:
+        A tuple of the arrays of struct mmsghdr and struct iovec.
+    """
+    msgvec = (_MMsgHdr * count)()
+    iovecs = (_IOVec * count)()
+    for mmsg, iovec in zip(msgvec, iovecs):
+        mmsg.msg_hdr.msg_iov = ctypes.pointer(iovec)
+        mmsg.msg_hdr.msg_iovlen = 1
+    return msgvec, iovecs
+
+
+class MMsgPort(udp.Port):
+
+    """
+    A UDP port reading and writing datagrams in batches.
+
+    Each read drains the socket `batch_size` datagrams per recvmmsg
+    system call, instead of one per recvfrom call. Written datagrams
+    are queued and sent by sendmmsg once per reactor iteration, so
+    that e.g. all the packets a ConnectionMultiplexer sends in an
+    iteration cost about one system call; unlike those of udp.Port,
+    send errors are thus logged instead of raised, and the datagrams
+    that fail are dropped.
+
+    Linux only; see AVAILABLE.
+    """
+
+    def __init__(
+        self,
+        port,
+        proto,
+        interface='',
+        maxPacketSize=8192,
+        reactor=None,
+        batch_size=constants.MMSG_BATCH_SIZE
+    ):
+        """
+        Create a new MMsgPort.
+
+        Args:
+            port: The port number to listen on.
+            proto: The DatagramProtocol to deliver datagrams to.
+            interface: The local IPv4 or IPv6 address to bind to.
+            maxPacketSize: The maximum size of received datagrams.
+            reactor: The reactor, or None for the global one.
+            batch_size: The number of datagrams read or written per
+                system call, at most.
+        """
+        udp.Port.__init__(
+            self,
+            port,
+            proto,
+            interface,
+            maxPacketSize,
+            reactor
+        )
+        self._batch_size = batch_size
+        self._send_queue = []
+        self._flush_call = None
+        # Encoded addresses of recent peers, both ways.
+        self._sockaddrs = {}
+        self._addrs = {}
+
+        self._recv_buffers = [
+            ctypes.create_string_buffer(maxPacketSize)
+            for _ in range(batch_size)
+        ]
+        self._recv_names = [
+            ctypes.create_string_buffer(_SOCKADDR_SIZE)
+            for _ in range(batch_size)
+        ]
+        self._recv_msgvec, recv_iovecs = _make_msgvec(batch_size)
+        for i in range(batch_size):
+            recv_iovecs[i].iov_base = ctypes.addressof(self._recv_buffers[i])
+            recv_iovecs[i].iov_len = maxPacketSize
+            self._recv_msgvec[i].msg_hdr.msg_name = ctypes.addressof(
+                self._recv_names[i]
+            )
+        self._send_msgvec, self._send_iovecs = _make_msgvec(batch_size)
+
+    def doRead(self):
+        """Read and deliver the datagrams waiting on the socket."""
+        read = 0
+        while read < self.maxThroughput:
+            for mmsg in self._recv_msgvec:
+                mmsg.msg_hdr.msg_namelen = _SOCKADDR_SIZE
+            count = _recvmmsg(
+                self.fileno(),
+                self._recv_msgvec,
+                self._batch_size,
+                _MSG_DONTWAIT,
+                None
+            )
+            if count < 0:
+                no = ctypes.get_errno()
+                if no == errno.EINTR:
+                    continue
+                if no in udp._sockErrReadIgnore:
+                    return
+                if no in udp._sockErrReadRefuse:
+                    if self._connectedAddr:
+                        self.protocol.connectionRefused()
+                    return
+                raise socket.error(no, os.strerror(no))
+
+            for i in range(count):
+                mmsg = self._recv_msgvec[i]
+                size = mmsg.msg_len
+                data = ctypes.string_at(self._recv_buffers[i], size)
+                sockaddr = ctypes.string_at(
+                    self._recv_names[i],
+                    mmsg.msg_hdr.msg_namelen
+                )
+                addr = self._addrs.get(sockaddr)
+                if addr is None:
+                    addr = _unpack_sockaddr(sockaddr)
+                    self._cache_sockaddr(addr, sockaddr)
+                read += size
+                try:
+                    self.protocol.datagramReceived(data, addr)
+                except:
+                    log.err()
+
+            if count < self._batch_size:
+                return
+
+    def write(self, datagram, addr=None):
+        """
+        Queue a datagram for sending in this reactor iteration.
+
+        Datagrams of connected ports, or to the broadcast address,
+        are sent at once, as udp.Port does.
+
+        Args:
+            datagram: The datagram, as a string.
+            addr: Tuple of destination address (ip, port), or None in
+                connected mode.
+
+        Raises:
+            twisted.internet.error.InvalidAddressError: The address
+                is not an IP address of the port's family.
+        """
+        if self._connectedAddr or addr[0] == '<broadcast>':
+            return udp.Port.write(self, datagram, addr)
+
+        sockaddr = self._sockaddrs.get(addr)
+        if sockaddr is None:
+            sockaddr = _pack_sockaddr(self.addressFamily, addr)
+            self._cache_sockaddr(addr, sockaddr)
+        self._send_queue.append((datagram, sockaddr))
+        if self._flush_call is None:
+            self._flush_call = self.reactor.callLater(0, self._flush)
+
+    def connectionLost(self, reason=None):
+        """Send the queued datagrams, then clean up the socket."""
+        if self._flush_call is not None:
+            self._flush_call.cancel()
+            self._flush()
+        udp.Port.connectionLost(self, reason)
+
+    def _cache_sockaddr(self, addr, sockaddr):
+        """
+        Cache the encoding of an address, both ways.
+
+        The cache is cleared when it grows beyond
+        MMSG_ADDRESS_CACHE_SIZE addresses.
+
+        Args:
+            addr: Tuple of address (ip, port).
+            sockaddr: The encoded address, as a string.
+        """
+        if len(self._sockaddrs) >= constants.MMSG_ADDRESS_CACHE_SIZE:
+            self._sockaddrs.clear()
+            self._addrs.clear()
+        self._sockaddrs[addr] = sockaddr
+        self._addrs[sockaddr] = addr
+
+    def _flush(self):
+        """Send the queued datagrams, `batch_size` per system call."""
+        self._flush_call = None
+        queue, self._send_queue = self._send_queue, []
+        for start in range(0, len(queue), self._batch_size):
+            self._send_batch(queue[start:start + self._batch_size])
+
+    def _send_batch(self, batch):
+        """
+        Send a batch of datagrams with sendmmsg.
+
+        Args:
+            batch: A list of at most `batch_size` (datagram, sockaddr)
+                tuples.
+        """
+        count = len(batch)
+        msgvec = self._send_msgvec
+        iovecs = self._send_iovecs
+        for i, (datagram, sockaddr) in enumerate(batch):
+            iovecs[i].iov_base = datagram
+            iovecs[i].iov_len = len(datagram)
+            msg_hdr = msgvec[i].msg_hdr
+            msg_hdr.msg_name = sockaddr
+            msg_hdr.msg_namelen = len(sockaddr)
+
+        sent = 0
+        while sent < count:
+            result = _sendmmsg(
+                self.fileno(),
+                ctypes.cast(
+                    ctypes.byref(msgvec, sent * ctypes.sizeof(_MMsgHdr)),
+                    ctypes.POINTER(_MMsgHdr)
+                ),
+                count - sent,
+                0
+            )
+            if result >= 0:
+                sent += result
+                continue
+
+            no = ctypes.get_errno()
+            if no == errno.EINTR:
+                continue
+            if no in _SEND_DROP_ERRORS:
+                return
+            if no != errno.ECONNREFUSED:
+                log.err(
+                    socket.error(no, os.strerror(no)),
+                    'Datagram dropped by sendmmsg.'
+                )
+            # Skip the datagram that failed.
+            sent += 1
+
+
+def listen_udp(
+    port,
+    protocol,
+    interface='',
+    maxPacketSize=8192,
+    reactor=None,
+    batch_size=constants.MMSG_BATCH_SIZE
+):
+    """
+    Listen for datagrams on an MMsgPort, like reactor.listenUDP.
+
+    Args:
+        port: The port number to listen on.
+        protocol: The DatagramProtocol to deliver datagrams to, e.g.
+            a rudp.ConnectionMultiplexer.
+        interface: The local IPv4 or IPv6 address to bind to.
+        maxPacketSize: The maximum size of received datagrams.
+        reactor: The reactor, or None for the global one.
+        batch_size: The number of datagrams read or written per
+            system call, at most.
+
+    Returns:
+        The listening MMsgPort.
+    """
+    mmsg_port = MMsgPort(
+        port,
+        protocol,
+        interface,
+        maxPacketSize,
+        reactor,
+        batch_size
+    )
+    mmsg_port.startListening()
+    return mmsg_port
@@ -4,6 +4,9 @@ Specification of RUDP packet structure.
 Classes:
     Packet: An RUDP packet implementing a total ordering and
         serializing to/from protobuf.
+
+Functions:
+    peek_addrs: Read the addresses of a serialized packet.
 """
 
 import functools
@@ -13,8 +16,10 @@ from txrudp import packet_pb2
 
 # IP validation regexes from the Regular Expressions Cookbook.
 # For now, only standard (non-compressed) IPv6 addresses are
-# supported. This might change in the future.
-_IPV4_REGEX = r'^(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)$'
+# supported. This might change in the future. Zero-padded IPv4
+# octets are rejected, as inet_pton (and thus ban rules) would.
+_IPV4_OCTET = r'(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])'
+_IPV4_REGEX = r'^(?:{0}\.){{3}}{0}$'.format(_IPV4_OCTET)
 _IPV6_REGEX = r'^(?:[A-F0-9]{1,4}:){7}[A-F0-9]{1,4}$'
 
 _IP_MATCHER = re.compile('({0})|({1})'.format(_IPV4_REGEX, _IPV6_REGEX))
@@ -52,6 +57,13 @@ class Packet(object):
         ack=0,
         fin=False,
         syn=False,
+        stream_id=0,
+        stream_prev=0,
+        skip=0,
+        unordered=False,
+        window=None,
+        fragment_count=0,
+        cookie='',
     ):
         """
         Create a Packet with the given fields.
@@ -69,6 +81,25 @@ class Packet(object):
                 ignore.
             fin: When True, signals that this packet ends the connection.
             syn: When True, signals the start of a new conenction.
+            stream_id: The stream the payload belongs to; stream 0
+                is the default, totally ordered stream.
+            stream_prev: On the first segment of a message on a
+                non-default stream, the sequence number of the last
+                segment of the previous message on the same stream
+                (or of the sender's SYN packet, if there is none).
+            skip: If positive, the receiver shall treat all packets
+                with a smaller sequence number as received; the
+                sender has abandoned those it did not see ACK-ed.
+            unordered: When True, the payload is delivered as soon
+                as it arrives, regardless of any stream ordering.
+            window: If not None, the number of further packets the
+                sender of this packet is currently willing to buffer.
+            fragment_count: On every segment of a payload spanning
+                several packets, the number of those packets;
+                otherwise 0.
+            cookie: The SYN cookie issued by the receiver of a SYN
+                packet, or echoed by the sender of a SYN packet, as
+                a string; otherwise empty.
 
         Return:
             An initialized Packet.
@@ -87,6 +118,13 @@ class Packet(object):
         new_packet.sequence_number = sequence_number
         new_packet.more_fragments = more_fragments
         new_packet.ack = ack
+        new_packet.stream_id = stream_id
+        new_packet.stream_prev = stream_prev
+        new_packet.skip = skip
+        new_packet.unordered = unordered
+        new_packet.window = window
+        new_packet.fragment_count = fragment_count
+        new_packet.cookie = cookie
 
         new_packet.payload = payload
 
@@ -154,7 +192,21 @@ class Packet(object):
         Raises:
             ValidationError: One or more values was invalid.
         """
-        dest_ip, dest_port = packet.dest_addr
+        Packet.validate_addrs(packet.dest_addr, packet.source_addr)
+
+    @staticmethod
+    def validate_addrs(dest_addr, source_addr):
+        """
+        Ensure packet addresses are valid.
+
+        Args:
+            dest_addr: Tuple of destination address (ip, port).
+            source_addr: Tuple of source address (ip, port).
+
+        Raises:
+            ValidationError: One or more values was invalid.
+        """
+        dest_ip, dest_port = dest_addr
         if _IP_MATCHER.match(dest_ip) is None:
             raise ValidationError(
                 'Bad destination IP: {0}.'.format(dest_ip)
@@ -165,7 +217,7 @@ class Packet(object):
                 'Bad destination port: {0}.'.format(dest_port)
             )
 
-        source_ip, source_port = packet.source_addr
+        source_ip, source_port = source_addr
         if _IP_MATCHER.match(source_ip) is None:
             raise ValidationError(
                 'Bad source IP: {0}.'.format(source_ip)
@@ -251,6 +303,117 @@ class Packet(object):
         """
         self._packet.ack = value
 
+    def get_stream_id(self):
+        return self._packet.stream_id
+
+    def set_stream_id(self, value):
+        """
+        Set the Packet's stream ID.
+
+        Args:
+            value: A non-negative integer.
+
+        Raises:
+            TypeError: Value has inappropriate type.
+        """
+        self._packet.stream_id = value
+
+    def get_stream_prev(self):
+        return self._packet.stream_prev
+
+    def set_stream_prev(self, value):
+        """
+        Set the sequence number preceding this message on its stream.
+
+        Args:
+            value: A non-negative integer.
+
+        Raises:
+            TypeError: Value has inappropriate type.
+        """
+        self._packet.stream_prev = value
+
+    def get_skip(self):
+        return self._packet.skip
+
+    def set_skip(self, value):
+        """
+        Set the sequence number up to which packets are abandoned.
+
+        Args:
+            value: A non-negative integer.
+
+        Raises:
+            TypeError: Value has inappropriate type.
+        """
+        self._packet.skip = value
+
+    def get_unordered(self):
+        return self._packet.unordered
+
+    def set_unordered(self, value):
+        """
+        Set the Packet's unordered flag.
+
+        Args:
+            value: True or False.
+
+        Raises:
+            TypeError: Value has inappropriate type.
+        """
+        self._packet.unordered = value
+
+    def get_window(self):
+        if self._packet.HasField('window'):
+            return self._packet.window
+        return None
+
+    def set_window(self, value):
+        """
+        Set the Packet's advertised receive window.
+
+        Args:
+            value: A non-negative integer, or None to advertise
+                no limit.
+
+        Raises:
+            TypeError: Value has inappropriate type.
+        """
+        if value is None:
+            self._packet.ClearField('window')
+        else:
+            self._packet.window = value
+
+    def get_fragment_count(self):
+        return self._packet.fragment_count
+
+    def set_fragment_count(self, value):
+        """
+        Set the number of segments of the Packet's payload.
+
+        Args:
+            value: A non-negative integer.
+
+        Raises:
+            TypeError: Value has inappropriate type.
+        """
+        self._packet.fragment_count = value
+
+    def get_cookie(self):
+        return self._packet.cookie
+
+    def set_cookie(self, value):
+        """
+        Set the Packet's SYN cookie.
+
+        Args:
+            value: The cookie, in bytes.
+
+        Raises:
+            TypeError: Value has inappropriate type.
+        """
+        self._packet.cookie = value
+
     def get_payload(self):
         return self._packet.payload
 
@@ -301,6 +464,41 @@ class Packet(object):
     sequence_number = property(get_sequence_number, set_sequence_number)
     more_fragments = property(get_more_fragments, set_more_fragments)
     ack = property(get_ack, set_ack)
+    stream_id = property(get_stream_id, set_stream_id)
+    stream_prev = property(get_stream_prev, set_stream_prev)
+    skip = property(get_skip, set_skip)
+    unordered = property(get_unordered, set_unordered)
+    window = property(get_window, set_window)
+    fragment_count = property(get_fragment_count, set_fragment_count)
+    cookie = property(get_cookie, set_cookie)
     payload = property(get_payload, set_payload)
     dest_addr = property(get_dest_addr, set_dest_addr)
     source_addr = property(get_source_addr, set_source_addr)
+
+
+def peek_addrs(data):
+    """
+    Read the addresses of a serialized packet, without decoding it.
+
+    Only the address fields are decoded, into a PacketHeader, while
+    all other fields are skipped over; e.g. a relay may thus forward
+    a datagram faster than `Packet.from_bytes` would decode it. The
+    addresses are not validated; see `Packet.validate_addrs`.
+
+    Args:
+        data: A protobuf-encoded bytestring.
+
+    Returns:
+        A tuple of the destination and source address of the packet,
+        each a tuple (ip, port).
+
+    Raises:
+        protobuf.message.DecodeError: Decoding the bytestring was
+            unsuccessful, e.g. it lacks an address.
+    """
+    header = packet_pb2.PacketHeader()
+    header.ParseFromString(data)
+    return (
+        (header.dest_ip, header.dest_port),
+        (header.source_ip, header.source_port)
+    )
@@ -13,7 +13,7 @@ from google.protobuf import descriptor_pb2
 DESCRIPTOR = _descriptor.FileDescriptor(
   name='packet.proto',
   package='txrudp',
-  serialized_pb='\n\x0cpacket.proto\x12\x06txrudp\"\xbd\x01\n\x06Packet\x12\x0b\n\x03syn\x18\x01 \x01(\x08\x12\x0b\n\x03\x66in\x18\x02 \x01(\x08\x12\x17\n\x0fsequence_number\x18\x03 \x01(\x04\x12\x16\n\x0emore_fragments\x18\x04 \x01(\x04\x12\x0b\n\x03\x61\x63k\x18\x05 \x01(\x04\x12\x0f\n\x07payload\x18\x06 \x01(\x0c\x12\x0f\n\x07\x64\x65st_ip\x18\x07 \x02(\t\x12\x11\n\tdest_port\x18\x08 \x02(\r\x12\x11\n\tsource_ip\x18\t \x02(\t\x12\x13\n\x0bsource_port\x18\n \x02(\rB\x02H\x03')
+  serialized_pb='\n\x0cpacket.proto\x12\x06txrudp\"\xbe\x02\n\x06Packet\x12\x0b\n\x03syn\x18\x01 \x01(\x08\x12\x0b\n\x03\x66in\x18\x02 \x01(\x08\x12\x17\n\x0fsequence_number\x18\x03 \x01(\x04\x12\x16\n\x0emore_fragments\x18\x04 \x01(\x04\x12\x0b\n\x03\x61\x63k\x18\x05 \x01(\x04\x12\x0f\n\x07payload\x18\x06 \x01(\x0c\x12\x0f\n\x07\x64\x65st_ip\x18\x07 \x02(\t\x12\x11\n\tdest_port\x18\x08 \x02(\r\x12\x11\n\tsource_ip\x18\t \x02(\t\x12\x13\n\x0bsource_port\x18\n \x02(\r\x12\x11\n\tstream_id\x18\x0b \x01(\r\x12\x13\n\x0bstream_prev\x18\x0c \x01(\x04\x12\x0c\n\x04skip\x18\r \x01(\x04\x12\x11\n\tunordered\x18\x0e \x01(\x08\x12\x0e\n\x06window\x18\x0f \x01(\r\x12\x16\n\x0e\x66ragment_count\x18\x10 \x01(\x04\x12\x0e\n\x06\x63ookie\x18\x11 \x01(\x0c\"Z\n\x0cPacketHeader\x12\x0f\n\x07\x64\x65st_ip\x18\x07 \x02(\t\x12\x11\n\tdest_port\x18\x08 \x02(\r\x12\x11\n\tsource_ip\x18\t \x02(\t\x12\x13\n\x0bsource_port\x18\n \x02(\rB\x02H\x03')
 
 
 
@@ -95,6 +95,55 @@ _PACKET = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       options=None),
+    _descriptor.FieldDescriptor(
+      name='stream_id', full_name='txrudp.Packet.stream_id', index=10,
+      number=11, type=13, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='stream_prev', full_name='txrudp.Packet.stream_prev', index=11,
+      number=12, type=4, cpp_type=4, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='skip', full_name='txrudp.Packet.skip', index=12,
+      number=13, type=4, cpp_type=4, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='unordered', full_name='txrudp.Packet.unordered', index=13,
+      number=14, type=8, cpp_type=7, label=1,
+      has_default_value=False, default_value=False,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='window', full_name='txrudp.Packet.window', index=14,
+      number=15, type=13, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='fragment_count', full_name='txrudp.Packet.fragment_count', index=15,
+      number=16, type=4, cpp_type=4, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='cookie', full_name='txrudp.Packet.cookie', index=16,
+      number=17, type=12, cpp_type=9, label=1,
+      has_default_value=False, default_value="",
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
   ],
   extensions=[
   ],
@@ -105,10 +154,60 @@ _PACKET = _descriptor.Descriptor(
   is_extendable=False,
   extension_ranges=[],
   serialized_start=25,
-  serialized_end=214,
+  serialized_end=343,
+)
+
+
+_PACKETHEADER = _descriptor.Descriptor(
+  name='PacketHeader',
+  full_name='txrudp.PacketHeader',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='dest_ip', full_name='txrudp.PacketHeader.dest_ip', index=0,
+      number=7, type=9, cpp_type=9, label=2,
+      has_default_value=False, default_value=unicode("", "utf-8"),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='dest_port', full_name='txrudp.PacketHeader.dest_port', index=1,
+      number=8, type=13, cpp_type=3, label=2,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='source_ip', full_name='txrudp.PacketHeader.source_ip', index=2,
+      number=9, type=9, cpp_type=9, label=2,
+      has_default_value=False, default_value=unicode("", "utf-8"),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='source_port', full_name='txrudp.PacketHeader.source_port', index=3,
+      number=10, type=13, cpp_type=3, label=2,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  options=None,
+  is_extendable=False,
+  extension_ranges=[],
+  serialized_start=345,
+  serialized_end=435,
 )
 
 DESCRIPTOR.message_types_by_name['Packet'] = _PACKET
+DESCRIPTOR.message_types_by_name['PacketHeader'] = _PACKETHEADER
 
 class Packet(_message.Message):
   __metaclass__ = _reflection.GeneratedProtocolMessageType
@@ -116,6 +215,12 @@ class Packet(_message.Message):
 
   # @@protoc_insertion_point(class_scope:txrudp.Packet)
 
+class PacketHeader(_message.Message):
+  __metaclass__ = _reflection.GeneratedProtocolMessageType
+  DESCRIPTOR = _PACKETHEADER
+
+  # @@protoc_insertion_point(class_scope:txrudp.PacketHeader)
+
 
 DESCRIPTOR.has_options = True
 DESCRIPTOR._options = _descriptor._ParseOptions(descriptor_pb2.FileOptions(), 'H\003')
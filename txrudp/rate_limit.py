@@ -0,0 +1,107 @@
+"""Token-bucket rate limiter for keyed events, e.g. inbound packets."""
+
+import collections
+
+from txrudp import constants
+
+
+class RateLimiter(collections.Sized):
+
+    """
+    A token bucket per key, e.g. per source address.
+
+    Each bucket holds `burst` tokens and refills at `rate` tokens per
+    second; an event is allowed if it can take its tokens (one, unless
+    events are weighted, e.g. by their size in bytes). The state of
+    a bucket is a single float, following the generic cell rate
+    algorithm (GCRA): the time at which the bucket will be full again.
+    Buckets that have refilled are indistinguishable from new ones and
+    are forgotten, so that only keys active in the last
+    `burst / rate` seconds (or so) take up memory.
+
+    At most `max_keys` keys are tracked, however many sources (e.g.
+    spoofed ones) show up between prunes: a new key beyond that forces
+    an early prune, at most once between regular prunes, so that keys
+    that keep changing cannot make each event pay for one. New keys
+    for which no room is left share a single overflow bucket until
+    the next regular prune.
+    """
+
+    # The key of the overflow bucket.
+    _OVERFLOW = object()
+
+    def __init__(
+        self,
+        rate,
+        burst,
+        max_keys=constants.RATE_LIMIT_MAX_KEYS
+    ):
+        """
+        Create a new RateLimiter.
+
+        Args:
+            rate: The sustained number of events allowed per second
+                and key, as a positive number.
+            burst: The number of events allowed at once per key, as
+                a positive integer.
+            max_keys: The number of keys tracked at most, as a
+                positive integer.
+        """
+        self._interval = 1.0 / rate
+        self._capacity = burst * self._interval
+        self._max_keys = max_keys
+        self._full_at = {}
+        self._next_prune = 0
+        self._may_prune_early = False
+
+    def __len__(self):
+        """Return the number of keys whose bucket is not full."""
+        return len(self._full_at)
+
+    def allow(self, key, now, cost=1):
+        """
+        Take tokens from the bucket of a key, if there are enough.
+
+        Args:
+            key: The key, as a hashable object.
+            now: The current time, in seconds.
+            cost: The number of tokens the event takes; an event
+                costing more than `burst` tokens is never allowed.
+
+        Returns:
+            True if the event is allowed, False if it should be dropped.
+        """
+        if now >= self._next_prune:
+            self._prune(now)
+            self._may_prune_early = True
+        if key not in self._full_at and len(self._full_at) >= self._max_keys:
+            # Prune early, but only once between regular prunes.
+            if self._may_prune_early:
+                self._prune(now)
+                self._may_prune_early = False
+            if len(self._full_at) >= self._max_keys:
+                key = self._OVERFLOW
+
+        increment = cost * self._interval
+        full_at = max(self._full_at.get(key, now), now)
+        if full_at - now > self._capacity - increment:
+            return False
+        self._full_at[key] = full_at + increment
+        return True
+
+    def _prune(self, now):
+        """
+        Forget the buckets that have refilled.
+
+        Args:
+            now: The current time, in seconds.
+        """
+        self._full_at = dict(
+            (key, full_at)
+            for key, full_at in self._full_at.iteritems()
+            if full_at > now
+        )
+        self._next_prune = now + max(
+            self._capacity,
+            constants.RATE_LIMIT_PRUNE_INTERVAL
+        )
@@ -1,11 +1,35 @@
 """Reliable UDP implementation using Twisted."""
 
 import collections
+import enum
+import hashlib
+import hmac
+import os
+import struct
 
 from google.protobuf import message
-from twisted.internet import protocol
+from twisted.internet import protocol, reactor
 
-from txrudp import packet
+from txrudp import constants, ip_filter, packet
+
+
+REACTOR = reactor
+
+DropReason = enum.Enum(
+    'DropReason',
+    (
+        'SOURCE_RATE',
+        'ADDRESS_RATE',
+        'NEW_CONNECTION_RATE',
+        'RELAY_FLOW_QUOTA',
+        'RELAY_SOURCE_QUOTA'
+    )
+)
+
+# A SYN cookie is the time it was issued, in seconds, followed by
+# a truncated HMAC.
+_COOKIE_TIME = struct.Struct('>I')
+_COOKIE_MAC_SIZE = 16
 
 
 class ConnectionMultiplexer(
@@ -19,12 +43,34 @@ class ConnectionMultiplexer(
     Handles graceful shutdown of active connections.
     """
 
+    class RelayStats(object):
+
+        """The traffic relayed from a source to a destination."""
+
+        def __init__(self):
+            """
+            Create new (zero) relay statistics.
+
+            Packets dropped for exceeding a relay quota are counted
+            apart from those relayed.
+            """
+            self.packets = 0
+            self.bytes = 0
+            self.dropped_packets = 0
+            self.dropped_bytes = 0
+
     def __init__(
         self,
         connection_factory,
         public_ip,
         relaying=False,
-        logger=None
+        logger=None,
+        syn_cookies=False,
+        source_limiter=None,
+        address_limiter=None,
+        new_connection_limiter=None,
+        relay_flow_limiter=None,
+        relay_source_limiter=None
     ):
         """
         Initialize a new multiplexer.
@@ -41,6 +87,38 @@ class ConnectionMultiplexer(
                 If False, this node will drop such messages.
             logger: A logging.Logger instance to dump invalid received
                 packets into; if None, dumping is disabled.
+            syn_cookies: If True, a SYN packet from an unknown
+                address is answered with a SYN cookie; a connection
+                is only created once a SYN echoing a valid cookie
+                arrives, which proves the sender can receive at the
+                address it claims.
+            source_limiter: A rate_limit.RateLimiter for the packets
+                received from each IP, or None for no limit.
+            address_limiter: A rate_limit.RateLimiter for the packets
+                received from each (ip, port) address, i.e. from each
+                connection, unless it is relayed; or None for no limit.
+            new_connection_limiter: A rate_limit.RateLimiter for the
+                connections created for each IP, or None for no limit.
+            relay_flow_limiter: A rate_limit.RateLimiter for the bytes
+                relayed in each flow, or None for no quota.
+            relay_source_limiter: A rate_limit.RateLimiter for the
+                bytes relayed from each sender IP, or None for no quota.
+
+        While relaying, a flow is the traffic that one sender address
+        relays from a source address to a destination address; the
+        sender is the address datagrams arrive from, since the source
+        address of a packet costs nothing to forge. The traffic of each
+        flow is counted in `relay_stats`, as RelayStats keyed by
+        (sender, source, destination), for the RELAY_STATS_SIZE most
+        recently active flows; it is an OrderedDict, least recently
+        active flow first. The relay quotas keep a heavy flow, or a
+        sender with many flows, from taking up all of the relay's
+        bandwidth; the datagrams beyond them are dropped.
+
+        Limits apply to the address a datagram arrives from, which is
+        the relay of relayed packets; packets beyond a limit are
+        dropped (before parsing, except for new connections) and
+        counted in `dropped_packets`, by DropReason.
         """
         super(ConnectionMultiplexer, self).__init__()
         self.connection_factory = connection_factory
@@ -48,8 +126,21 @@ class ConnectionMultiplexer(
         self.port = None
         self.relaying = relaying
         self._active_connections = {}
-        self._banned_ips = set()
+        self._ip_filter = ip_filter.IPFilter()
         self._logger = logger
+        self._source_limiter = source_limiter
+        self._address_limiter = address_limiter
+        self._new_connection_limiter = new_connection_limiter
+        self._relay_flow_limiter = relay_flow_limiter
+        self._relay_source_limiter = relay_source_limiter
+        self.dropped_packets = collections.Counter()
+        self.relay_stats = collections.OrderedDict()
+        # Whether packets are relayed, per (source, destination) pair.
+        self._relay_routes = {}
+        if syn_cookies:
+            self._cookie_secret = os.urandom(32)
+        else:
+            self._cookie_secret = None
 
     def startProtocol(self):
         """Start the protocol and cache listening port."""
@@ -106,28 +197,73 @@ class ConnectionMultiplexer(
 
     def ban_ip(self, ip_address):
         """
-        Add an IP address to the ban list. No connections will be
-        made to this IP and packets will be dropped.
+        Ban an IP address or network. No connections will be made
+        to its IPs and packets will be dropped, unless they are
+        allowed by a rule on a smaller network.
 
         Args:
-            ip_address: a `String` IP address (without port).
+            ip_address: a `String` IP address (without port), or
+                network in CIDR notation (e.g. '10.1.0.0/16').
+
+        Raises:
+            ValueError: The address is invalid.
         """
-        self._banned_ips.add(ip_address)
+        self._ip_filter.ban(ip_address)
+        self._relay_routes.clear()
+
+    def allow_ip(self, ip_address):
+        """
+        Allow an IP address or network within a banned network.
+
+        Args:
+            ip_address: a `String` IP address (without port), or
+                network in CIDR notation (e.g. '10.1.2.0/24').
+
+        Raises:
+            ValueError: The address is invalid.
+        """
+        self._ip_filter.allow(ip_address)
+        self._relay_routes.clear()
 
     def remove_ip_ban(self, ip_address):
         """
-        Remove an IP address from the ban list.
+        Remove the ban (or allow) rule on an IP address or network.
 
         Args:
-            ip_address: a `String` IP address (without port).
+            ip_address: a `String` IP address (without port), or
+                network in CIDR notation.
+
+        Raises:
+            ValueError: The address is invalid.
         """
-        self._banned_ips.discard(ip_address)
+        self._ip_filter.remove(ip_address)
+        self._relay_routes.clear()
+
+    def relay_stats_by_source(self):
+        """
+        Sum up the relay statistics of each sender IP.
+
+        Returns:
+            A dict mapping the IP each relayed datagram arrived from
+            to its RelayStats.
+        """
+        by_source = {}
+        for (addr, _, _), stats in self.relay_stats.iteritems():
+            total = by_source.get(addr[0])
+            if total is None:
+                total = by_source[addr[0]] = self.RelayStats()
+            total.packets += stats.packets
+            total.bytes += stats.bytes
+            total.dropped_packets += stats.dropped_packets
+            total.dropped_bytes += stats.dropped_bytes
+        return by_source
 
     def datagramReceived(self, datagram, addr):
         """
         Called when a datagram is received.
 
-        If the datagram isn't meant for us, immediately relay it.
+        If the datagram isn't meant for us, immediately relay it;
+        while relaying, only its addresses are decoded to tell.
         Otherwise, delegate handling to the appropriate connection.
         If no such connection exists, create one. Always take care
         to avoid mistaking a relay address for the original sender's
@@ -141,6 +277,26 @@ class ConnectionMultiplexer(
                 is being relayed; future outbound packets should also
                 be relayed through the specified relay address.
         """
+        if self._ip_filter and self._ip_filter.is_banned(addr[0]):
+            return
+        if not self._allow_datagram(addr):
+            return
+
+        if self.relaying:
+            try:
+                dest_addr, source_addr = packet.peek_addrs(datagram)
+            except (message.DecodeError, TypeError, ValueError):
+                pass  # Left for the full decoding to log.
+            else:
+                if dest_addr[0] != self.public_ip:
+                    self._relay_datagram(
+                        datagram,
+                        addr,
+                        dest_addr,
+                        source_addr
+                    )
+                    return
+
         try:
             rudp_packet = packet.Packet.from_bytes(datagram)
         except (message.DecodeError, TypeError, ValueError):
@@ -154,15 +310,31 @@ class ConnectionMultiplexer(
                     'Bad packet (invalid RUDP packet): {0}'.format(datagram)
                 )
         else:
-            if (addr[0] in self._banned_ips or
-               rudp_packet.source_addr[0] in self._banned_ips):
+            if self._is_banned(rudp_packet.source_addr[0]):
                 return
             if rudp_packet.dest_addr[0] != self.public_ip:
                 if self.relaying:
-                    self.transport.write(datagram, rudp_packet.dest_addr)
+                    self._relay_datagram(
+                        datagram,
+                        addr,
+                        rudp_packet.dest_addr,
+                        rudp_packet.source_addr
+                    )
             else:
                 con = self._active_connections.get(rudp_packet.source_addr)
                 if con is None and rudp_packet.get_syn():
+                    if (
+                        self._cookie_secret is not None and
+                        not self._check_syn_cookie(rudp_packet, addr)
+                    ):
+                        self._send_syn_cookie(rudp_packet, addr)
+                        return
+                    if not self._allow(
+                        self._new_connection_limiter,
+                        addr[0],
+                        DropReason.NEW_CONNECTION_RATE
+                    ):
+                        return
                     con = self.make_new_connection(
                         (self.public_ip, self.port),
                         rudp_packet.source_addr,
@@ -171,6 +343,219 @@ class ConnectionMultiplexer(
                 if con is not None:
                     con.receive_packet(rudp_packet, addr)
 
+    def _relay_datagram(self, datagram, addr, dest_addr, source_addr):
+        """
+        Forward a datagram meant for another node.
+
+        Whether the datagram may be relayed only depends on its
+        source and destination addresses, so the decision is cached
+        per (source, destination) pair; the cache is cleared when it
+        grows beyond RELAY_ROUTE_CACHE_SIZE pairs or ban rules change.
+        Relay quotas are then checked for every datagram, per flow
+        and per sender IP.
+
+        Args:
+            datagram: Datagram string received from transport layer.
+            addr: The sender address, i.e. the address the datagram
+                arrived from.
+            dest_addr: The destination address of the packet.
+            source_addr: The source address of the packet.
+        """
+        route = (source_addr, dest_addr)
+        relayed = self._relay_routes.get(route)
+        if relayed is None:
+            relayed = self._check_relay_route(dest_addr, source_addr)
+            if len(self._relay_routes) >= constants.RELAY_ROUTE_CACHE_SIZE:
+                self._relay_routes.clear()
+            self._relay_routes[route] = relayed
+        if not relayed:
+            return
+
+        # Forged addresses cost the sender nothing, so statistics
+        # are only kept for the most recently active flows.
+        flow = (addr, source_addr, dest_addr)
+        stats = self.relay_stats.pop(flow, None)
+        if stats is None:
+            stats = self.RelayStats()
+            if len(self.relay_stats) >= constants.RELAY_STATS_SIZE:
+                self.relay_stats.popitem(last=False)
+        self.relay_stats[flow] = stats
+        size = len(datagram)
+        if not (
+            self._allow(
+                self._relay_flow_limiter,
+                flow,
+                DropReason.RELAY_FLOW_QUOTA,
+                size
+            ) and
+            self._allow(
+                self._relay_source_limiter,
+                addr[0],
+                DropReason.RELAY_SOURCE_QUOTA,
+                size
+            )
+        ):
+            stats.dropped_packets += 1
+            stats.dropped_bytes += size
+            return
+
+        stats.packets += 1
+        stats.bytes += size
+        self.transport.write(datagram, dest_addr)
+
+    def _check_relay_route(self, dest_addr, source_addr):
+        """
+        Check whether packets may be relayed between two addresses.
+
+        Args:
+            dest_addr: The destination address of the packets.
+            source_addr: The source address of the packets.
+
+        Returns:
+            True if both addresses are valid and the source is not
+            banned, False otherwise.
+        """
+        try:
+            packet.Packet.validate_addrs(dest_addr, source_addr)
+        except packet.ValidationError:
+            return False
+        return not self._is_banned(source_addr[0])
+
+    def _is_banned(self, ip):
+        """
+        Check an IP address taken from a packet against the ban rules.
+
+        Args:
+            ip: The IP address, as a string.
+
+        Returns:
+            True if the address is banned, or cannot be parsed as an
+            IP address; False otherwise.
+        """
+        if not self._ip_filter:
+            return False
+        try:
+            return self._ip_filter.is_banned(ip)
+        except ValueError:
+            return True
+
+    def _allow_datagram(self, addr):
+        """
+        Check the datagram rate limits of the address a datagram
+        arrives from.
+
+        Args:
+            addr: The address the datagram arrived from.
+
+        Returns:
+            True if the datagram is allowed, False if it was dropped.
+        """
+        if not self._allow(
+            self._source_limiter,
+            addr[0],
+            DropReason.SOURCE_RATE
+        ):
+            return False
+        return self._allow(
+            self._address_limiter,
+            addr,
+            DropReason.ADDRESS_RATE
+        )
+
+    def _allow(self, limiter, key, reason, cost=1):
+        """
+        Take tokens from a rate limiter, counting the drop if none.
+
+        Args:
+            limiter: A rate_limit.RateLimiter, or None for no limit.
+            key: The key of the limiter's bucket.
+            reason: The DropReason to count if the event is dropped.
+            cost: The number of tokens the event takes.
+
+        Returns:
+            True if the event is allowed, False if it was dropped.
+        """
+        if limiter is None or limiter.allow(key, REACTOR.seconds(), cost):
+            return True
+        self.dropped_packets[reason] += 1
+        return False
+
+    def _make_syn_cookie(self, rudp_packet, addr, issued_at):
+        """
+        Compute the SYN cookie for a SYN packet.
+
+        The cookie binds the source address and sequence number of
+        the packet and the address it arrived from.
+
+        Args:
+            rudp_packet: A packet.Packet with SYN flag set.
+            addr: The address the packet arrived from.
+            issued_at: The time the cookie is issued, in whole seconds.
+
+        Returns:
+            The cookie, as bytes.
+        """
+        time_bytes = _COOKIE_TIME.pack(issued_at)
+        mac = hmac.new(
+            self._cookie_secret,
+            '{0}|{1}|{2}|{3}|{4}|{5}'.format(
+                time_bytes,
+                rudp_packet.source_addr[0],
+                rudp_packet.source_addr[1],
+                addr[0],
+                addr[1],
+                rudp_packet.sequence_number
+            ),
+            hashlib.sha256
+        )
+        return time_bytes + mac.digest()[:_COOKIE_MAC_SIZE]
+
+    def _check_syn_cookie(self, rudp_packet, addr):
+        """
+        Check whether a SYN packet echoes a valid, recent cookie.
+
+        Args:
+            rudp_packet: A packet.Packet with SYN flag set.
+            addr: The address the packet arrived from.
+        """
+        cookie = rudp_packet.cookie
+        if len(cookie) != _COOKIE_TIME.size + _COOKIE_MAC_SIZE:
+            return False
+
+        issued_at, = _COOKIE_TIME.unpack(cookie[:_COOKIE_TIME.size])
+        age = int(REACTOR.seconds()) - issued_at
+        if not 0 <= age <= constants.SYN_COOKIE_LIFETIME:
+            return False
+        return hmac.compare_digest(
+            cookie,
+            self._make_syn_cookie(rudp_packet, addr, issued_at)
+        )
+
+    def _send_syn_cookie(self, rudp_packet, addr):
+        """
+        Answer a SYN packet with a SYN cookie, keeping no state.
+
+        The answer is a bare packet acknowledging the SYN packet;
+        the sender is expected to send its SYN packet again, with
+        the cookie.
+
+        Args:
+            rudp_packet: A packet.Packet with SYN flag set.
+            addr: The address the packet arrived from.
+        """
+        cookie_packet = packet.Packet.from_data(
+            0,
+            rudp_packet.source_addr,
+            (self.public_ip, self.port),
+            ack=rudp_packet.sequence_number + 1,
+            cookie=self._make_syn_cookie(
+                rudp_packet,
+                addr,
+                int(REACTOR.seconds())
+            )
+        )
+        self.transport.write(cookie_packet.to_bytes(), addr)
+
     def make_new_connection(self, own_addr, source_addr, relay_addr=None):
         """
         Create a new connection to handle the given address.
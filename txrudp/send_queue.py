@@ -0,0 +1,159 @@
+"""Priority queue used as send buffer for outbound messages."""
+
+import collections
+
+
+class SendQueue(collections.Sized):
+
+    """
+    A FIFO queue of outbound messages per priority level.
+
+    Segments are dequeued from the highest-priority level that holds
+    a message; level 0 has the highest priority. The fragments of a
+    message must occupy consecutive sequence numbers, so the queue
+    only switches levels at message boundaries.
+
+    To prevent starvation, every message dequeued from a level counts
+    as a skip for every lower, non-empty level; once a level has been
+    skipped `starvation_limit` times, its next message goes first.
+
+    Messages are objects with two attributes: `segments`, an iterator
+    over segment tuples whose first element is the number of remaining
+    segments, and `deadline`, the time after which the message should
+    be dropped if none of it has been dequeued, or None.
+    """
+
+    def __init__(self, levels, starvation_limit):
+        """
+        Create a new (empty) SendQueue.
+
+        Args:
+            levels: The number of priority levels, as an integer.
+            starvation_limit: The number of messages that may overtake
+                a waiting message, as an integer.
+        """
+        self._queues = tuple(collections.deque() for _ in range(levels))
+        self._skips = [0] * levels
+        self._starvation_limit = starvation_limit
+        self._current = None
+        self._len = 0
+
+    def __len__(self):
+        """Return the number of queued (or partially sent) messages."""
+        return self._len
+
+    def push(self, message, level):
+        """
+        Enqueue a message.
+
+        Args:
+            message: The message, as described above.
+            level: The priority level of the message, as an integer.
+        """
+        self._queues[level].append(message)
+        self._len += 1
+
+    def remove(self, message):
+        """
+        Withdraw a message none of which has been dequeued.
+
+        Args:
+            message: The message to withdraw.
+
+        Returns:
+            True if the message was withdrawn, False if it has already
+            been (partially) dequeued.
+        """
+        for level, queue in enumerate(self._queues):
+            if level == self._current and queue[0] is message:
+                return False
+            try:
+                queue.remove(message)
+            except ValueError:
+                continue
+            self._len -= 1
+            return True
+        return False
+
+    def clear(self):
+        """
+        Remove all messages, including any partially dequeued one.
+
+        Returns:
+            A list of the removed messages.
+        """
+        removed = [message for queue in self._queues for message in queue]
+        for queue in self._queues:
+            queue.clear()
+        self._current = None
+        self._len = 0
+        return removed
+
+    def drop_expired(self, now):
+        """
+        Drop messages at the front of each level past their deadline.
+
+        Expired messages further back are dropped once they reach
+        the front, still before any of their segments is dequeued;
+        this keeps the cost proportional to the number of messages
+        dropped.
+
+        Args:
+            now: The current time.
+
+        Returns:
+            A list of the dropped messages.
+        """
+        dropped = []
+        for level, queue in enumerate(self._queues):
+            start = 1 if level == self._current else 0
+            while len(queue) > start:
+                message = queue[start]
+                if message.deadline is None or message.deadline > now:
+                    break
+                del queue[start]
+                dropped.append(message)
+        self._len -= len(dropped)
+        return dropped
+
+    def popleft(self):
+        """
+        Dequeue the next segment.
+
+        Returns:
+            A tuple of the message and its next segment tuple.
+
+        Raises:
+            IndexError: The queue is empty.
+        """
+        if self._current is None:
+            self._current = self._select_level()
+        message = self._queues[self._current][0]
+        segment = next(message.segments)
+        if not segment[0]:
+            self._queues[self._current].popleft()
+            self._current = None
+            self._len -= 1
+        return message, segment
+
+    def _select_level(self):
+        """
+        Select the level from which the next message is dequeued.
+
+        Raises:
+            IndexError: The queue is empty.
+        """
+        waiting = [level for level, q in enumerate(self._queues) if q]
+        if not waiting:
+            raise IndexError('pop from an empty SendQueue')
+
+        selected = waiting[0]
+        starved = max(waiting, key=self._skips.__getitem__)
+        if self._skips[starved] >= self._starvation_limit:
+            selected = starved
+
+        for level in waiting:
+            if level > selected:
+                self._skips[level] += 1
+        self._skips[selected] = 0
+        return selected
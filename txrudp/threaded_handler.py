@@ -0,0 +1,144 @@
+"""
+Handler running the callbacks of another handler on a thread pool.
+
+Classes:
+    ThreadedHandler: Handler forwarding its callbacks to a thread pool.
+"""
+
+import collections
+
+from twisted.internet import defer, reactor, threads
+from twisted.python import log
+
+from txrudp import connection, constants
+
+
+REACTOR = reactor
+
+
+class ThreadedHandler(connection.Handler):
+
+    """
+    A handler running the callbacks of another handler on a thread pool.
+
+    The wrapped handler may then block (e.g. on a database write)
+    without stalling the reactor, and thus ACKs, retransmissions and
+    all other connections. Callbacks of the same connection still run
+    one at a time, in order; callbacks of different connections run
+    in parallel, up to the size of the pool, which may be shared.
+
+    Once more than `max_pending` callbacks of the connection are
+    pending, delivery on the connection is paused, closing its receive
+    window; it is resumed once at most half as many are left, unless
+    the connection has been shutdown meanwhile.
+
+    Only `receive_message`, `receive_stream_message` and
+    `handle_shutdown` are forwarded. A Connection is not thread-safe:
+    the message callbacks, which run on the pool, must not call it
+    directly, but through `reactor.callFromThread` (e.g. to send a
+    reply or shutdown the connection). `handle_shutdown` runs on the
+    reactor thread, once every callback before it has returned, so it
+    may call the connection (e.g. `unregister`) as usual.
+    """
+
+    def __init__(
+        self,
+        handler,
+        threadpool,
+        max_pending=constants.MAX_PENDING_CALLBACKS
+    ):
+        """
+        Create a new ThreadedHandler.
+
+        Args:
+            handler: The wrapped connection.Handler.
+            threadpool: A started twisted.python.threadpool.ThreadPool.
+            max_pending: The number of callbacks that may be pending
+                (running or waiting) before delivery is paused.
+        """
+        self.handler = handler
+        self._threadpool = threadpool
+        self._max_pending = max_pending
+        self._pending = collections.deque()
+        self._paused = False
+
+    @property
+    def connection(self):
+        """Get the connection of the wrapped handler."""
+        return self.handler.connection
+
+    @connection.setter
+    def connection(self, value):
+        """Set the connection of the wrapped handler."""
+        self.handler.connection = value
+
+    def receive_message(self, message):
+        """
+        Run `receive_message` of the wrapped handler.
+
+        Args:
+            message: The payload of a Packet, as a string.
+        """
+        self._dispatch(self.handler.receive_message, message)
+
+    def receive_stream_message(self, stream, message):
+        """
+        Run `receive_stream_message` of the wrapped handler.
+
+        Args:
+            stream: The stream of the message, as a positive integer.
+            message: The payload of a Packet, as a string.
+        """
+        self._dispatch(self.handler.receive_stream_message, stream, message)
+
+    def handle_shutdown(self):
+        """
+        Run `handle_shutdown` of the wrapped handler.
+
+        It runs on the reactor thread, after the pending callbacks.
+        """
+        self._dispatch(self.handler.handle_shutdown, in_thread=False)
+
+    def _dispatch(self, f, *args, **kwargs):
+        """
+        Queue a callback behind those of the same connection.
+
+        Args:
+            f: The callback.
+            args: Positional arguments of the callback.
+            in_thread: Whether the callback runs on the thread pool
+                (the default) or on the reactor thread.
+        """
+        self._pending.append((f, args, kwargs.get('in_thread', True)))
+        if len(self._pending) == 1:
+            self._run_next()
+        elif len(self._pending) > self._max_pending and not self._paused:
+            if self.connection is not None:
+                self._paused = True
+                self.connection.pauseProducing()
+
+    def _run_next(self):
+        """Run the oldest pending callback, on the thread pool or not."""
+        f, args, in_thread = self._pending[0]
+        if in_thread:
+            d = threads.deferToThreadPool(
+                REACTOR,
+                self._threadpool,
+                f,
+                *args
+            )
+        else:
+            d = defer.maybeDeferred(f, *args)
+        d.addErrback(log.err, 'Handler callback failed.')
+        d.addCallback(self._callback_done)
+
+    def _callback_done(self, _):
+        """Move on to the next pending callback, if any."""
+        self._pending.popleft()
+        if self._paused and len(self._pending) <= self._max_pending // 2:
+            self._paused = False
+            # The connection may have been shutdown meanwhile.
+            if self.connection.state != connection.State.SHUTDOWN:
+                self.connection.resumeProducing()
+        if self._pending:
+            self._run_next()